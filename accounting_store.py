@@ -0,0 +1,553 @@
+"""
+Accounting queries and writes used by the GUI.
+
+Every function takes an open connection as its first argument and touches no
+Tk state, so the GUI can run them on its database worker thread (see
+db_worker.py). Write functions do not commit; the worker commits the whole
+task as one transaction.
+"""
+
+from archive import CARRY_FORWARD_PERIOD
+from ledger import ENTRY_ADJUSTMENT, ENTRY_INDEBTEDNESS, ENTRY_PAYMENT, record_entry
+from payment_allocations import (
+    first_affected_invoice, get_invoice_payments, invoice_key, reallocate
+)
+
+def get_dashboard_stats(conn):
+    """Totals, last backup date and recent payments for the dashboard"""
+    # Totals are kept current by triggers (see database._add_dashboard_summary)
+    total_admins, total_earned, total_paid, last_backup = conn.execute("""
+        SELECT total_admins, total_earned, total_paid, last_backup
+        FROM dashboard_summary WHERE id = 1
+    """).fetchone()
+
+    # Get recent payments (the newest 20 rows of idx_payments_date)
+    recent_activity = conn.execute('''
+        SELECT p.payment_date, a.name, 'Payment', p.amount
+        FROM payments p
+        JOIN admin_accounts a ON p.admin_uuid = a.uuid
+        ORDER BY p.payment_date DESC
+        LIMIT 20
+    ''').fetchall()
+
+    return {
+        'total_admins': total_admins,
+        'total_earned': total_earned or 0,
+        'total_paid': total_paid or 0,
+        'last_backup': last_backup,
+        'recent_activity': recent_activity,
+    }
+
+def list_active_admins(conn):
+    """(uuid, name, fa_number, total_earned, total_paid) for active admins, ordered by name"""
+    return conn.execute('''
+        SELECT uuid, name, fa_number, total_earned, total_paid
+        FROM admin_accounts
+        WHERE status = 'active' OR status IS NULL
+        ORDER BY name
+    ''').fetchall()
+
+def list_all_admins(conn):
+    """(uuid, name, fa_number, total_earned, total_paid) for every admin, ordered by name"""
+    return conn.execute('''
+        SELECT uuid, name, fa_number, total_earned, total_paid
+        FROM admin_accounts
+        ORDER BY name
+    ''').fetchall()
+
+def get_admin(conn, admin_uuid):
+    """(uuid, name, fa_number, total_earned, total_paid) for an admin, or None"""
+    return conn.execute("""
+        SELECT uuid, name, fa_number, total_earned, total_paid
+        FROM admin_accounts WHERE uuid = ?
+    """, (admin_uuid,)).fetchone()
+
+def get_outstanding_report(conn):
+    """
+    Who owes what: (uuid, name, fa_number, unpaid_invoices, outstanding,
+    oldest_unpaid_date) for every admin with unpaid invoices, largest debt
+    first, from the invoice_status view in one query.
+    """
+    return conn.execute("""
+        SELECT s.admin_uuid, COALESCE(a.name, s.admin_uuid), a.fa_number,
+               COUNT(*) AS unpaid_invoices, SUM(s.outstanding) AS outstanding, MIN(s.addition_date)
+        FROM invoice_status s
+        LEFT JOIN admin_accounts a ON a.uuid = s.admin_uuid
+        WHERE NOT s.paid
+        GROUP BY s.admin_uuid
+        ORDER BY outstanding DESC
+    """).fetchall()
+
+# Rows per history page on the admin detail page
+HISTORY_PAGE_SIZE = 100
+
+def _keyset(date_column, before):
+    """WHERE clause continuing a newest-first (date, id) history after the row before, and its parameters"""
+    if before is None:
+        return "", ()
+    return f"AND ({date_column}, id) < (?, ?)", tuple(before)
+
+def _invoice_page_sql(admin_uuid, include_archive, before, limit):
+    """SELECT (and parameters) for one page of get_invoice_history"""
+    after_clause, after_params = _keyset('addition_date', before)
+    if not include_archive:
+        return f"""
+            SELECT id, addition_date, amount, invoice_period_start, invoice_period_end,
+                   NOT EXISTS (SELECT 1 FROM payment_allocations pa
+                               WHERE pa.invoice_id = i.id AND pa.payment_id IS NULL) AS paid,
+                   0 AS archived
+            FROM main.invoice_additions i
+            WHERE admin_uuid = ? {after_clause}
+            ORDER BY addition_date DESC, id DESC
+            LIMIT ?
+        """, (admin_uuid, *after_params, limit)
+
+    return f"""
+        SELECT id, addition_date, amount, invoice_period_start, invoice_period_end,
+               archived OR NOT unpaid AS paid, archived
+        FROM (
+            SELECT id, addition_date, amount, invoice_period_start, invoice_period_end,
+                   EXISTS (SELECT 1 FROM payment_allocations pa
+                           WHERE pa.invoice_id = i.id AND pa.payment_id IS NULL) AS unpaid,
+                   id IN (SELECT id FROM archive.invoice_additions) AS archived
+            FROM main.invoice_additions i
+            WHERE admin_uuid = ? AND invoice_period_start IS NOT ? {after_clause}
+            UNION ALL
+            SELECT id, addition_date, amount, invoice_period_start, invoice_period_end, 0, 1
+            FROM archive.invoice_additions
+            WHERE admin_uuid = ? AND invoice_period_start IS NOT ? {after_clause}
+              AND id NOT IN (SELECT id FROM main.invoice_additions)
+        )
+        ORDER BY addition_date DESC, id DESC
+        LIMIT ?
+    """, (admin_uuid, CARRY_FORWARD_PERIOD, *after_params,
+          admin_uuid, CARRY_FORWARD_PERIOD, *after_params, limit)
+
+def _payment_page_sql(admin_uuid, include_archive, before, limit):
+    """SELECT (and parameters) for one page of get_payment_history"""
+    after_clause, after_params = _keyset('payment_date', before)
+    if not include_archive:
+        return f"""
+            SELECT id, payment_date, amount, 0 AS archived
+            FROM main.payments
+            WHERE admin_uuid = ? {after_clause}
+            ORDER BY payment_date DESC, id DESC
+            LIMIT ?
+        """, (admin_uuid, *after_params, limit)
+
+    return f"""
+        SELECT id, payment_date, amount, id IN (SELECT id FROM archive.payments) AS archived
+        FROM main.payments
+        WHERE admin_uuid = ? {after_clause}
+        UNION ALL
+        SELECT id, payment_date, amount, 1 FROM archive.payments
+        WHERE admin_uuid = ? {after_clause} AND id NOT IN (SELECT id FROM main.payments)
+        ORDER BY payment_date DESC, id DESC
+        LIMIT ?
+    """, (admin_uuid, *after_params, admin_uuid, *after_params, limit)
+
+def _history_totals_sql(admin_uuid, include_archive):
+    """SELECT (and parameters) of invoice_count, invoiced, payment_count, paid for get_history_totals"""
+    if not include_archive:
+        return """
+            SELECT i.n, i.total, p.n, p.total
+            FROM (SELECT COUNT(*) AS n, COALESCE(SUM(amount), 0) AS total
+                  FROM main.invoice_additions WHERE admin_uuid = ?) i,
+                 (SELECT COUNT(*) AS n, COALESCE(SUM(amount), 0) AS total
+                  FROM main.payments WHERE admin_uuid = ?) p
+        """, (admin_uuid, admin_uuid)
+
+    return """
+        WITH invoice_rows AS (
+            SELECT amount FROM main.invoice_additions
+            WHERE admin_uuid = ? AND invoice_period_start IS NOT ?
+            UNION ALL
+            SELECT amount FROM archive.invoice_additions
+            WHERE admin_uuid = ? AND invoice_period_start IS NOT ?
+              AND id NOT IN (SELECT id FROM main.invoice_additions)
+        ), payment_rows AS (
+            SELECT amount FROM main.payments WHERE admin_uuid = ?
+            UNION ALL
+            SELECT amount FROM archive.payments
+            WHERE admin_uuid = ? AND id NOT IN (SELECT id FROM main.payments)
+        )
+        SELECT i.n, i.total, p.n, p.total
+        FROM (SELECT COUNT(*) AS n, COALESCE(SUM(amount), 0) AS total FROM invoice_rows) i,
+             (SELECT COUNT(*) AS n, COALESCE(SUM(amount), 0) AS total FROM payment_rows) p
+    """, (admin_uuid, CARRY_FORWARD_PERIOD, admin_uuid, CARRY_FORWARD_PERIOD, admin_uuid, admin_uuid)
+
+def _totals_dict(row):
+    invoice_count, invoiced, payment_count, paid = row
+    return {'invoice_count': invoice_count, 'invoiced': invoiced, 'payment_count': payment_count, 'paid': paid}
+
+def get_invoice_history(conn, admin_uuid, include_archive=False, before=None, limit=HISTORY_PAGE_SIZE):
+    """
+    One page of the admin's invoice additions, newest first: (id, addition_date,
+    amount, invoice_period_start, invoice_period_end, paid, archived) rows.
+    before is the (addition_date, id) of the last row of the previous page.
+    With include_archive the archived invoices (all paid) replace the
+    carry-forward row that stands in for them.
+    """
+    return conn.execute(*_invoice_page_sql(admin_uuid, include_archive, before, limit)).fetchall()
+
+def get_payment_history(conn, admin_uuid, include_archive=False, before=None, limit=HISTORY_PAGE_SIZE):
+    """
+    One page of the admin's payments, newest first: (id, payment_date, amount,
+    archived) rows. before is the (payment_date, id) of the last row of the
+    previous page.
+    """
+    return conn.execute(*_payment_page_sql(admin_uuid, include_archive, before, limit)).fetchall()
+
+def get_history_totals(conn, admin_uuid, include_archive=False):
+    """Row counts and amount totals of the whole invoice and payment histories"""
+    return _totals_dict(conn.execute(*_history_totals_sql(admin_uuid, include_archive)).fetchone())
+
+def get_admin_detail(conn, admin_uuid, include_archive=False):
+    """
+    Everything the admin detail page shows first, read with one statement: the
+    account, history totals and the newest page of invoices (with paid status)
+    and payments. None if there is no such admin.
+    """
+    invoice_sql, invoice_params = _invoice_page_sql(admin_uuid, include_archive, None, HISTORY_PAGE_SIZE)
+    payment_sql, payment_params = _payment_page_sql(admin_uuid, include_archive, None, HISTORY_PAGE_SIZE)
+    totals_sql, totals_params = _history_totals_sql(admin_uuid, include_archive)
+
+    # One result set of (section, up to 7 values) rows
+    rows = conn.execute(f"""
+        SELECT 0, uuid, name, fa_number, total_earned, total_paid, NULL, NULL
+        FROM admin_accounts WHERE uuid = ?
+        UNION ALL
+        SELECT 1, *, NULL, NULL, NULL FROM ({totals_sql})
+        UNION ALL
+        SELECT 2, * FROM ({invoice_sql})
+        UNION ALL
+        SELECT 3, *, NULL, NULL, NULL FROM ({payment_sql})
+    """, (admin_uuid, *totals_params, *invoice_params, *payment_params)).fetchall()
+
+    sections = {0: [], 1: [], 2: [], 3: []}
+    for row in rows:
+        sections[row[0]].append(row[1:])
+    if not sections[0]:
+        return None
+    # A compound SELECT does not promise to keep its parts' order: sort the
+    # history pages newest first by (date, id) again
+    for section in (2, 3):
+        sections[section].sort(key=lambda row: (row[1], row[0]), reverse=True)
+    return {
+        'admin': sections[0][0][:5],
+        'totals': _totals_dict(sections[1][0][:4]),
+        # The newest page of each history; older pages load as the lists scroll
+        'invoices': sections[2],
+        'payments': [row[:4] for row in sections[3]],
+    }
+
+def record_payment(conn, admin_uuid, amount, payment_date):
+    """Insert a payment, allocate it to unpaid invoices and add it to the admin's total_paid"""
+    payment_id = conn.execute('''
+        INSERT INTO payments (admin_uuid, amount, payment_date, payment_method, reference, notes)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (admin_uuid, amount, payment_date, '', '', '')).lastrowid
+    reallocate(conn, admin_uuid, first_affected_invoice(conn, admin_uuid, payment_date, payment_id), [payment_id])
+    record_entry(conn, admin_uuid, ENTRY_PAYMENT, payment_date, paid=amount,
+                 source_table='payments', source_id=payment_id)
+
+    # Update admin account
+    conn.execute('''
+        UPDATE admin_accounts
+        SET total_paid = total_paid + ?, last_payment_date = ?
+        WHERE uuid = ?
+    ''', (amount, payment_date, admin_uuid))
+
+def add_indebtedness(conn, admin_uuid, amount, addition_date):
+    """Add start-up indebtedness as an invoice record and raise total_earned"""
+    invoice_id = conn.execute('''
+        INSERT INTO invoice_additions (admin_uuid, amount, addition_date, invoice_period_start, invoice_period_end)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (admin_uuid, amount, addition_date, "Start Up Indebtedness", "Start Up Indebtedness")).lastrowid
+    reallocate(conn, admin_uuid, (addition_date, invoice_id))
+    record_entry(conn, admin_uuid, ENTRY_INDEBTEDNESS, addition_date, earned=amount,
+                 source_table='invoice_additions', source_id=invoice_id)
+
+    # Update admin total earned
+    conn.execute('''
+        UPDATE admin_accounts
+        SET total_earned = total_earned + ?
+        WHERE uuid = ?
+    ''', (amount, admin_uuid))
+
+def get_payment(conn, payment_id):
+    """(amount, payment_date, admin_name, admin_uuid) for a payment, or None"""
+    return conn.execute("""
+        SELECT p.amount, p.payment_date, a.name, p.admin_uuid
+        FROM payments p
+        JOIN admin_accounts a ON p.admin_uuid = a.uuid
+        WHERE p.id = ?
+    """, (payment_id,)).fetchone()
+
+def delete_payment(conn, payment_id, amount, admin_uuid):
+    """Delete a payment, re-allocate what it paid for and take it off the admin's total_paid"""
+    payment = conn.execute("SELECT payment_date FROM payments WHERE id = ?", (payment_id,)).fetchone()
+    start = first_affected_invoice(conn, admin_uuid, payment[0], payment_id) if payment else None
+    conn.execute("DELETE FROM payment_allocations WHERE payment_id = ?", (payment_id,))
+    conn.execute("DELETE FROM payments WHERE id = ?", (payment_id,))
+    reallocate(conn, admin_uuid, start)
+    if payment:
+        record_entry(conn, admin_uuid, ENTRY_ADJUSTMENT, payment[0], paid=-amount,
+                     source_table='payments', source_id=payment_id, note="Payment deleted")
+
+    # Update admin's total_paid
+    conn.execute("""
+        UPDATE admin_accounts
+        SET total_paid = total_paid - ?
+        WHERE uuid = ?
+    """, (amount, admin_uuid))
+
+def get_invoice_addition(conn, invoice_id):
+    """(amount, addition_date, period_start, period_end, admin_name, admin_uuid), or None"""
+    return conn.execute("""
+        SELECT ia.amount, ia.addition_date, ia.invoice_period_start, ia.invoice_period_end, a.name, ia.admin_uuid
+        FROM invoice_additions ia
+        JOIN admin_accounts a ON ia.admin_uuid = a.uuid
+        WHERE ia.id = ?
+    """, (invoice_id,)).fetchone()
+
+def is_invoice_paid(conn, invoice_id):
+    """Check if an invoice is paid (green): no part of it is left unallocated"""
+    return conn.execute("""
+        SELECT NOT EXISTS (
+            SELECT 1 FROM payment_allocations WHERE invoice_id = ? AND payment_id IS NULL
+        )
+    """, (invoice_id,)).fetchone()[0] == 1
+
+def calculate_payment_reductions_for_invoice(conn, invoice_id):
+    """Which payment amounts should be reduced when deleting a paid invoice"""
+    return [
+        {
+            'payment_id': payment_id,
+            'amount': amount,
+            'date': payment_date.split()[0] if ' ' in payment_date else payment_date
+        }
+        for payment_id, amount, payment_date in get_invoice_payments(conn, invoice_id)
+    ]
+
+def get_invoice_deletion_info(conn, invoice_id):
+    """Invoice details plus paid status and the payment reductions deleting it would need"""
+    invoice = get_invoice_addition(conn, invoice_id)
+    if not invoice:
+        return None
+
+    is_paid = is_invoice_paid(conn, invoice_id)
+    payment_reductions = calculate_payment_reductions_for_invoice(conn, invoice_id) if is_paid else []
+    return {
+        'invoice': invoice,
+        'is_paid': is_paid,
+        'payment_reductions': payment_reductions,
+    }
+
+def reduce_payment_amounts(conn, payment_reductions, admin_uuid):
+    """Reduce payment amounts based on the calculated reductions"""
+    total_reduction = 0
+
+    for reduction in payment_reductions:
+        payment_id = reduction['payment_id']
+        amount_to_reduce = reduction['amount']
+
+        # Get current payment amount
+        current_amount, payment_date = conn.execute(
+            "SELECT amount, payment_date FROM payments WHERE id = ?", (payment_id,)
+        ).fetchone()
+
+        # Calculate new amount
+        new_amount = current_amount - amount_to_reduce
+
+        if new_amount > 0:
+            # Update payment amount
+            conn.execute("UPDATE payments SET amount = ? WHERE id = ?", (new_amount, payment_id))
+        else:
+            # Delete payment if amount becomes zero or negative
+            conn.execute("DELETE FROM payment_allocations WHERE payment_id = ?", (payment_id,))
+            conn.execute("DELETE FROM payments WHERE id = ?", (payment_id,))
+
+        record_entry(conn, admin_uuid, ENTRY_ADJUSTMENT, payment_date, paid=-amount_to_reduce,
+                     source_table='payments', source_id=payment_id, note="Payment reduced with deleted invoice")
+        total_reduction += amount_to_reduce
+
+    # Update admin's total_paid
+    conn.execute("""
+        UPDATE admin_accounts
+        SET total_paid = total_paid - ?
+        WHERE uuid = ?
+    """, (total_reduction, admin_uuid))
+
+def _check_not_carried_forward(conn, invoice_id):
+    """Refuse to change the carry-forward row that archiving leaves in place of archived invoices"""
+    row = conn.execute("SELECT invoice_period_start FROM invoice_additions WHERE id = ?", (invoice_id,)).fetchone()
+    if row and row[0] == CARRY_FORWARD_PERIOD:
+        raise ValueError("The Carried Forward invoice stands in for archived history and cannot be edited or deleted")
+
+def delete_invoice_addition(conn, invoice_id, amount, admin_uuid, payment_reductions=None):
+    """Delete an invoice addition, lower total_earned and undo the payments that covered it"""
+    _check_not_carried_forward(conn, invoice_id)
+    # Work out what has to be re-allocated while the current allocations still exist
+    start = invoice_key(conn, invoice_id)
+    addition_date = start[0] if start else None
+    payment_ids = []
+    for payment_id, _, payment_date in get_invoice_payments(conn, invoice_id):
+        payment_ids.append(payment_id)
+        if payment_reductions:
+            # Shrinking a payment also moves the money it spent on earlier invoices
+            affected = first_affected_invoice(conn, admin_uuid, payment_date, payment_id)
+            if affected and (start is None or affected < tuple(start)):
+                start = affected
+
+    conn.execute("DELETE FROM payment_allocations WHERE invoice_id = ?", (invoice_id,))
+    conn.execute("DELETE FROM invoice_additions WHERE id = ?", (invoice_id,))
+    if addition_date:
+        record_entry(conn, admin_uuid, ENTRY_ADJUSTMENT, addition_date, earned=-amount,
+                     source_table='invoice_additions', source_id=invoice_id, note="Invoice deleted")
+
+    # Update admin's total_earned
+    conn.execute("""
+        UPDATE admin_accounts
+        SET total_earned = total_earned - ?
+        WHERE uuid = ?
+    """, (amount, admin_uuid))
+
+    # If invoice was paid, reduce corresponding payment amounts
+    if payment_reductions:
+        reduce_payment_amounts(conn, payment_reductions, admin_uuid)
+
+    reallocate(conn, admin_uuid, tuple(start) if start else None, payment_ids)
+
+def update_invoice_addition_amount(conn, invoice_id, admin_uuid, old_amount, new_amount):
+    """Change an invoice addition's amount and move total_earned by the difference"""
+    _check_not_carried_forward(conn, invoice_id)
+    conn.execute("UPDATE invoice_additions SET amount = ? WHERE id = ?", (new_amount, invoice_id))
+    key = invoice_key(conn, invoice_id)
+    reallocate(conn, admin_uuid, key)
+    if key:
+        record_entry(conn, admin_uuid, ENTRY_ADJUSTMENT, key[0], earned=new_amount - old_amount,
+                     source_table='invoice_additions', source_id=invoice_id, note="Invoice amount edited")
+
+    # Update admin's total_earned
+    conn.execute("""
+        UPDATE admin_accounts
+        SET total_earned = total_earned + ?
+        WHERE uuid = ?
+    """, (new_amount - old_amount, admin_uuid))
+
+def list_period_additions(conn, period_start, period_end):
+    """Names of the admins that already have an invoice addition for the period ('YYYY-MM-DD' dates)"""
+    return [row[0] for row in conn.execute("""
+        SELECT DISTINCT COALESCE(a.name, i.admin_uuid)
+        FROM invoice_additions i
+        LEFT JOIN admin_accounts a ON a.uuid = i.admin_uuid
+        WHERE i.invoice_period_start = ? AND i.invoice_period_end = ?
+        ORDER BY 1
+    """, (period_start, period_end))]
+
+def list_generated_invoices(conn, include_archive=False):
+    """Rows for the Generated Invoices list, newest first"""
+    if not include_archive:
+        return conn.execute('''
+            SELECT invoice_date,
+                   (SELECT name FROM admin_accounts WHERE uuid = i.admin_uuid) as admin_name,
+                   usage_gb, amount, status, pdf_path
+            FROM invoices i
+            ORDER BY invoice_date DESC
+        ''').fetchall()
+
+    return conn.execute('''
+        SELECT invoice_date,
+               (SELECT name FROM admin_accounts WHERE uuid = i.admin_uuid) as admin_name,
+               usage_gb, amount, status, pdf_path
+        FROM (
+            SELECT admin_uuid, invoice_date, usage_gb, amount, status, pdf_path FROM main.invoices
+            UNION ALL
+            SELECT admin_uuid, invoice_date, usage_gb, amount, status, pdf_path FROM archive.invoices
+            WHERE id NOT IN (SELECT id FROM main.invoices)
+        ) i
+        ORDER BY invoice_date DESC
+    ''').fetchall()
+
+def record_backup_file(conn, panel_number, data_hash, file_path, backup_date):
+    """Remember a downloaded backup file unless the same data is already recorded; True if it was new"""
+    existing = conn.execute("SELECT id FROM backup_data WHERE panel_number = ? AND data_hash = ?",
+                            (panel_number, data_hash)).fetchone()
+    if not existing:
+        conn.execute('''
+            INSERT INTO backup_data (panel_number, backup_date, data_hash, file_path)
+            VALUES (?, ?, ?, ?)
+        ''', (panel_number, backup_date, data_hash, file_path))
+    return not existing
+
+def update_admin_names(conn, admin_names):
+    """Replace placeholder admin names with the names found in backup files"""
+    for uuid, name in admin_names.items():
+        conn.execute("""
+            UPDATE admin_accounts
+            SET name = ?
+            WHERE uuid = ? AND (name LIKE 'Admin_%' OR name IS NULL)
+        """, (name, uuid))
+
+def sync_admin_accounts(conn, telegram_accounts, admin_names):
+    """
+    Synchronize admin accounts with TELEGRAM_ACCOUNTS: add new admins, mark
+    removed ones with financial data inactive and delete the rest.
+    Returns (new_admins_count, removed_admins_count).
+    """
+    cursor = conn.cursor()
+    new_admins_count = 0
+    removed_admins_count = 0
+
+    # Get all UUIDs currently in the database
+    cursor.execute("SELECT uuid FROM admin_accounts")
+    db_uuids = {row[0] for row in cursor.fetchall()}
+
+    # Find admins to remove (in database but not in config)
+    uuids_to_remove = db_uuids - set(telegram_accounts.keys())
+
+    # Remove admins that are no longer in config
+    for uuid in uuids_to_remove:
+        # Check if admin has any financial data
+        cursor.execute("""
+            SELECT
+                (SELECT COUNT(*) FROM payments WHERE admin_uuid = ?) as payment_count,
+                (SELECT COUNT(*) FROM invoice_additions WHERE admin_uuid = ?) as invoice_count,
+                total_earned, total_paid
+            FROM admin_accounts WHERE uuid = ?
+        """, (uuid, uuid, uuid))
+
+        result = cursor.fetchone()
+        if result:
+            payment_count, invoice_count, total_earned, total_paid = result
+
+            # If admin has financial data, mark as inactive instead of deleting
+            if payment_count > 0 or invoice_count > 0 or (total_earned or 0) > 0 or (total_paid or 0) > 0:
+                cursor.execute("UPDATE admin_accounts SET status = 'inactive' WHERE uuid = ?", (uuid,))
+                print(f"Admin {uuid} marked as inactive (has financial data)")
+            else:
+                # Safe to delete if no financial data
+                cursor.execute("DELETE FROM admin_accounts WHERE uuid = ?", (uuid,))
+                print(f"Admin {uuid} deleted (no financial data)")
+
+            removed_admins_count += 1
+
+    # Add new admins from config
+    for uuid, data in telegram_accounts.items():
+        telegram_id, fa_number, price_per_gb = data
+
+        if uuid not in db_uuids:
+            admin_name = admin_names.get(uuid) or f"Admin_{uuid[:8]}"
+            cursor.execute('''
+                INSERT INTO admin_accounts (uuid, name, telegram_id, panel_number, fa_number, price_per_gb)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (uuid, admin_name, telegram_id, telegram_id, fa_number, price_per_gb))
+
+            new_admins_count += 1
+            print(f"New admin added: {admin_name} ({uuid})")
+
+    # Update admin names from backup files
+    update_admin_names(conn, admin_names)
+
+    return new_admins_count, removed_admins_count
@@ -0,0 +1,139 @@
+"""
+Archiving of closed periods into a separate archive database.
+
+archive_closed_periods() moves an admin's fully settled invoice additions
+older than a cutoff, together with the payments spent only on them, into
+the attached archive database (see database.attach_archive). Generated
+invoice records older than the cutoff move as well. If some of the money for
+the archived invoices came from payments that stay behind, a "Carried Forward"
+invoice addition for that amount keeps the FIFO allocation of the remaining
+rows unchanged. Balances (admin_accounts totals and the ledger) are not
+touched.
+
+The day-to-day queries only read the main tables; the history views in
+accounting_store read the archive too when asked (include_archive=True).
+"""
+
+from datetime import datetime
+
+from payment_allocations import get_unpaid_invoice_ids, rebuild_allocations
+
+# invoice_period_start/end of the row standing in for archived invoices
+CARRY_FORWARD_PERIOD = "Carried Forward"
+
+def _settled_prefix(conn, admin_uuid, cutoff_date):
+    """The admin's oldest invoice additions that are paid and older than the cutoff"""
+    invoices = conn.execute("""
+        SELECT id, amount, addition_date FROM main.invoice_additions
+        WHERE admin_uuid = ?
+        ORDER BY addition_date, id
+    """, (admin_uuid,)).fetchall()
+    unpaid_ids = get_unpaid_invoice_ids(conn, admin_uuid)
+
+    prefix = []
+    for invoice in invoices:
+        if invoice[2] >= cutoff_date or invoice[0] in unpaid_ids:
+            break
+        prefix.append(invoice)
+
+    # The carry-forward row takes the last archived date, so it must sort
+    # before every invoice that stays
+    if len(prefix) < len(invoices):
+        first_kept_date = invoices[len(prefix)][2]
+        while prefix and prefix[-1][2] == first_kept_date:
+            prefix.pop()
+    return prefix
+
+def _spent_payments(conn, admin_uuid, cutoff_date, invoice_ids):
+    """(id, amount) of payments older than the cutoff spent entirely on invoice_ids"""
+    spent_on = {}
+    for payment_id, invoice_id in conn.execute("""
+            SELECT pa.payment_id, pa.invoice_id
+            FROM payment_allocations pa
+            JOIN main.payments p ON p.id = pa.payment_id
+            WHERE pa.admin_uuid = ? AND p.payment_date < ?
+            """, (admin_uuid, cutoff_date)):
+        spent_on.setdefault(payment_id, set()).add(invoice_id)
+
+    payment_ids = [payment_id for payment_id, targets in spent_on.items() if targets <= invoice_ids]
+    if not payment_ids:
+        return []
+    placeholders = ','.join('?' * len(payment_ids))
+    return conn.execute(f"SELECT id, amount FROM main.payments WHERE id IN ({placeholders})",
+                        payment_ids).fetchall()
+
+def _move_rows(conn, table, columns, ids, archived_at):
+    """Copy rows into archive.<table> (replacing leftovers of an interrupted run)"""
+    if not ids:
+        return
+    placeholders = ','.join('?' * len(ids))
+    conn.execute(f"""
+        INSERT OR REPLACE INTO archive.{table} ({columns}, archived_at)
+        SELECT {columns}, ? FROM main.{table} WHERE id IN ({placeholders})
+    """, [archived_at] + list(ids))
+
+def _delete_rows(conn, table, ids):
+    if not ids:
+        return
+    placeholders = ','.join('?' * len(ids))
+    conn.execute(f"DELETE FROM main.{table} WHERE id IN ({placeholders})", list(ids))
+
+def archive_closed_periods(conn, cutoff_date):
+    """
+    Archive settled history dated before cutoff_date ('YYYY-MM-DD') and return
+    counts of the rows moved. Main and archive are separate files, which
+    SQLite cannot commit atomically together in WAL mode, so this commits the
+    copy into the archive before removing the rows from the main tables: an
+    interruption can only leave rows in both, and the main copy wins.
+    """
+    archived_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    plans = []
+    admin_uuids = [row[0] for row in conn.execute("""
+        SELECT DISTINCT admin_uuid FROM main.invoice_additions WHERE addition_date < ?
+    """, (cutoff_date,)).fetchall()]
+
+    for admin_uuid in admin_uuids:
+        prefix = _settled_prefix(conn, admin_uuid, cutoff_date)
+        if not prefix:
+            continue
+        invoice_ids = {invoice[0] for invoice in prefix}
+        payments = _spent_payments(conn, admin_uuid, cutoff_date, invoice_ids)
+        carry_forward = sum(invoice[1] for invoice in prefix) - sum(payment[1] for payment in payments)
+        plans.append((admin_uuid, invoice_ids, [payment[0] for payment in payments],
+                      carry_forward, prefix[-1][2]))
+
+    invoice_record_ids = [row[0] for row in conn.execute(
+        "SELECT id FROM main.invoices WHERE invoice_date < ?", (cutoff_date,)
+    ).fetchall()]
+
+    # Step 1: copy into the archive and make it durable
+    for admin_uuid, invoice_ids, payment_ids, _, _ in plans:
+        _move_rows(conn, 'invoice_additions',
+                   'id, admin_uuid, amount, addition_date, invoice_period_start, invoice_period_end',
+                   invoice_ids, archived_at)
+        _move_rows(conn, 'payments',
+                   'id, admin_uuid, amount, payment_date, payment_method, reference, notes',
+                   payment_ids, archived_at)
+    _move_rows(conn, 'invoices', 'id, admin_uuid, invoice_date, usage_gb, amount, status, pdf_path',
+               invoice_record_ids, archived_at)
+    conn.commit()
+
+    # Step 2: remove from the main tables, leaving a carry-forward row behind
+    for admin_uuid, invoice_ids, payment_ids, carry_forward, last_date in plans:
+        _delete_rows(conn, 'invoice_additions', invoice_ids)
+        _delete_rows(conn, 'payments', payment_ids)
+        if carry_forward > 0:
+            conn.execute("""
+                INSERT INTO main.invoice_additions
+                    (admin_uuid, amount, addition_date, invoice_period_start, invoice_period_end)
+                VALUES (?, ?, ?, ?, ?)
+            """, (admin_uuid, carry_forward, last_date, CARRY_FORWARD_PERIOD, CARRY_FORWARD_PERIOD))
+        rebuild_allocations(conn, admin_uuid)
+    _delete_rows(conn, 'invoices', invoice_record_ids)
+
+    return {
+        'admins': len(plans),
+        'invoice_additions': sum(len(plan[1]) for plan in plans),
+        'payments': sum(len(plan[2]) for plan in plans),
+        'invoices': len(invoice_record_ids),
+    }
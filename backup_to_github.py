@@ -9,15 +9,18 @@ import sys
 import subprocess
 import json
 import shutil
-from datetime import datetime
 import sqlite3
+from datetime import datetime
 import tempfile
+from database import archive_path, backup_database, connect
 
 # Configuration
 GITHUB_USERNAME = "alighaemi9731"
 GITHUB_REPO = "accountant"
 BACKUP_DIR = "backup_temp"
 DATABASE_FILE = "vpn_accounting.db"
+# Store the database gzipped in the backup (also enabled with --compress)
+COMPRESS_DATABASE = "--compress" in sys.argv
 
 def run_command(command, cwd=None, check=True):
     """Run a shell command and return the result"""
@@ -72,7 +75,7 @@ def create_backup_directory():
     print(f"✅ Created backup directory: {BACKUP_DIR}")
 
 def copy_files_to_backup():
-    """Copy necessary files to backup directory"""
+    """Copy necessary files to backup directory; False if the database could not be backed up"""
     files_to_backup = [
         "*.py",
         "*.md",
@@ -116,12 +119,22 @@ def copy_files_to_backup():
     
     # Copy database file if it exists
     if os.path.exists(DATABASE_FILE):
-        shutil.copy2(DATABASE_FILE, BACKUP_DIR)
-        print(f"✅ Copied database: {DATABASE_FILE}")
+        # Online backup: a consistent copy even while the application is writing
+        for database_file in (DATABASE_FILE, archive_path(DATABASE_FILE)):
+            if not os.path.exists(database_file):
+                continue
+            destination = os.path.join(BACKUP_DIR, database_file + (".gz" if COMPRESS_DATABASE else ""))
+            try:
+                backup_database(destination, database_file, compress=COMPRESS_DATABASE)
+                print(f"✅ Backed up database: {os.path.basename(destination)} (integrity check passed)")
+            except Exception as e:
+                print(f"❌ Database backup failed: {e}")
+                return False
     else:
         print(f"⚠️  Database file not found: {DATABASE_FILE}")
     
     print("✅ Copied all necessary files to backup directory")
+    return True
 
 def create_readme_for_backup():
     """Create a README file for the backup"""
@@ -150,7 +163,8 @@ def create_readme_for_backup():
 - `requirements.txt` - Python dependencies
 
 ### Database
-- `vpn_accounting.db` - SQLite database with all accounting data
+- `vpn_accounting.db` - SQLite database with all accounting data (`vpn_accounting.db.gz` when made with `--compress`; gunzip it before use)
+- `vpn_accounting_archive.db` - Archived (settled) payments and invoices, if records have been archived
 
 ### Documentation
 - `README.md` - Main documentation
@@ -186,28 +200,34 @@ def get_database_info():
         return "Database file not found"
     
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
+        # Read-only WAL connection: safe while the application is writing
+        conn = connect(DATABASE_FILE, read_only=True)
         cursor = conn.cursor()
         
-        # Get admin count
-        cursor.execute("SELECT COUNT(*) FROM admin_accounts WHERE status = 'active'")
-        admin_count = cursor.fetchone()[0]
+        # Totals and counts are kept current by triggers in the application
+        try:
+            cursor.execute("""
+                SELECT total_admins, total_earned, total_paid, payment_count, invoice_count
+                FROM dashboard_summary WHERE id = 1
+            """)
+            summary = cursor.fetchone()
+        except sqlite3.OperationalError:
+            # Not yet opened by a version with the summary table (migration 5)
+            summary = None
         
-        # Get total earned
-        cursor.execute("SELECT SUM(total_earned) FROM admin_accounts")
-        total_earned = cursor.fetchone()[0] or 0
+        if summary is None:
+            cursor.execute("""
+                SELECT (SELECT COUNT(*) FROM admin_accounts WHERE status = 'active'),
+                       (SELECT SUM(total_earned) FROM admin_accounts),
+                       (SELECT SUM(total_paid) FROM admin_accounts),
+                       (SELECT COUNT(*) FROM payments),
+                       (SELECT COUNT(*) FROM invoice_additions)
+            """)
+            summary = cursor.fetchone()
         
-        # Get total paid
-        cursor.execute("SELECT SUM(total_paid) FROM admin_accounts")
-        total_paid = cursor.fetchone()[0] or 0
-        
-        # Get payment count
-        cursor.execute("SELECT COUNT(*) FROM payments")
-        payment_count = cursor.fetchone()[0]
-        
-        # Get invoice count
-        cursor.execute("SELECT COUNT(*) FROM invoice_additions")
-        invoice_count = cursor.fetchone()[0]
+        admin_count, total_earned, total_paid, payment_count, invoice_count = summary
+        total_earned = total_earned or 0
+        total_paid = total_paid or 0
         
         conn.close()
         
@@ -416,7 +436,9 @@ def main():
     # Create backup
     print("\n📦 Creating backup...")
     create_backup_directory()
-    copy_files_to_backup()
+    if not copy_files_to_backup():
+        shutil.rmtree(BACKUP_DIR, ignore_errors=True)
+        return False
     create_readme_for_backup()
     
     # Initialize git and create release
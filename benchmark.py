@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+VPN Panel Accounting System - Performance Benchmarks
+Measures the performance budgets of the application and exits with a non-zero
+status when one of them is exceeded.
+
+Usage:
+    python benchmark.py            # run all benchmarks
+    python benchmark.py startup    # GUI startup time only
+    python benchmark.py admin_detail  # admin detail queries vs. payments table size
+    python benchmark.py --skip-window # without a display: check the import budget only
+
+Without a display the startup probe runs under xvfb-run when it is installed;
+otherwise the startup benchmark fails unless --skip-window is given.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Measure only the import budget when no display is available
+SKIP_WINDOW = "--skip-window" in sys.argv
+
+# Startup budgets (seconds)
+IMPORT_BUDGET_SECONDS = 0.25
+STARTUP_BUDGET_SECONDS = 1.0
+
+# Admin detail page: payment table sizes to grow through and the per-page budget
+PAYMENT_TABLE_SIZES = [10_000, 100_000, 300_000]
+BENCHMARK_ADMIN_COUNT = 500
+ADMIN_DETAIL_BUDGET_SECONDS = 0.01
+
+# History rows of the measured admin: enough for a second page of payments
+MEASURED_ADMIN_PAYMENTS = 300
+
+# Runs in a fresh interpreter so module caches do not hide import costs.
+# Mirrors gui_app.main() up to the first fully drawn window.
+STARTUP_PROBE = r'''
+import json, sys, time
+start = time.perf_counter()
+import gui_app
+imported = time.perf_counter()
+result = {"import": imported - start, "window": None}
+try:
+    root = gui_app.tk.Tk()
+except gui_app.tk.TclError as e:
+    result["error"] = str(e)
+else:
+    app = gui_app.VPNAccountingApp(root)
+    root.update()
+    result["window"] = time.perf_counter() - start
+    root.destroy()
+result["reportlab_loaded"] = "reportlab" in sys.modules
+result["requests_loaded"] = "requests" in sys.modules
+print(json.dumps(result))
+'''
+
+def run_probe(probe, cwd):
+    """Run a probe script with the application on the path and return its JSON result"""
+    env = dict(os.environ, PYTHONPATH=APP_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    command = [sys.executable, "-c", probe]
+    if sys.platform.startswith('linux') and not os.environ.get('DISPLAY') and shutil.which('xvfb-run'):
+        # Headless: give the probe a virtual display so the window is measured
+        command = ['xvfb-run', '--auto-servernum'] + command
+    result = subprocess.run(command, cwd=cwd, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr)
+        return None
+    # The application prints progress messages; the JSON result is the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def benchmark_startup():
+    """Time importing gui_app and building the main window against the startup budget"""
+    print("🚀 Startup benchmark")
+    work_dir = tempfile.mkdtemp(prefix="vpn_bench_")
+    try:
+        # Same fixtures the app expects next to it, with a fresh database
+        for name in ("config.py", "DejaVuSans.ttf"):
+            shutil.copy2(os.path.join(APP_DIR, name), work_dir)
+        result = run_probe(STARTUP_PROBE, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if result is None:
+        print("❌ Startup probe failed")
+        return False
+
+    ok = True
+    print(f"   import gui_app: {result['import'] * 1000:.0f} ms (budget {IMPORT_BUDGET_SECONDS * 1000:.0f} ms)")
+    if result['import'] > IMPORT_BUDGET_SECONDS:
+        print("❌ Import is over budget")
+        ok = False
+
+    if result['window'] is None:
+        if SKIP_WINDOW:
+            print(f"⚠️  Window not measured (no display: {result.get('error')})")
+        else:
+            print(f"❌ Window not measured (no display: {result.get('error')}); "
+                  f"install xvfb-run or pass --skip-window")
+            ok = False
+    else:
+        print(f"   main window ready: {result['window'] * 1000:.0f} ms (budget {STARTUP_BUDGET_SECONDS * 1000:.0f} ms)")
+        if result['window'] > STARTUP_BUDGET_SECONDS:
+            print("❌ Startup is over budget")
+            ok = False
+
+    for module in ("reportlab", "requests"):
+        if result[f'{module}_loaded']:
+            print(f"❌ {module} was imported during startup")
+            ok = False
+
+    if ok:
+        print("✅ Startup within budget")
+    return ok
+
+def seed_payments(conn, admin_uuids, count, start_id):
+    """Insert `count` payments spread over all admins, plus an invoice addition per 10 payments"""
+    payments = []
+    additions = []
+    for i in range(start_id, start_id + count):
+        admin_uuid = admin_uuids[i % len(admin_uuids)]
+        date = f"{2020 + i % 6}-{1 + i % 12:02d}-{1 + i % 28:02d} 12:00:00"
+        payments.append((admin_uuid, random.randint(1, 500) * 1000, date, "Cash"))
+        if i % 10 == 0:
+            additions.append((admin_uuid, random.randint(1, 5000) * 1000, date, date, date))
+    conn.executemany(
+        "INSERT INTO payments (admin_uuid, amount, payment_date, payment_method) VALUES (?, ?, ?, ?)",
+        payments
+    )
+    conn.executemany(
+        """INSERT INTO invoice_additions
+           (admin_uuid, amount, addition_date, invoice_period_start, invoice_period_end)
+           VALUES (?, ?, ?, ?, ?)""",
+        additions
+    )
+    conn.commit()
+
+def time_admin_detail(conn, admin_uuid, repeats=20):
+    """
+    Best-of-N wall time for what opening an admin's detail page runs (see
+    gui_app.show_admin): get_admin_detail, then the next page of each history
+    as the lists are scrolled
+    """
+    from accounting_store import get_admin_detail, get_invoice_history, get_payment_history
+
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        detail = get_admin_detail(conn, admin_uuid)
+        for fetch, rows in ((get_invoice_history, detail['invoices']), (get_payment_history, detail['payments'])):
+            if rows:
+                fetch(conn, admin_uuid, False, (rows[-1][1], rows[-1][0]))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def benchmark_admin_detail():
+    """Show the admin detail page's queries stay flat as the payments table grows"""
+    from database import MIGRATIONS, migrate
+    from payment_allocations import rebuild_allocations
+
+    print("📊 Admin detail benchmark")
+    work_dir = tempfile.mkdtemp(prefix="vpn_bench_")
+    try:
+        connections = {}
+        # Base tables only (no indexes) versus the fully migrated schema
+        for label, target_version in (("unindexed", 1), ("migrated", MIGRATIONS[-1][0])):
+            conn = sqlite3.connect(os.path.join(work_dir, f"{label}.db"))
+            migrate(conn, target_version)
+            if target_version < 3:
+                # The detail page reads paid status from payment_allocations
+                conn.execute("""
+                    CREATE TABLE payment_allocations (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        payment_id INTEGER, invoice_id INTEGER, admin_uuid TEXT, amount DECIMAL(15,2)
+                    )
+                """)
+            conn.executemany(
+                "INSERT INTO admin_accounts (uuid, name) VALUES (?, ?)",
+                [(f"admin-{i:04d}", f"Admin {i:04d}") for i in range(BENCHMARK_ADMIN_COUNT)]
+            )
+            conn.commit()
+            connections[label] = conn
+
+        # The measured admin keeps a fixed history while everyone else's grows
+        admin_uuids = [f"admin-{i:04d}" for i in range(BENCHMARK_ADMIN_COUNT)]
+        for conn in connections.values():
+            seed_payments(conn, admin_uuids[:1], MEASURED_ADMIN_PAYMENTS, 0)
+            rebuild_allocations(conn, admin_uuids[0])
+            conn.commit()
+        ok = True
+        seeded = 0
+        for size in PAYMENT_TABLE_SIZES:
+            random.seed(size)
+            timings = {}
+            for label, conn in connections.items():
+                seed_payments(conn, admin_uuids[1:], size - seeded, seeded)
+                timings[label] = time_admin_detail(conn, admin_uuids[0])
+            seeded = size
+
+            print(f"   {size:>8,} payments: migrated {timings['migrated'] * 1000:6.2f} ms, "
+                  f"unindexed {timings['unindexed'] * 1000:6.2f} ms")
+            if timings['migrated'] > ADMIN_DETAIL_BUDGET_SECONDS:
+                print(f"❌ Admin detail over budget ({ADMIN_DETAIL_BUDGET_SECONDS * 1000:.0f} ms)")
+                ok = False
+
+        for conn in connections.values():
+            conn.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if ok:
+        print("✅ Admin detail within budget")
+    return ok
+
+BENCHMARKS = {
+    "startup": benchmark_startup,
+    "admin_detail": benchmark_admin_detail,
+}
+
+def main():
+    names = [arg for arg in sys.argv[1:] if not arg.startswith('--')] or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        print(f"Unknown benchmark(s): {', '.join(unknown)}. Available: {', '.join(BENCHMARKS)}")
+        return False
+
+    results = [BENCHMARKS[name]() for name in names]
+    return all(results)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+VPN Panel Accounting System - Consistency Checks
+Drives the accounting write paths with random operations on a scratch
+database and, after every operation, checks the state they maintain
+incrementally against a from-scratch recomputation:
+
+- payment_allocations as left by reallocate() equals rebuild_allocations()
+- admin_accounts totals equal the ledger sums (ledger.check_totals)
+- the paid status in payment_allocations equals the invoice_status view
+
+Operations: record, import and delete payments; add, edit and delete
+invoice additions (deleting a paid one shrinks the payments that covered
+it); invoice runs; archiving of closed periods. Exits with a non-zero
+status at the first mismatch.
+
+Usage:
+    python consistency_check.py                 # default number of operations
+    python consistency_check.py 2000 7          # operations, random seed
+"""
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta
+
+DEFAULT_OPERATIONS = 500
+DEFAULT_SEED = 1
+CHECK_ADMIN_COUNT = 3
+
+# Relative weights of the random operations
+OPERATION_WEIGHTS = {
+    'record_payment': 25,
+    'import_payments': 8,
+    'delete_payment': 10,
+    'add_indebtedness': 15,
+    'invoice_run': 10,
+    'edit_invoice': 12,
+    'delete_invoice': 15,
+    'archive': 3,
+}
+
+def random_date(rng):
+    """A day in 2023-2024; few distinct days, so rows often share a date"""
+    return f"{rng.choice((2023, 2024))}-{rng.randint(1, 12):02d}-{rng.randint(1, 3):02d}"
+
+def random_amount(rng):
+    return rng.randint(1, 40) * 1000
+
+def pick(conn, rng, sql, params=()):
+    """One random row of a query, or None"""
+    rows = conn.execute(sql, params).fetchall()
+    return rng.choice(rows) if rows else None
+
+def allocation_rows(conn):
+    """The allocations as a multiset, ignoring their row ids"""
+    return Counter(
+        (payment_id, invoice_id, admin_uuid, round(amount, 2))
+        for payment_id, invoice_id, admin_uuid, amount in conn.execute(
+            "SELECT payment_id, invoice_id, admin_uuid, amount FROM payment_allocations")
+    )
+
+def check_state(conn):
+    """Descriptions of every inconsistency in the committed state (empty when consistent)"""
+    import ledger
+    from payment_allocations import rebuild_allocations
+
+    problems = []
+    incremental = allocation_rows(conn)
+    rebuild_allocations(conn)
+    rebuilt = allocation_rows(conn)
+    conn.rollback()
+    if incremental != rebuilt:
+        problems.append(f"allocations differ from a rebuild: kept {sorted((incremental - rebuilt).elements())}, "
+                        f"expected {sorted((rebuilt - incremental).elements())}")
+
+    for uuid, name, stored, expected in ledger.check_totals(conn):
+        problems.append(f"{name} ({uuid}) totals {stored} disagree with the ledger {expected}")
+
+    unpaid_allocated = {row[0] for row in conn.execute(
+        "SELECT invoice_id FROM payment_allocations WHERE payment_id IS NULL")}
+    unpaid_view = {row[0] for row in conn.execute("SELECT id FROM invoice_status WHERE NOT paid")}
+    if unpaid_allocated != unpaid_view:
+        problems.append(f"unpaid invoices differ: allocations {sorted(unpaid_allocated - unpaid_view)}, "
+                        f"invoice_status {sorted(unpaid_view - unpaid_allocated)}")
+    return problems
+
+def run_operation(conn, name, rng, admin_uuids):
+    """Apply one operation through the application's own code and commit it; returns a description"""
+    import accounting_store
+    from archive import CARRY_FORWARD_PERIOD, archive_closed_periods
+    from enhanced_data_processing import EnhancedDataProcessor
+    from payment_import import apply_payment_import, build_import_preview
+
+    admin_uuid = rng.choice(admin_uuids)
+
+    if name == 'record_payment':
+        amount, date = random_amount(rng), random_date(rng)
+        accounting_store.record_payment(conn, admin_uuid, amount, date)
+        description = f"payment of {amount} on {date} for {admin_uuid}"
+    elif name == 'import_payments':
+        lines = [f"{rng.choice(admin_uuids)},{random_amount(rng)},{random_date(rng)}" for _ in range(rng.randint(1, 4))]
+        preview = build_import_preview(conn, "\n".join(lines), amount_unit=1)
+        count, _ = apply_payment_import(conn, preview)
+        description = f"import of {count} payments: {'; '.join(lines)}"
+    elif name == 'delete_payment':
+        payment = pick(conn, rng, "SELECT id, amount FROM payments WHERE admin_uuid = ?", (admin_uuid,))
+        if not payment:
+            return None
+        accounting_store.delete_payment(conn, payment[0], payment[1], admin_uuid)
+        description = f"deletion of payment {payment[0]}"
+    elif name == 'add_indebtedness':
+        amount, date = random_amount(rng), random_date(rng)
+        accounting_store.add_indebtedness(conn, admin_uuid, amount, date)
+        description = f"indebtedness of {amount} on {date} for {admin_uuid}"
+    elif name == 'invoice_run':
+        amount = random_amount(rng)
+        start = datetime.strptime(random_date(rng), '%Y-%m-%d')
+        end = start + timedelta(days=30)
+        # What an invoice run with "add to accounts" does for each main admin
+        processor = EnhancedDataProcessor(conn)
+        if processor.has_period_addition(admin_uuid, start, end):
+            return None
+        processor.add_earnings_to_account(admin_uuid, amount, start, end)
+        description = f"invoice run adding {amount} for {admin_uuid} ({start:%Y-%m-%d} to {end:%Y-%m-%d})"
+    elif name in ('edit_invoice', 'delete_invoice'):
+        invoice = pick(conn, rng, """
+            SELECT id, amount FROM invoice_additions
+            WHERE admin_uuid = ? AND invoice_period_start IS NOT ?
+        """, (admin_uuid, CARRY_FORWARD_PERIOD))
+        if not invoice:
+            return None
+        if name == 'edit_invoice':
+            amount = random_amount(rng)
+            accounting_store.update_invoice_addition_amount(conn, invoice[0], admin_uuid, invoice[1], amount)
+            description = f"edit of invoice {invoice[0]} from {invoice[1]} to {amount}"
+        else:
+            info = accounting_store.get_invoice_deletion_info(conn, invoice[0])
+            accounting_store.delete_invoice_addition(conn, invoice[0], invoice[1], admin_uuid,
+                                                     info['payment_reductions'])
+            description = (f"deletion of {'paid' if info['is_paid'] else 'unpaid'} invoice {invoice[0]}"
+                           f" ({len(info['payment_reductions'])} payments reduced)")
+    elif name == 'archive':
+        cutoff = random_date(rng)
+        counts = archive_closed_periods(conn, cutoff)
+        description = (f"archive before {cutoff}: {counts['invoice_additions']} invoices, "
+                       f"{counts['payments']} payments")
+    else:
+        raise ValueError(f"Unknown operation: {name}")
+
+    conn.commit()
+    return description
+
+def run_checks(operations=DEFAULT_OPERATIONS, seed=DEFAULT_SEED):
+    """Run `operations` random operations, checking the state after each one"""
+    from database import attach_archive, connect, migrate
+
+    print(f"🔍 Consistency check: {operations} operations, seed {seed}")
+    work_dir = tempfile.mkdtemp(prefix="vpn_check_")
+    try:
+        path = os.path.join(work_dir, "check.db")
+        conn = connect(path)
+        migrate(conn)
+        attach_archive(conn, path, create=True)
+        admin_uuids = [f"admin-{i}" for i in range(CHECK_ADMIN_COUNT)]
+        conn.executemany(
+            "INSERT INTO admin_accounts (uuid, name, total_earned, total_paid, status) VALUES (?, ?, 0, 0, 'active')",
+            [(uuid, f"Admin {i}") for i, uuid in enumerate(admin_uuids)]
+        )
+        conn.commit()
+
+        rng = random.Random(seed)
+        names = list(OPERATION_WEIGHTS)
+        weights = [OPERATION_WEIGHTS[name] for name in names]
+        applied = Counter()
+        for step in range(1, operations + 1):
+            name = rng.choices(names, weights)[0]
+            description = run_operation(conn, name, rng, admin_uuids)
+            if description is None:
+                continue
+            applied[name] += 1
+            problems = check_state(conn)
+            if problems:
+                print(f"❌ Inconsistent after operation {step}, {description}:")
+                for problem in problems:
+                    print(f"   {problem}")
+                return False
+        conn.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print("   " + ", ".join(f"{name} {count}" for name, count in sorted(applied.items())))
+    print("✅ Allocations, ledger totals and invoice status consistent after every operation")
+    return True
+
+def main():
+    operations = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_OPERATIONS
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_SEED
+    return run_checks(operations, seed)
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -1,4 +1,4 @@
-from pdf_generation import create_invoices
+from pdf_generation import create_invoices, load_admin_balances
 import os
 from utils import read_json_file, find_descendants
 
@@ -9,6 +9,7 @@ def process_invoices():
     json_file_paths.sort()
     panel_number = 1
     dic = {}
+    balances = load_admin_balances()
     for json_file in json_file_paths:
         data = read_json_file(json_file)
         admin_users = data.get('admin_users', [])
@@ -22,7 +23,7 @@ def process_invoices():
                 descendants = [admin]
                 descendant_admins = find_descendants(admin['uuid'], admin_users, descendants)
                 total_usage = [0]
-                create_invoices(descendant_admins, data.get('users', []), prev_invoice_date, panel_number, total_usage)
+                create_invoices(descendant_admins, data.get('users', []), prev_invoice_date, panel_number, total_usage, balances=balances)
         panel_number += 1
 
     print("\nrepeated ones:\n")
@@ -0,0 +1,678 @@
+"""
+Database schema and versioned migrations for the VPN accounting database.
+
+Every schema change is an ordered step in MIGRATIONS. The schema_version table
+records which steps a database has already applied, so opening an older
+database upgrades it in place. Add new steps at the end; never edit a step
+that has already shipped.
+"""
+
+import gzip
+import os
+import shutil
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import query_stats
+
+DATABASE_FILE = 'vpn_accounting.db'
+
+# How long a connection waits for a lock before raising "database is locked"
+BUSY_TIMEOUT_MS = 5000
+# Idle read-only connections kept open for reuse
+READER_POOL_SIZE = 4
+# Online backups copy this many pages per step, pausing between steps so
+# the application's writes are not held up
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP_SECONDS = 0.005
+
+def _create_accounting_tables(cursor):
+    """Version 1: the original accounting tables"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS admin_accounts (
+            uuid TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            telegram_id INTEGER,
+            panel_number INTEGER,
+            fa_number TEXT,
+            price_per_gb INTEGER DEFAULT 1000,
+            total_earned DECIMAL(15,2) DEFAULT 0,
+            total_paid DECIMAL(15,2) DEFAULT 0,
+            last_payment_date TEXT,
+            last_invoice_date TEXT,
+            status TEXT DEFAULT 'active'
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_uuid TEXT,
+            amount DECIMAL(15,2),
+            payment_date TEXT,
+            payment_method TEXT,
+            reference TEXT,
+            notes TEXT,
+            FOREIGN KEY (admin_uuid) REFERENCES admin_accounts (uuid)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS invoices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_uuid TEXT,
+            invoice_date TEXT,
+            usage_gb INTEGER,
+            amount DECIMAL(15,2),
+            status TEXT DEFAULT 'unpaid',
+            pdf_path TEXT,
+            FOREIGN KEY (admin_uuid) REFERENCES admin_accounts (uuid)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS backup_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            panel_number INTEGER,
+            backup_date TEXT,
+            data_hash TEXT,
+            file_path TEXT
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS invoice_additions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_uuid TEXT,
+            amount DECIMAL(15,2),
+            addition_date TEXT,
+            invoice_period_start TEXT,
+            invoice_period_end TEXT,
+            FOREIGN KEY (admin_uuid) REFERENCES admin_accounts (uuid)
+        )
+    ''')
+
+def _add_lookup_indexes(cursor):
+    """Version 2: indexes for the per-admin history queries and lookups"""
+    # Payment history and SUM(amount) per admin are answered from the index alone
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payments_admin_date
+        ON payments (admin_uuid, payment_date, amount)
+    ''')
+    # Dashboard "recent activity" and the last-30-days totals
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payments_date
+        ON payments (payment_date)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_invoice_additions_admin_date
+        ON invoice_additions (admin_uuid, addition_date, amount)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_invoices_admin_date
+        ON invoices (admin_uuid, invoice_date)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_invoices_date
+        ON invoices (invoice_date)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_backup_data_panel_hash
+        ON backup_data (panel_number, data_hash)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_admin_accounts_name
+        ON admin_accounts (name)
+    ''')
+
+def _add_payment_allocations(cursor):
+    """Version 3: FIFO payment-to-invoice allocations, backfilled from existing history"""
+    # NULL invoice_id is unspent payment credit, NULL payment_id an unpaid invoice balance
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS payment_allocations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            payment_id INTEGER,
+            invoice_id INTEGER,
+            admin_uuid TEXT,
+            amount DECIMAL(15,2),
+            FOREIGN KEY (payment_id) REFERENCES payments (id),
+            FOREIGN KEY (invoice_id) REFERENCES invoice_additions (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payment_allocations_invoice
+        ON payment_allocations (invoice_id)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payment_allocations_payment
+        ON payment_allocations (payment_id)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_payment_allocations_admin
+        ON payment_allocations (admin_uuid, payment_id, invoice_id)
+    ''')
+
+    # FIFO backfill: with each admin's invoices and payments laid end to end
+    # (oldest first), a payment covers the part of an invoice their ranges share
+    cursor.execute('''
+        WITH invoices AS (
+            SELECT id, admin_uuid, amount,
+                   SUM(amount) OVER (PARTITION BY admin_uuid ORDER BY addition_date, id
+                                     ROWS UNBOUNDED PRECEDING) AS upto
+            FROM invoice_additions WHERE amount > 0
+        ),
+        paid_in AS (
+            SELECT id, admin_uuid, amount,
+                   SUM(amount) OVER (PARTITION BY admin_uuid ORDER BY payment_date, id
+                                     ROWS UNBOUNDED PRECEDING) AS upto
+            FROM payments WHERE amount > 0
+        ),
+        invoiced_total AS (SELECT admin_uuid, SUM(amount) AS total FROM invoices GROUP BY admin_uuid),
+        paid_total AS (SELECT admin_uuid, SUM(amount) AS total FROM paid_in GROUP BY admin_uuid)
+        INSERT INTO payment_allocations (payment_id, invoice_id, admin_uuid, amount)
+        SELECT p.id, i.id, i.admin_uuid,
+               MIN(i.upto, p.upto) - MAX(i.upto - i.amount, p.upto - p.amount)
+        FROM invoices i
+        JOIN paid_in p ON p.admin_uuid = i.admin_uuid
+                      AND p.upto - p.amount < i.upto AND i.upto - i.amount < p.upto
+        UNION ALL
+        SELECT NULL, i.id, i.admin_uuid, i.upto - MAX(i.upto - i.amount, COALESCE(t.total, 0))
+        FROM invoices i LEFT JOIN paid_total t ON t.admin_uuid = i.admin_uuid
+        WHERE i.upto > COALESCE(t.total, 0)
+        UNION ALL
+        SELECT p.id, NULL, p.admin_uuid, p.upto - MAX(p.upto - p.amount, COALESCE(t.total, 0))
+        FROM paid_in p LEFT JOIN invoiced_total t ON t.admin_uuid = p.admin_uuid
+        WHERE p.upto > COALESCE(t.total, 0)
+    ''')
+
+def _add_ledger(cursor):
+    """Version 4: append-only money ledger and monthly balance snapshots, backfilled from history"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ledger_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_uuid TEXT,
+            entry_type TEXT,
+            entry_date TEXT,
+            earned DECIMAL(15,2) DEFAULT 0,
+            paid DECIMAL(15,2) DEFAULT 0,
+            source_table TEXT,
+            source_id INTEGER,
+            note TEXT,
+            recorded_at TEXT,
+            FOREIGN KEY (admin_uuid) REFERENCES admin_accounts (uuid)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ledger_entries_admin_date
+        ON ledger_entries (admin_uuid, entry_date, earned, paid)
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS ledger_entries_no_update
+        BEFORE UPDATE ON ledger_entries
+        BEGIN
+            SELECT RAISE(ABORT, 'ledger_entries is append-only');
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS ledger_entries_no_delete
+        BEFORE DELETE ON ledger_entries
+        BEGIN
+            SELECT RAISE(ABORT, 'ledger_entries is append-only');
+        END
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS balance_snapshots (
+            admin_uuid TEXT,
+            month TEXT,
+            total_earned DECIMAL(15,2),
+            total_paid DECIMAL(15,2),
+            PRIMARY KEY (admin_uuid, month)
+        )
+    ''')
+
+    # Book the existing invoice additions and payments
+    cursor.execute('''
+        INSERT INTO ledger_entries
+            (admin_uuid, entry_type, entry_date, earned, paid, source_table, source_id, note, recorded_at)
+        SELECT admin_uuid,
+               CASE WHEN invoice_period_start = 'Start Up Indebtedness' THEN 'indebtedness' ELSE 'invoice' END,
+               addition_date, amount, 0, 'invoice_additions', id, NULL, datetime('now', 'localtime')
+        FROM invoice_additions
+    ''')
+    cursor.execute('''
+        INSERT INTO ledger_entries
+            (admin_uuid, entry_type, entry_date, earned, paid, source_table, source_id, note, recorded_at)
+        SELECT admin_uuid, 'payment', payment_date, 0, amount, 'payments', id, NULL, datetime('now', 'localtime')
+        FROM payments
+    ''')
+
+    # Totals changed outside the history tables (older versions) become an opening adjustment
+    cursor.execute('''
+        INSERT INTO ledger_entries
+            (admin_uuid, entry_type, entry_date, earned, paid, source_table, source_id, note, recorded_at)
+        SELECT a.uuid, 'adjustment', datetime('now', 'localtime'),
+               COALESCE(a.total_earned, 0) - COALESCE(l.earned, 0),
+               COALESCE(a.total_paid, 0) - COALESCE(l.paid, 0),
+               NULL, NULL, 'Opening balance from admin_accounts', datetime('now', 'localtime')
+        FROM admin_accounts a
+        LEFT JOIN (
+            SELECT admin_uuid, SUM(earned) AS earned, SUM(paid) AS paid
+            FROM ledger_entries GROUP BY admin_uuid
+        ) l ON l.admin_uuid = a.uuid
+        WHERE ABS(COALESCE(a.total_earned, 0) - COALESCE(l.earned, 0)) > 0.01
+           OR ABS(COALESCE(a.total_paid, 0) - COALESCE(l.paid, 0)) > 0.01
+    ''')
+
+    # Running totals at the end of every finished month
+    cursor.execute('''
+        INSERT INTO balance_snapshots (admin_uuid, month, total_earned, total_paid)
+        SELECT admin_uuid, month,
+               SUM(month_earned) OVER (PARTITION BY admin_uuid ORDER BY month),
+               SUM(month_paid) OVER (PARTITION BY admin_uuid ORDER BY month)
+        FROM (
+            SELECT admin_uuid, substr(entry_date, 1, 7) AS month,
+                   COALESCE(SUM(earned), 0) AS month_earned, COALESCE(SUM(paid), 0) AS month_paid
+            FROM ledger_entries
+            WHERE entry_date > '' AND entry_date < strftime('%Y-%m', 'now', 'localtime')
+            GROUP BY admin_uuid, month
+        )
+    ''')
+
+def _add_dashboard_summary(cursor):
+    """Version 5: single-row dashboard totals kept current by triggers"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS dashboard_summary (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_admins INTEGER DEFAULT 0,
+            total_earned DECIMAL(15,2) DEFAULT 0,
+            total_paid DECIMAL(15,2) DEFAULT 0,
+            payment_count INTEGER DEFAULT 0,
+            invoice_count INTEGER DEFAULT 0,
+            last_backup TEXT
+        )
+    ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO dashboard_summary
+            (id, total_admins, total_earned, total_paid, payment_count, invoice_count, last_backup)
+        SELECT 1,
+               (SELECT COUNT(*) FROM admin_accounts WHERE status = 'active'),
+               (SELECT COALESCE(SUM(total_earned), 0) FROM admin_accounts),
+               (SELECT COALESCE(SUM(total_paid), 0) FROM admin_accounts),
+               (SELECT COUNT(*) FROM payments),
+               (SELECT COUNT(*) FROM invoice_additions),
+               (SELECT MAX(backup_date) FROM backup_data)
+    ''')
+
+    # admin_accounts: active count and the earned/paid sums
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS dashboard_admin_insert
+        AFTER INSERT ON admin_accounts
+        BEGIN
+            UPDATE dashboard_summary SET
+                total_admins = total_admins + (NEW.status IS 'active'),
+                total_earned = total_earned + COALESCE(NEW.total_earned, 0),
+                total_paid = total_paid + COALESCE(NEW.total_paid, 0)
+            WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS dashboard_admin_update
+        AFTER UPDATE OF status, total_earned, total_paid ON admin_accounts
+        BEGIN
+            UPDATE dashboard_summary SET
+                total_admins = total_admins + (NEW.status IS 'active') - (OLD.status IS 'active'),
+                total_earned = total_earned + COALESCE(NEW.total_earned, 0) - COALESCE(OLD.total_earned, 0),
+                total_paid = total_paid + COALESCE(NEW.total_paid, 0) - COALESCE(OLD.total_paid, 0)
+            WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS dashboard_admin_delete
+        AFTER DELETE ON admin_accounts
+        BEGIN
+            UPDATE dashboard_summary SET
+                total_admins = total_admins - (OLD.status IS 'active'),
+                total_earned = total_earned - COALESCE(OLD.total_earned, 0),
+                total_paid = total_paid - COALESCE(OLD.total_paid, 0)
+            WHERE id = 1;
+        END
+    ''')
+
+    # payments and invoice_additions: row counts
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS dashboard_payment_insert
+        AFTER INSERT ON payments
+        BEGIN
+            UPDATE dashboard_summary SET payment_count = payment_count + 1 WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS dashboard_payment_delete
+        AFTER DELETE ON payments
+        BEGIN
+            UPDATE dashboard_summary SET payment_count = payment_count - 1 WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS dashboard_invoice_addition_insert
+        AFTER INSERT ON invoice_additions
+        BEGIN
+            UPDATE dashboard_summary SET invoice_count = invoice_count + 1 WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS dashboard_invoice_addition_delete
+        AFTER DELETE ON invoice_additions
+        BEGIN
+            UPDATE dashboard_summary SET invoice_count = invoice_count - 1 WHERE id = 1;
+        END
+    ''')
+
+    # backup_data: latest backup date (deletes are rare, so those rescan)
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS dashboard_backup_insert
+        AFTER INSERT ON backup_data
+        WHEN NEW.backup_date IS NOT NULL
+        BEGIN
+            UPDATE dashboard_summary SET last_backup = NEW.backup_date
+            WHERE id = 1 AND (last_backup IS NULL OR last_backup < NEW.backup_date);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS dashboard_backup_delete
+        AFTER DELETE ON backup_data
+        BEGIN
+            UPDATE dashboard_summary SET last_backup = (SELECT MAX(backup_date) FROM backup_data)
+            WHERE id = 1;
+        END
+    ''')
+
+def _add_search_indexes(cursor):
+    """Version 6: FTS5 trigram index for panel user search"""
+    from search_index import fts5_trigram_available
+
+    if not fts5_trigram_available(cursor.connection):
+        # Panel user search is unavailable (see search_index.py)
+        print(f"⚠️  SQLite {sqlite3.sqlite_version} has no FTS5 trigram tokenizer; panel user search is disabled")
+        return
+
+    # Panel users come from the downloaded backups (search_index.index_panel_users)
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS panel_user_search
+        USING fts5(name, uuid, admin_name, admin_uuid UNINDEXED, panel_number UNINDEXED, tokenize = 'trigram')
+    ''')
+
+def _drop_admin_search(cursor):
+    """Version 7: drop the admin search index earlier builds of version 6 created (admins are searched in memory)"""
+    for trigger in ('admin_search_insert', 'admin_search_update', 'admin_search_delete'):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    cursor.execute("DROP TABLE IF EXISTS admin_search")
+
+def _add_invoice_status_view(cursor):
+    """Version 8: FIFO paid status and unpaid amount of every invoice addition, from running totals"""
+    # An admin's payments pay off invoices oldest first, so an invoice is paid
+    # once the running total of invoices up to it is covered by all payments
+    cursor.execute('''
+        CREATE VIEW IF NOT EXISTS invoice_status AS
+        SELECT i.id, i.admin_uuid, i.addition_date, i.amount, i.running_total,
+               COALESCE(p.payments_total, 0) AS payments_total,
+               ROUND(i.running_total - COALESCE(p.payments_total, 0), 2) <= 0 AS paid,
+               MAX(0, MIN(i.amount, ROUND(i.running_total - COALESCE(p.payments_total, 0), 2))) AS outstanding
+        FROM (
+            SELECT id, admin_uuid, addition_date, COALESCE(amount, 0) AS amount,
+                   SUM(COALESCE(amount, 0)) OVER (PARTITION BY admin_uuid ORDER BY addition_date, id
+                                                  ROWS UNBOUNDED PRECEDING) AS running_total
+            FROM invoice_additions
+        ) i
+        LEFT JOIN (
+            SELECT admin_uuid, SUM(amount) AS payments_total FROM payments GROUP BY admin_uuid
+        ) p ON p.admin_uuid = i.admin_uuid
+    ''')
+
+# (version, description, step) - applied in order, each in its own transaction
+MIGRATIONS = [
+    (1, "Accounting tables", _create_accounting_tables),
+    (2, "Indexes for admin history and lookups", _add_lookup_indexes),
+    (3, "Payment allocations", _add_payment_allocations),
+    (4, "Money ledger and balance snapshots", _add_ledger),
+    (5, "Trigger-maintained dashboard summary", _add_dashboard_summary),
+    (6, "Panel user search index", _add_search_indexes),
+    (7, "Drop admin search index", _drop_admin_search),
+    (8, "Invoice paid status view", _add_invoice_status_view),
+]
+
+def get_schema_version(conn):
+    """Return the highest migration version applied to the database"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT
+        )
+    ''')
+    result = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return result[0] or 0
+
+def migrate(conn, target_version=None):
+    """Apply all pending migrations (up to target_version) and return the schema version"""
+    current_version = get_schema_version(conn)
+
+    for version, description, step in MIGRATIONS:
+        if version <= current_version:
+            continue
+        if target_version is not None and version > target_version:
+            break
+
+        # DDL is transactional in SQLite: a failing step leaves no partial schema
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN")
+            step(cursor)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            )
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            print(f"Migration {version} ({description}) failed")
+            raise
+
+        print(f"Applied database migration {version}: {description}")
+        current_version = version
+
+    return current_version
+
+def connect(path=DATABASE_FILE, read_only=False, check_same_thread=True):
+    """
+    Open a connection configured for concurrent use: WAL journal, busy timeout
+    and synchronous=NORMAL (safe in WAL mode, one fsync per checkpoint instead
+    of per commit). Read-only connections refuse writes via query_only.
+    With VPN_QUERY_STATS=1 every statement is timed (see query_stats.py).
+    """
+    factory = query_stats.StatsConnection if query_stats.ENABLED else sqlite3.Connection
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=check_same_thread,
+                           factory=factory)
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    # WAL is persistent in the file; setting it again is a no-op
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    if read_only:
+        conn.execute("PRAGMA query_only = ON")
+    return conn
+
+def checkpoint(path=DATABASE_FILE):
+    """Fold the write-ahead log back into the main database file"""
+    conn = connect(path)
+    try:
+        return conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    finally:
+        conn.close()
+
+def archive_path(path=DATABASE_FILE):
+    """The archive database kept next to a main database (vpn_accounting_archive.db)"""
+    root, ext = os.path.splitext(path)
+    return f"{root}_archive{ext or '.db'}"
+
+def attach_archive(conn, path=DATABASE_FILE, create=False):
+    """
+    Attach the archive database (see archive.py) as 'archive'. It holds rows
+    moved out of payments, invoice_additions and invoices with their original
+    ids. Must run outside a transaction; create=True makes the tables.
+    """
+    conn.execute("ATTACH DATABASE ? AS archive", (archive_path(path),))
+    if not create:
+        return
+    conn.execute("PRAGMA archive.journal_mode = WAL")
+    conn.execute("PRAGMA archive.synchronous = NORMAL")
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS archive.payments (
+            id INTEGER PRIMARY KEY,
+            admin_uuid TEXT,
+            amount DECIMAL(15,2),
+            payment_date TEXT,
+            payment_method TEXT,
+            reference TEXT,
+            notes TEXT,
+            archived_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS archive.invoice_additions (
+            id INTEGER PRIMARY KEY,
+            admin_uuid TEXT,
+            amount DECIMAL(15,2),
+            addition_date TEXT,
+            invoice_period_start TEXT,
+            invoice_period_end TEXT,
+            archived_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS archive.invoices (
+            id INTEGER PRIMARY KEY,
+            admin_uuid TEXT,
+            invoice_date TEXT,
+            usage_gb INTEGER,
+            amount DECIMAL(15,2),
+            status TEXT,
+            pdf_path TEXT,
+            archived_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS archive.idx_archive_payments_admin_date
+            ON payments(admin_uuid, payment_date);
+        CREATE INDEX IF NOT EXISTS archive.idx_archive_invoice_additions_admin_date
+            ON invoice_additions(admin_uuid, addition_date);
+        CREATE INDEX IF NOT EXISTS archive.idx_archive_invoices_date
+            ON invoices(invoice_date);
+    ''')
+
+def backup_database(destination, source=DATABASE_FILE, compress=False, progress=None):
+    """
+    Copy a live database with SQLite's online backup API, a few pages at a
+    time, so the application can keep writing. The copy is a self-contained
+    file (no -wal), checked with PRAGMA integrity_check and optionally
+    gzipped (destination should then end in .gz). progress(remaining, total)
+    is called after every step. Returns the destination path.
+    """
+    copy_path = destination + '.tmp'
+    if os.path.exists(copy_path):
+        os.remove(copy_path)
+
+    src = connect(source, read_only=True)
+    dst = sqlite3.connect(copy_path)
+    try:
+        src.backup(dst, pages=BACKUP_PAGES_PER_STEP,
+                   progress=(lambda status, remaining, total: progress(remaining, total)) if progress else None,
+                   sleep=BACKUP_STEP_SLEEP_SECONDS)
+        # The copy inherits WAL mode; switch back so it is one file
+        dst.execute("PRAGMA journal_mode = DELETE")
+        result = dst.execute("PRAGMA integrity_check").fetchall()
+        if result != [('ok',)]:
+            raise sqlite3.DatabaseError(f"Backup failed integrity check: {result[:5]}")
+    except Exception:
+        dst.close()
+        os.remove(copy_path)
+        raise
+    finally:
+        src.close()
+    dst.close()
+
+    if compress:
+        with open(copy_path, 'rb') as f_in, gzip.open(destination, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(copy_path)
+    else:
+        os.replace(copy_path, destination)
+    return destination
+
+class ConnectionManager:
+    """
+    Hands out the application's database connections: a single writer shared
+    by the GUI and invoice processing (serialised by write_lock), and pooled
+    read-only connections. In WAL mode readers see the last committed state
+    and are never blocked by a long write transaction.
+    """
+
+    def __init__(self, path=DATABASE_FILE, pool_size=READER_POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self.write_lock = threading.RLock()
+        self._writer = None
+        self._idle_readers = []
+        self._pool_lock = threading.Lock()
+
+    @property
+    def writer(self):
+        """The writer connection, opened (and migrated) on first use"""
+        with self.write_lock:
+            if self._writer is None:
+                self._writer = connect(self.path, check_same_thread=False)
+                migrate(self._writer)
+                attach_archive(self._writer, self.path, create=True)
+            return self._writer
+
+    @contextmanager
+    def write(self):
+        """Run a write transaction on the writer connection; commits on success, rolls back on error"""
+        with self.write_lock:
+            conn = self.writer
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    @contextmanager
+    def reader(self):
+        """Borrow a read-only connection from the pool"""
+        # Make sure the schema exists before anyone reads (without waiting on
+        # write_lock once the writer is open)
+        if self._writer is None:
+            self.writer
+        with self._pool_lock:
+            conn = self._idle_readers.pop() if self._idle_readers else None
+        if conn is None:
+            conn = connect(self.path, read_only=True, check_same_thread=False)
+            attach_archive(conn, self.path)
+        try:
+            yield conn
+        finally:
+            # End any read transaction so the reader does not pin an old snapshot
+            conn.rollback()
+            with self._pool_lock:
+                if len(self._idle_readers) < self.pool_size:
+                    self._idle_readers.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    def close(self):
+        """Close every connection owned by the manager"""
+        with self._pool_lock:
+            readers, self._idle_readers = self._idle_readers, []
+        for conn in readers:
+            conn.close()
+        with self.write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
@@ -0,0 +1,109 @@
+"""
+Background database worker for the GUI.
+
+All SQL runs on a single worker thread, so a slow query never freezes the Tk
+main loop. Each submitted task gets a Future; its callback is handed back to
+the Tk thread through a result queue that is drained with root.after, so no
+Tk call is ever made from the worker thread.
+"""
+
+import queue
+import sys
+import threading
+from concurrent.futures import Future
+
+# Result polling interval while tasks are outstanding (~60 fps)
+POLL_INTERVAL_MS = 16
+
+class DatabaseWorker:
+    """Runs task(conn, *args) callables on one thread against a ConnectionManager"""
+
+    def __init__(self, root, db, on_error=None):
+        self.root = root
+        self.db = db
+        self.on_error = on_error
+        self._requests = queue.Queue()
+        self._results = queue.Queue()
+        # Only touched on the Tk thread
+        self._outstanding = 0
+        self._polling = False
+        self._thread = threading.Thread(target=self._run, name="database-worker", daemon=True)
+        self._thread.start()
+
+    def submit(self, task, *args, write=False, callback=None, errback=None):
+        """
+        Queue task(conn, *args) and return its Future. Call from the Tk thread.
+
+        Write tasks run on the writer connection and are committed as one
+        transaction (rolled back if they raise); read tasks get a pooled
+        read-only connection. callback(result) or errback(exception) then run
+        on the Tk thread; errors without an errback go to on_error.
+        """
+        future = Future()
+        self._outstanding += 1
+        self._requests.put((future, task, args, write, callback, errback))
+        if not self._polling:
+            self._polling = True
+            self.root.after(POLL_INTERVAL_MS, self._poll)
+        return future
+
+    def _run(self):
+        """Worker thread: execute queued tasks in submission order"""
+        while True:
+            request = self._requests.get()
+            if request is None:
+                break
+            future, task, args, write, callback, errback = request
+            if future.set_running_or_notify_cancel():
+                try:
+                    if write:
+                        with self.db.write() as conn:
+                            result = task(conn, *args)
+                    else:
+                        with self.db.reader() as conn:
+                            result = task(conn, *args)
+                except Exception as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+            self._results.put((future, callback, errback))
+
+    def _poll(self):
+        """Tk thread: deliver finished tasks to their callbacks"""
+        finished = []
+        while True:
+            try:
+                finished.append(self._results.get_nowait())
+            except queue.Empty:
+                break
+        self._outstanding -= len(finished)
+
+        # Schedule the next poll before running callbacks: a callback that opens
+        # a modal dialog runs a nested event loop, and results must keep flowing
+        if self._outstanding > 0:
+            self.root.after(POLL_INTERVAL_MS, self._poll)
+        else:
+            self._polling = False
+
+        for future, callback, errback in finished:
+            if future.cancelled():
+                continue
+            try:
+                error = future.exception()
+                if error is not None:
+                    if errback:
+                        errback(error)
+                    elif self.on_error:
+                        self.on_error(error)
+                    else:
+                        print(f"Database task failed: {error}")
+                elif callback:
+                    callback(future.result())
+            except Exception:
+                # A failing callback must not stop delivery of the others
+                self.root.report_callback_exception(*sys.exc_info())
+
+    def stop(self, timeout=5):
+        """Finish queued tasks and stop the worker thread"""
+        self._requests.put(None)
+        self._thread.join(timeout)
@@ -1,19 +1,34 @@
-from pdf_generation import create_invoices
 import os
 from utils import read_json_file, find_descendants
 from datetime import datetime, timedelta
 import sqlite3
 from decimal import Decimal
 from config import TELEGRAM_ACCOUNTS
+from ledger import ENTRY_INVOICE, record_entry
+from payment_allocations import reallocate
 
 class EnhancedDataProcessor:
     def __init__(self, db_connection):
         self.conn = db_connection
         self.cursor = db_connection.cursor()
     
-    def process_invoices_with_accounting(self, start_date=None, end_date=None, add_to_accounts=False):
+    def process_invoices_with_accounting(self, start_date=None, end_date=None, add_to_accounts=False,
+                                         output_mode='files', zip_bundles=False, archive_format=None,
+                                         progress_callback=None, cancel_event=None):
         """
-        Process invoices and update accounting database with earnings
+        Process invoices and update accounting database with earnings.
+        output_mode 'files' writes one PDF per admin, 'bundle' one multi-page PDF per
+        main admin; zip_bundles packs each Telegram account's folder into a zip.
+        archive_format ('zip' or 'tar') renders every PDF in memory into one archive
+        for the whole run instead of writing individual files.
+        
+        progress_callback(event) is called (on the processing thread) as each panel
+        starts and after each main admin, with a dict of panel, panels, admin,
+        admins and name. Setting cancel_event (a threading.Event) stops the run
+        before the next main admin; the admins already done stay committed.
+        With add_to_accounts each admin's amounts are committed in one transaction,
+        and admins that already have an invoice addition for the period are skipped.
+        Returns a summary dict: total_earnings, admins, panels, skipped and cancelled.
         """
         if start_date is None:
             start_date = datetime.now() - timedelta(days=30)
@@ -30,19 +45,62 @@ class EnhancedDataProcessor:
                           if filename.endswith(".json")]
         json_file_paths.sort()
         
+        # The PDF machinery (reportlab, fonts) is only loaded once invoices are generated
+        from pdf_generation import load_admin_balances, zip_invoice_folders, InvoiceArchive
+        
+        # Load every admin's previous balance once for the whole run
+        # (each main admin is only updated after its own PDFs are rendered)
+        balances = load_admin_balances(self.conn)
+        
+        archive = None
+        if archive_format:
+            archive_name = f"invoices_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{archive_format}"
+            archive = InvoiceArchive(os.path.join("invoices", archive_name), archive_format)
+        
+        summary = {'total_earnings': 0, 'admins': 0, 'panels': 0, 'skipped': 0, 'cancelled': False}
+        try:
+            self._process_backup_files(json_file_paths, start_date, end_date, add_to_accounts,
+                                       balances, output_mode, archive, summary, progress_callback, cancel_event)
+        finally:
+            if archive is not None:
+                archive.close()
+        
+        # A cancelled run still zips what it generated, so the output layout is the same
+        if zip_bundles and archive is None:
+            zip_invoice_folders()
+        
+        return summary
+    
+    def _process_backup_files(self, json_file_paths, start_date, end_date, add_to_accounts,
+                              balances, output_mode, archive, summary, progress_callback=None, cancel_event=None):
+        """Generate invoices and earnings for every main admin in the backup files, counting them in summary"""
+        from pdf_generation import create_invoices
+        
         panel_number = 1
-        total_earnings = 0
         processed_admins = set()  # Track processed admins to avoid duplicates
         
+        def report(admin_index, admin_count, name=None):
+            if progress_callback:
+                progress_callback({'panel': panel_number, 'panels': len(json_file_paths),
+                                   'admin': admin_index, 'admins': admin_count, 'name': name})
+        
         for json_file in json_file_paths:
             data = read_json_file(json_file)
             admin_users = data.get('admin_users', [])
             
-            for admin in admin_users:
-                # Only process main admins (not Owner, comment != '-', and not already processed)
-                if ((admin['name'] != 'Owner') & 
-                    (admin['comment'] != '-') & 
-                    (admin['uuid'] not in processed_admins)):
+            # Main admins: not Owner and comment != '-'
+            main_admins = [admin for admin in admin_users
+                           if admin['name'] != 'Owner' and admin['comment'] != '-']
+            report(0, len(main_admins))
+            
+            for admin_index, admin in enumerate(main_admins, 1):
+                # Stop between admins, never halfway through one
+                if cancel_event is not None and cancel_event.is_set():
+                    summary['cancelled'] = True
+                    return
+                
+                # Skip admins already processed as another admin's descendant
+                if admin['uuid'] not in processed_admins:
                     
                     # Use the provided start_date instead of database last_invoice_date
                     # This ensures consistent date ranges for invoice generation
@@ -65,35 +123,45 @@ class EnhancedDataProcessor:
                     for desc_admin in descendant_admins:
                         processed_admins.add(desc_admin['uuid'])
                     
-                    # Calculate earnings for this admin and all descendants
+                    # Never add the same period to an admin's account twice (e.g. re-running a cancelled run)
+                    if add_to_accounts and self.has_period_addition(admin['uuid'], start_date, end_date):
+                        print(f"⚠️  Skipping admin {admin.get('name', 'Unknown')}: invoice amounts for "
+                              f"{start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')} were already added")
+                        summary['skipped'] += 1
+                        report(admin_index, len(main_admins), admin.get('name'))
+                        continue
+                    
+                    # Generate PDF invoices FIRST (before updating database)
+                    # This ensures the remainder calculation uses only previous amounts
+                    # The PDF will show: current invoice amounts + previous unpaid remainder
                     print(f"Processing admin {admin.get('name', 'Unknown')} from {prev_invoice_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
+                    pdf_paths = create_invoices(descendant_admins, data.get('users', []), 
+                                  prev_invoice_date.strftime('%Y-%m-%d'), 
+                                  panel_number, [0], end_date.strftime('%Y-%m-%d'), balances,
+                                  output_mode, archive)
+                    
+                    # Calculate earnings for this admin and all descendants
                     admin_earnings = self.calculate_admin_earnings(
                         descendant_admins, 
                         data.get('users', []), 
                         prev_invoice_date, 
                         end_date,
-                        panel_number
+                        panel_number,
+                        pdf_paths
                     )
                     
-                    # Generate PDF invoices FIRST (before updating database)
-                    # This ensures the remainder calculation uses only previous amounts
-                    # The PDF will show: current invoice amounts + previous unpaid remainder
-                    create_invoices(descendant_admins, data.get('users', []), 
-                                  prev_invoice_date.strftime('%Y-%m-%d'), 
-                                  panel_number, [0], end_date.strftime('%Y-%m-%d'))
-                    
                     # Update database with earnings for the main admin only AFTER generating PDFs
                     # This prevents double-counting current amounts as "previous remainder"
                     if add_to_accounts:
-                        self.update_admin_earnings(admin['uuid'], admin_earnings)
-                        # Track the invoice addition
-                        self.track_invoice_addition(admin['uuid'], admin_earnings, start_date, end_date)
+                        self.add_earnings_to_account(admin['uuid'], admin_earnings, start_date, end_date)
                     
-                    total_earnings += admin_earnings
+                    summary['total_earnings'] += admin_earnings
+                    summary['admins'] += 1
+                
+                report(admin_index, len(main_admins), admin.get('name'))
             
+            summary['panels'] += 1
             panel_number += 1
-        
-        return total_earnings
     
     def get_last_invoice_date(self, admin_uuid):
         """Get the last invoice date for an admin from database"""
@@ -126,7 +194,7 @@ class EnhancedDataProcessor:
         # If parsing fails, return default date
         return datetime(2023, 1, 1)
     
-    def calculate_admin_earnings(self, descendant_admins, users, start_date, end_date, panel_number):
+    def calculate_admin_earnings(self, descendant_admins, users, start_date, end_date, panel_number, pdf_paths=None):
         """Calculate total earnings for an admin and their descendants"""
         total_earnings = 0
         
@@ -162,7 +230,8 @@ class EnhancedDataProcessor:
             
             # Store invoice data in database for main admins only (for tracking purposes)
             if total_usage > 0:  # Only store if there's actual usage
-                self.store_invoice_data(admin_uuid, end_date, total_usage, admin_earnings)
+                self.store_invoice_data(admin_uuid, end_date, total_usage, admin_earnings,
+                                        (pdf_paths or {}).get(admin_uuid))
         
         return total_earnings
     
@@ -198,8 +267,27 @@ class EnhancedDataProcessor:
             result = self.cursor.fetchone()
             return result[0] if result else 1000  # Default price
     
+    def has_period_addition(self, admin_uuid, start_date, end_date):
+        """Whether the admin already has an invoice addition for the period start_date to end_date"""
+        self.cursor.execute("""
+            SELECT 1 FROM invoice_additions
+            WHERE admin_uuid = ? AND invoice_period_start = ? AND invoice_period_end = ?
+            LIMIT 1
+        """, (admin_uuid, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
+        return self.cursor.fetchone() is not None
+    
+    def add_earnings_to_account(self, admin_uuid, earnings, start_date, end_date):
+        """Add a period's earnings to the admin's account: totals, invoice addition and ledger in one commit"""
+        try:
+            self.update_admin_earnings(admin_uuid, earnings)
+            self.track_invoice_addition(admin_uuid, earnings, start_date, end_date)
+        except Exception:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+    
     def update_admin_earnings(self, admin_uuid, earnings):
-        """Update admin's total earnings in database"""
+        """Update admin's total earnings in database (the caller commits)"""
         # Only update earnings for admins that exist in the database
         # (main admins, not descendants)
         self.cursor.execute("SELECT uuid FROM admin_accounts WHERE uuid = ?", (admin_uuid,))
@@ -209,27 +297,30 @@ class EnhancedDataProcessor:
                 SET total_earned = total_earned + ?, last_invoice_date = ?
                 WHERE uuid = ?
             """, (earnings, datetime.now().strftime('%Y-%m-%d'), admin_uuid))
-            
-            self.conn.commit()
     
     def track_invoice_addition(self, admin_uuid, amount, start_date, end_date):
-        """Track invoice addition with date and period"""
+        """Track invoice addition with date and period (the caller commits)"""
+        addition_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         self.cursor.execute("""
             INSERT INTO invoice_additions (admin_uuid, amount, addition_date, invoice_period_start, invoice_period_end)
             VALUES (?, ?, ?, ?, ?)
-        """, (admin_uuid, amount, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 
+        """, (admin_uuid, amount, addition_date, 
               start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
-        
-        self.conn.commit()
+        # Spend any unspent payment credit on the new invoice
+        invoice_id = self.cursor.lastrowid
+        reallocate(self.conn, admin_uuid, (addition_date, invoice_id))
+        record_entry(self.conn, admin_uuid, ENTRY_INVOICE, addition_date, earned=amount,
+                     source_table='invoice_additions', source_id=invoice_id)
     
-    def store_invoice_data(self, admin_uuid, invoice_date, usage_gb, amount):
+    def store_invoice_data(self, admin_uuid, invoice_date, usage_gb, amount, pdf_path=None):
         """Store invoice data in database"""
         # Only store invoice data for admins that exist in the database
         # (main admins, not descendants)
         self.cursor.execute("SELECT uuid FROM admin_accounts WHERE uuid = ?", (admin_uuid,))
         if self.cursor.fetchone():
-            # Find the PDF file path
-            pdf_path = self.find_invoice_pdf(admin_uuid, invoice_date)
+            # Find the PDF file path (a file below invoices/ or "<archive>::<member>")
+            if pdf_path is None:
+                pdf_path = self.find_invoice_pdf(admin_uuid, invoice_date)
             
             self.cursor.execute("""
                 INSERT INTO invoices (admin_uuid, invoice_date, usage_gb, amount, status, pdf_path)
@@ -411,7 +502,9 @@ class EnhancedDataProcessor:
         
         return descendants
 
-def process_invoices_with_accounting(db_connection, start_date=None, end_date=None, add_to_accounts=False):
+def process_invoices_with_accounting(db_connection, start_date=None, end_date=None, add_to_accounts=False,
+                                     output_mode='files', zip_bundles=False, archive_format=None,
+                                     progress_callback=None, cancel_event=None):
     """Main function to process invoices with accounting integration"""
     # Reload config to get updated TELEGRAM_ACCOUNTS
     import importlib
@@ -419,4 +512,6 @@ def process_invoices_with_accounting(db_connection, start_date=None, end_date=No
     importlib.reload(config)
     
     processor = EnhancedDataProcessor(db_connection)
-    return processor.process_invoices_with_accounting(start_date, end_date, add_to_accounts) 
\ No newline at end of file
+    return processor.process_invoices_with_accounting(start_date, end_date, add_to_accounts,
+                                                      output_mode, zip_bundles, archive_format,
+                                                      progress_callback, cancel_event) 
\ No newline at end of file
@@ -5,14 +5,25 @@ import os
 from datetime import datetime, timedelta
 import threading
 import importlib
-from file_management import download_all_backup_files
-from data_processing import process_invoices
-from utils import delete_folder, read_json_file, find_descendants
+import queue
+# PDF generation (reportlab, fonts) and downloading (requests) are imported on
+# first use inside the handlers so they do not slow down application startup
+from utils import delete_folder, read_json_file, find_descendants, normalize_search_text
 import config
-import sqlite3
+from database import DATABASE_FILE, ConnectionManager
+from db_worker import DatabaseWorker
+import accounting_store
+import ledger
+import search_index
+from tree_sync import TreeviewSync
+from archive import CARRY_FORWARD_PERIOD, archive_closed_periods
+import ui_profiler
 from decimal import Decimal, ROUND_HALF_UP
 
 class VPNAccountingApp:
+    # Delay between the last keystroke in the admin search box and filtering
+    SEARCH_DEBOUNCE_MS = 150
+    
     def __init__(self, root):
         self.root = root
         self.root.title("VPN Panel Accounting System")
@@ -30,93 +41,78 @@ class VPNAccountingApp:
         self.notebook = ttk.Notebook(self.main_container)
         self.notebook.pack(fill=tk.BOTH, expand=True)
         
-        # Create tabs
-        self.create_dashboard_tab()
-        self.create_download_tab()
-        self.create_accounting_tab()
-        self.create_invoices_tab()
-        
-        # Initialize admin accounts from config
+        # Active admins by UUID (the admin list's row ids), shared by the
+        # accounting handlers, and the admin shown on the detail page
+        self.admin_cache = {}
+        self.current_admin_uuid = None
+        # Detail pages already read, by (uuid, include_archive); dropped when
+        # the admin's list row changes or its history is edited
+        self.admin_detail_cache = {}
+        
+        # The admin list is filtered in memory: rows in display order with their
+        # precomputed search keys, and the pending (debounced) filter callback
+        self.admin_search_rows = []
+        self.search_after_id = None
+        
+        # History views read the archive database only when asked
+        self.include_archive_var = tk.BooleanVar(value=False)
+        self.archived_invoice_ids = set()
+        self.archived_payment_ids = set()
+        
+        # Detail page histories are read a page at a time: the (date, id) key of
+        # the last row shown, whether more rows remain, and whether a page is on
+        # its way. generation changes whenever the page is reloaded for an admin.
+        self.history_pages = {kind: {'before': None, 'done': True, 'loading': False, 'generation': 0}
+                              for kind in ('invoices', 'payments')}
+        
+        # Create tabs: each is built (and loads its data) on its first visit
+        self.lazy_tabs = {}
+        self.notebook.bind('<<NotebookTabChanged>>', self.build_selected_tab)
+        self.add_lazy_tab("Dashboard", self.create_dashboard_tab)
+        self.add_lazy_tab("Download Backups", self.create_download_tab)
+        self.add_lazy_tab("Accounting", self.create_accounting_tab)
+        self.add_lazy_tab("Invoices", self.create_invoices_tab)
+        # The first tab once the window is up
+        self.root.after_idle(self.build_selected_tab)
+        
+        # Initialize admin accounts from config (in the background; the built
+        # tabs refresh when it finishes)
         self.sync_admin_accounts_with_config()
-        
-        # Load initial data
-        self.load_dashboard_data()
-        
+    
+    def add_lazy_tab(self, text, builder):
+        """Add an empty notebook tab that builder(frame) fills in on first visit"""
+        frame = ttk.Frame(self.notebook)
+        self.notebook.add(frame, text=text)
+        self.lazy_tabs[str(frame)] = (frame, builder)
+    
+    def build_selected_tab(self, event=None):
+        """Build the selected tab if it has not been built yet"""
+        frame, builder = self.lazy_tabs.pop(self.notebook.select(), (None, None))
+        if builder:
+            builder(frame)
+
     def init_database(self):
         """Initialize SQLite database for accounting data"""
-        self.conn = sqlite3.connect('vpn_accounting.db')
-        self.cursor = self.conn.cursor()
-        
-        # Create tables
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS admin_accounts (
-                uuid TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                telegram_id INTEGER,
-                panel_number INTEGER,
-                fa_number TEXT,
-                price_per_gb INTEGER DEFAULT 1000,
-                total_earned DECIMAL(15,2) DEFAULT 0,
-                total_paid DECIMAL(15,2) DEFAULT 0,
-                last_payment_date TEXT,
-                last_invoice_date TEXT,
-                status TEXT DEFAULT 'active'
-            )
-        ''')
-        
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS payments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                admin_uuid TEXT,
-                amount DECIMAL(15,2),
-                payment_date TEXT,
-                payment_method TEXT,
-                reference TEXT,
-                notes TEXT,
-                FOREIGN KEY (admin_uuid) REFERENCES admin_accounts (uuid)
-            )
-        ''')
-        
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS invoices (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                admin_uuid TEXT,
-                invoice_date TEXT,
-                usage_gb INTEGER,
-                amount DECIMAL(15,2),
-                status TEXT DEFAULT 'unpaid',
-                pdf_path TEXT,
-                FOREIGN KEY (admin_uuid) REFERENCES admin_accounts (uuid)
-            )
-        ''')
-        
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS backup_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                panel_number INTEGER,
-                backup_date TEXT,
-                data_hash TEXT,
-                file_path TEXT
-            )
-        ''')
-        
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS invoice_additions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                admin_uuid TEXT,
-                amount DECIMAL(15,2),
-                addition_date TEXT,
-                invoice_period_start TEXT,
-                invoice_period_end TEXT,
-                FOREIGN KEY (admin_uuid) REFERENCES admin_accounts (uuid)
-            )
-        ''')
-        
-        self.conn.commit()
-        
-
-        
-        self.conn.commit()
+        # WAL-mode connections: one writer (created and migrated by the first
+        # worker task, off the Tk thread) plus pooled read-only connections
+        self.db = ConnectionManager(DATABASE_FILE)
+        
+        # All SQL runs on the worker thread; results come back through root.after
+        self.db_worker = DatabaseWorker(self.root, self.db, on_error=self.show_database_error)
+        
+        # Invoice runs take minutes: they get their own worker thread and writer
+        # connection, so the rest of the GUI keeps reading and writing meanwhile
+        self.job_db = ConnectionManager(DATABASE_FILE, pool_size=0)
+        self.job_worker = DatabaseWorker(self.root, self.job_db, on_error=self.show_database_error)
+        self.invoice_cancel_event = None
+        self.invoice_progress = queue.Queue()
+        
+        # Close the balance snapshots of months finished since the last run
+        self.db_worker.submit(ledger.take_snapshots, write=True)
+    
+    def show_database_error(self, error):
+        """Report a failed background database task"""
+        messagebox.showerror("Error", f"Database error: {str(error)}")
     
     def format_amount_for_display(self, amount):
         """Convert amount to display format (divide by 1000)"""
@@ -137,111 +133,35 @@ class VPNAccountingApp:
         except ValueError:
             return 0
     
-    def sync_admin_accounts_with_config(self):
+    def sync_admin_accounts_with_config(self, on_done=None):
         """Synchronize admin accounts with TELEGRAM_ACCOUNTS config - add new and remove deleted"""
-        importlib.reload(config)  # ensures latest file content
-        telegram_accounts = config.TELEGRAM_ACCOUNTS  # fresh dictionary
-        
-        new_admins_count = 0
-        removed_admins_count = 0
-        
-        # Get all UUIDs currently in the database
-        self.cursor.execute("SELECT uuid FROM admin_accounts")
-        db_uuids = {row[0] for row in self.cursor.fetchall()}
-        
-        # Get all UUIDs from config
-        config_uuids = set(telegram_accounts.keys())
-        
-        # Find admins to remove (in database but not in config)
-        uuids_to_remove = db_uuids - config_uuids
-        
-        # Remove admins that are no longer in config
-        for uuid in uuids_to_remove:
-            # Check if admin has any financial data
-            self.cursor.execute("""
-                SELECT 
-                    (SELECT COUNT(*) FROM payments WHERE admin_uuid = ?) as payment_count,
-                    (SELECT COUNT(*) FROM invoice_additions WHERE admin_uuid = ?) as invoice_count,
-                    total_earned, total_paid
-                FROM admin_accounts WHERE uuid = ?
-            """, (uuid, uuid, uuid))
-            
-            result = self.cursor.fetchone()
-            if result:
-                payment_count, invoice_count, total_earned, total_paid = result
-                
-                # If admin has financial data, mark as inactive instead of deleting
-                if payment_count > 0 or invoice_count > 0 or (total_earned or 0) > 0 or (total_paid or 0) > 0:
-                    self.cursor.execute("UPDATE admin_accounts SET status = 'inactive' WHERE uuid = ?", (uuid,))
-                    print(f"Admin {uuid} marked as inactive (has financial data)")
-                else:
-                    # Safe to delete if no financial data
-                    self.cursor.execute("DELETE FROM admin_accounts WHERE uuid = ?", (uuid,))
-                    print(f"Admin {uuid} deleted (no financial data)")
-                
-                removed_admins_count += 1
-        
-        # Add new admins from config
-        for uuid, data in telegram_accounts.items():
-            telegram_id, fa_number, price_per_gb = data
-            
-            # Check if admin already exists
-            self.cursor.execute("SELECT uuid FROM admin_accounts WHERE uuid = ?", (uuid,))
-            if not self.cursor.fetchone():
-                # Get admin name from backup files if available
-                admin_name = self.get_admin_name_from_backups(uuid)
-                
-                # Use the price from the data tuple (already imported from config)
-                price_per_gb = data[2]  # Price per GB is at index 2
-                
-                # Add all admins from TELEGRAM_ACCOUNTS to the database
-                self.cursor.execute('''
-                    INSERT INTO admin_accounts (uuid, name, telegram_id, panel_number, fa_number, price_per_gb)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (uuid, admin_name or f"Admin_{uuid[:8]}", telegram_id, telegram_id, fa_number, price_per_gb))
-                
-                new_admins_count += 1
-                print(f"New admin added: {admin_name or f'Admin_{uuid[:8]}'} ({uuid})")
-        
-        # Update admin names from backup files
-        self.update_admin_names_from_backups()
-        
-        self.conn.commit()
+        def sync(conn):
+            # Config and backup files are read on the worker thread too
+            importlib.reload(config)  # ensures latest file content
+            telegram_accounts = dict(config.TELEGRAM_ACCOUNTS)  # fresh dictionary
+            admin_names = self.get_admin_names_from_backups()
+            return accounting_store.sync_admin_accounts(conn, telegram_accounts, admin_names)
+        
+        def synced(counts):
+            self.load_admin_accounts()
+            self.load_dashboard_data()
+            if on_done:
+                on_done(*counts)
         
-        # Return counts
-        return new_admins_count, removed_admins_count
+        # on_done receives (new_admins_count, removed_admins_count)
+        return self.db_worker.submit(sync, write=True, callback=synced)
     
     def initialize_admin_accounts(self):
         """Initialize admin accounts from TELEGRAM_ACCOUNTS config (legacy method)"""
-        new_admins_count, removed_admins_count = self.sync_admin_accounts_with_config()
-        return new_admins_count
-    
-    def get_admin_name_from_backups(self, uuid):
-        """Get admin name from backup files"""
-        downloads_folder = "downloads"
-        if not os.path.exists(downloads_folder):
-            return None
-            
-        for filename in os.listdir(downloads_folder):
-            if filename.endswith('.json'):
-                file_path = os.path.join(downloads_folder, filename)
-                try:
-                    data = read_json_file(file_path)
-                    for admin in data.get('admin_users', []):
-                        if admin.get('uuid') == uuid:
-                            return admin.get('name')
-                except:
-                    continue
-        return None
+        return self.sync_admin_accounts_with_config()
     
-    def update_admin_names_from_backups(self):
-        """Update admin names in database from backup files"""
+    def get_admin_names_from_backups(self):
+        """Map admin UUID to name from the downloaded backup files"""
         downloads_folder = "downloads"
+        admin_names = {}
         if not os.path.exists(downloads_folder):
-            return
+            return admin_names
         
-        # Get all admin names from backup files
-        admin_names = {}
         for filename in os.listdir(downloads_folder):
             if filename.endswith('.json'):
                 file_path = os.path.join(downloads_folder, filename)
@@ -254,21 +174,10 @@ class VPNAccountingApp:
                             admin_names[uuid] = name
                 except:
                     continue
-        
-        # Update admin names in database
-        for uuid, name in admin_names.items():
-            self.cursor.execute("""
-                UPDATE admin_accounts 
-                SET name = ? 
-                WHERE uuid = ? AND (name LIKE 'Admin_%' OR name IS NULL)
-            """, (name, uuid))
-        
-        self.conn.commit()
+        return admin_names
     
-    def create_dashboard_tab(self):
+    def create_dashboard_tab(self, dashboard_frame):
         """Create dashboard tab with overview statistics"""
-        dashboard_frame = ttk.Frame(self.notebook)
-        self.notebook.add(dashboard_frame, text="Dashboard")
         
         # Title
         title_label = ttk.Label(dashboard_frame, text="VPN Panel Accounting Dashboard", 
@@ -329,11 +238,11 @@ class VPNAccountingApp:
         refresh_btn = ttk.Button(dashboard_frame, text="Refresh Dashboard", 
                                 command=self.load_dashboard_data)
         refresh_btn.pack(pady=10)
+        
+        self.load_dashboard_data()
     
-    def create_download_tab(self):
+    def create_download_tab(self, download_frame):
         """Create download tab for managing backup downloads"""
-        download_frame = ttk.Frame(self.notebook)
-        self.notebook.add(download_frame, text="Download Backups")
         
         # Title
         title_label = ttk.Label(download_frame, text="Download Panel Backups", 
@@ -388,10 +297,8 @@ class VPNAccountingApp:
         # Load existing backup files
         self.load_backup_files()
     
-    def create_accounting_tab(self):
+    def create_accounting_tab(self, accounting_frame):
         """Create accounting tab for managing admin accounts and payments"""
-        accounting_frame = ttk.Frame(self.notebook)
-        self.notebook.add(accounting_frame, text="Accounting")
         
         # Title
         title_label = ttk.Label(accounting_frame, text="Admin Account Management", 
@@ -428,6 +335,12 @@ class VPNAccountingApp:
         
         ttk.Button(button_frame, text="🔄 Refresh Names", 
                   command=self.refresh_admin_names).pack(side=tk.RIGHT)
+        ttk.Button(button_frame, text="📥 Import Payments", 
+                  command=self.import_payments).pack(side=tk.RIGHT, padx=(0, 10))
+        ttk.Button(button_frame, text="🗄️ Archive Old Records", 
+                  command=self.archive_old_records).pack(side=tk.RIGHT, padx=(0, 10))
+        ttk.Button(button_frame, text="💸 Who Owes What", 
+                  command=self.show_outstanding_report).pack(side=tk.RIGHT, padx=(0, 10))
         
         # Search frame
         search_frame = ttk.Frame(self.admin_list_page)
@@ -445,6 +358,7 @@ class VPNAccountingApp:
         
         # Clear search button
         ttk.Button(search_frame, text="Clear", command=self.clear_search).pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Button(search_frame, text="🔎 Find Panel User", command=self.find_panel_user).pack(side=tk.LEFT, padx=(10, 0))
         
         # Admin treeview with scrollbars
         tree_frame = ttk.Frame(self.admin_list_page)
@@ -483,6 +397,11 @@ class VPNAccountingApp:
         tree_frame.grid_rowconfigure(0, weight=1)
         tree_frame.grid_columnconfigure(0, weight=1)
         
+        # Row colors follow the balance, so a row's tag changes only when its totals do
+        self.admin_tree.tag_configure('owing', background='#ffffff', foreground='#2c3e50')
+        self.admin_tree.tag_configure('settled', background='#f8f9fa', foreground='#2c3e50')
+        self.admin_tree_sync = TreeviewSync(self.admin_tree)
+        
         # Bind single-click event to open admin detail page
         self.admin_tree.bind('<ButtonRelease-1>', self.open_admin_detail_page)
         
@@ -603,6 +522,11 @@ class VPNAccountingApp:
         ttk.Button(payment_buttons_frame, text="🗑️ Clear Form", 
                   command=self.clear_payment_form).pack(side=tk.LEFT)
         
+        # Archived rows are shown greyed out and cannot be edited
+        ttk.Checkbutton(self.content_scrollable_frame, text="🗄️ Include archived history",
+                       variable=self.include_archive_var,
+                       command=lambda: self.refresh_admin_detail()).pack(anchor=tk.W, pady=(0, 10))
+        
         # Invoice history section
         invoice_frame = ttk.LabelFrame(self.content_scrollable_frame, text="📄 Invoice History", padding=15)
         invoice_frame.pack(fill=tk.BOTH, expand=True, pady=(0, 20))
@@ -622,7 +546,8 @@ class VPNAccountingApp:
         # Invoice treeview scrollbar
         invoice_scrollbar = ttk.Scrollbar(invoice_tree_frame, orient=tk.VERTICAL, 
                                          command=self.invoice_tree.yview)
-        self.invoice_tree.configure(yscrollcommand=invoice_scrollbar.set)
+        self.invoice_tree.configure(yscrollcommand=lambda first, last: self.on_history_scroll(
+            'invoices', invoice_scrollbar, first, last))
         
         self.invoice_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         invoice_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
@@ -658,7 +583,8 @@ class VPNAccountingApp:
         # Payment treeview scrollbar
         payment_scrollbar = ttk.Scrollbar(payment_tree_frame, orient=tk.VERTICAL, 
                                          command=self.payment_tree.yview)
-        self.payment_tree.configure(yscrollcommand=payment_scrollbar.set)
+        self.payment_tree.configure(yscrollcommand=lambda first, last: self.on_history_scroll(
+            'payments', payment_scrollbar, first, last))
         
         self.payment_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         payment_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
@@ -712,22 +638,22 @@ class VPNAccountingApp:
         admin_frame = ttk.LabelFrame(main_frame, text="Select Admin", padding=15)
         admin_frame.pack(fill=tk.X, pady=(0, 20))
         
-        # Get all admins
-        self.cursor.execute('''
-            SELECT name, fa_number, total_earned, total_paid
-            FROM admin_accounts
-            ORDER BY name
-        ''')
-        admins = self.cursor.fetchall()
-        
-        # Admin selection dropdown
+        # Admin selection dropdown (filled once the admin list is loaded)
         ttk.Label(admin_frame, text="Admin:", font=('Arial', 11, 'bold')).pack(anchor=tk.W)
         admin_var = tk.StringVar()
-        admin_names = [f"{admin[0]} ({admin[1]})" for admin in admins]
-        admin_combo = ttk.Combobox(admin_frame, textvariable=admin_var, values=admin_names, 
+        admin_combo = ttk.Combobox(admin_frame, textvariable=admin_var, values=[], 
                                   state='readonly', font=('Arial', 11))
         admin_combo.pack(fill=tk.X, pady=(5, 0))
         
+        # Get all admins
+        admins = []
+        
+        def show_admins(rows):
+            admins[:] = rows
+            admin_combo['values'] = [f"{admin[1]} ({admin[2]})" for admin in admins]
+        
+        self.db_worker.submit(accounting_store.list_all_admins, callback=show_admins)
+        
         # Current balance display
         balance_frame = ttk.Frame(admin_frame)
         balance_frame.pack(fill=tk.X, pady=(15, 0))
@@ -758,18 +684,14 @@ class VPNAccountingApp:
         
         def update_balance_display(*args):
             """Update balance display when admin is selected"""
-            if admin_var.get():
-                admin_name = admin_var.get().split(' (')[0]
-                for admin in admins:
-                    if admin[0] == admin_name:
-                        earned, paid = admin[2], admin[3]
-                        balance = earned - paid
-                        current_balance_var.set(f"Balance: {self.format_amount_for_display(balance)}K تومان")
-                        break
+            if admin_combo.current() >= 0:
+                earned, paid = admins[admin_combo.current()][3:5]
+                balance = earned - paid
+                current_balance_var.set(f"Balance: {self.format_amount_for_display(balance)}K تومان")
         
         def add_indebtedness():
             """Add indebtedness as invoice record"""
-            if not admin_var.get():
+            if admin_combo.current() < 0:
                 messagebox.showwarning("Warning", "Please select an admin")
                 return
             
@@ -777,40 +699,23 @@ class VPNAccountingApp:
                 messagebox.showwarning("Warning", "Please enter indebtedness amount")
                 return
             
-            admin_name = admin_var.get().split(' (')[0]
+            admin_uuid, admin_name = admins[admin_combo.current()][:2]
             amount = self.parse_amount_from_input(amount_var.get())
             notes = notes_var.get()
-            
-            # Get admin UUID
-            self.cursor.execute("SELECT uuid FROM admin_accounts WHERE name = ?", (admin_name,))
-            result = self.cursor.fetchone()
-            if not result:
-                messagebox.showerror("Error", "Admin not found")
-                return
-            
-            admin_uuid = result[0]
             current_date = datetime.now().strftime('%Y-%m-%d')
             
-            # Add indebtedness as invoice record
-            self.cursor.execute('''
-                INSERT INTO invoice_additions (admin_uuid, amount, addition_date, invoice_period_start, invoice_period_end)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (admin_uuid, amount, current_date, "Start Up Indebtedness", "Start Up Indebtedness"))
-            
-            # Update admin total earned
-            self.cursor.execute('''
-                UPDATE admin_accounts 
-                SET total_earned = total_earned + ?
-                WHERE uuid = ?
-            ''', (amount, admin_uuid))
+            def add(conn):
+                # Add indebtedness as invoice record
+                accounting_store.add_indebtedness(conn, admin_uuid, amount, current_date)
             
-            self.conn.commit()
+            def added(_):
+                # Refresh displays
+                self.load_admin_accounts()
+                self.load_dashboard_data()
+                messagebox.showinfo("Success", f"Indebtedness of {self.format_amount_for_display(amount)}K تومان added for {admin_name}")
+                dialog.destroy()
             
-            # Refresh displays
-            self.load_admin_accounts()
-            self.load_dashboard_data()
-            messagebox.showinfo("Success", f"Indebtedness of {self.format_amount_for_display(amount)}K تومان added for {admin_name}")
-            dialog.destroy()
+            self.db_worker.submit(add, write=True, callback=added)
         
         # Bind admin selection to update balance
         admin_var.trace('w', update_balance_display)
@@ -820,13 +725,307 @@ class VPNAccountingApp:
                   style='Accent.TButton').pack(side=tk.LEFT, padx=(0, 10))
         ttk.Button(button_frame, text="❌ Cancel", command=dialog.destroy).pack(side=tk.RIGHT)
     
+    def import_payments(self):
+        """Import many payments at once from a CSV file or pasted statement text"""
+        import payment_import
+        
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Import Payments")
+        dialog.geometry("800x600")
+        dialog.transient(self.root)
+        dialog.grab_set()
+        
+        # Center dialog
+        dialog.update_idletasks()
+        x = (dialog.winfo_screenwidth() // 2) - (800 // 2)
+        y = (dialog.winfo_screenheight() // 2) - (600 // 2)
+        dialog.geometry(f"800x600+{x}+{y}")
+        
+        main_frame = ttk.Frame(dialog, padding=20)
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        ttk.Label(main_frame, text="Import Payments", 
+                 font=('Arial', 16, 'bold')).pack(pady=(0, 10))
+        ttk.Label(main_frame, text="One payment per line: admin (name, FA number or UUID), amount, date. "
+                                   "A header row may name the columns.",
+                 font=('Arial', 10)).pack(anchor=tk.W)
+        
+        # Source text (pasted or loaded from a file)
+        text_frame = ttk.Frame(main_frame)
+        text_frame.pack(fill=tk.BOTH, expand=True, pady=(10, 10))
+        source_text = tk.Text(text_frame, height=8, font=('Arial', 10))
+        source_text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        text_scrollbar = ttk.Scrollbar(text_frame, orient=tk.VERTICAL, command=source_text.yview)
+        source_text.configure(yscrollcommand=text_scrollbar.set)
+        text_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        # Options
+        options_frame = ttk.Frame(main_frame)
+        options_frame.pack(fill=tk.X, pady=(0, 10))
+        
+        def open_csv():
+            file_path = filedialog.askopenfilename(
+                parent=dialog, title="Select payments file",
+                filetypes=[("CSV files", "*.csv"), ("Text files", "*.txt"), ("All files", "*.*")]
+            )
+            if file_path:
+                with open(file_path, 'r', encoding='utf-8-sig') as f:
+                    source_text.delete('1.0', tk.END)
+                    source_text.insert('1.0', f.read())
+        
+        ttk.Button(options_frame, text="📂 Open CSV...", command=open_csv).pack(side=tk.LEFT)
+        amounts_in_k_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(options_frame, text="Amounts in K تومان", 
+                       variable=amounts_in_k_var).pack(side=tk.LEFT, padx=(15, 0))
+        ttk.Label(options_frame, text="Date for rows without one:").pack(side=tk.LEFT, padx=(15, 5))
+        default_date_entry = ttk.Entry(options_frame, width=12)
+        default_date_entry.pack(side=tk.LEFT)
+        default_date_entry.insert(0, datetime.now().strftime('%Y-%m-%d'))
+        
+        # Preview
+        preview_frame = ttk.Frame(main_frame)
+        preview_frame.pack(fill=tk.BOTH, expand=True)
+        columns = ('Line', 'Admin', 'Amount', 'Date', 'Status')
+        preview_tree = ttk.Treeview(preview_frame, columns=columns, show='headings', height=8)
+        for col, width in zip(columns, (50, 220, 110, 100, 260)):
+            preview_tree.heading(col, text=col)
+            preview_tree.column(col, width=width)
+        preview_tree.tag_configure('error', foreground='red')
+        preview_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        preview_scrollbar = ttk.Scrollbar(preview_frame, orient=tk.VERTICAL, command=preview_tree.yview)
+        preview_tree.configure(yscrollcommand=preview_scrollbar.set)
+        preview_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        summary_var = tk.StringVar(value="Paste or open payments, then click Preview")
+        ttk.Label(main_frame, textvariable=summary_var, font=('Arial', 11, 'bold')).pack(anchor=tk.W, pady=(10, 0))
+        
+        button_frame = ttk.Frame(main_frame)
+        button_frame.pack(fill=tk.X, pady=(10, 0))
+        
+        preview_rows = []
+        
+        def show_preview(rows):
+            preview_rows[:] = rows
+            preview_tree.delete(*preview_tree.get_children())
+            for row in rows:
+                admin = row['admin_name'] or row['admin_text']
+                amount = f"{self.format_amount_for_display(row['amount'])}K" if row['amount'] is not None else ''
+                preview_tree.insert('', 'end', values=(row['line'], admin, amount, row['payment_date'] or '',
+                                                       row['error'] or 'Ready'),
+                                    tags=('error',) if row['error'] else ())
+            ready = [row for row in rows if not row['error']]
+            total = sum(row['amount'] for row in ready)
+            summary_var.set(f"{len(ready)} payments ready ({self.format_amount_for_display(total)}K تومان), "
+                            f"{len(rows) - len(ready)} rows skipped")
+            import_btn.config(state='normal' if ready else 'disabled')
+        
+        def preview():
+            text = source_text.get('1.0', tk.END)
+            amount_unit = 1000 if amounts_in_k_var.get() else 1
+            default_date = payment_import.parse_payment_date(default_date_entry.get()) if default_date_entry.get() else None
+            self.db_worker.submit(payment_import.build_import_preview, text, amount_unit, default_date,
+                                  callback=show_preview)
+        
+        def imported(result):
+            count, total = result
+            # One refresh for the whole import
+            self.load_admin_accounts()
+            self.load_dashboard_data()
+            messagebox.showinfo("Success", f"Imported {count} payments ({self.format_amount_for_display(total)}K تومان)")
+            dialog.destroy()
+        
+        def apply_import():
+            ready = [row for row in preview_rows if not row['error']]
+            if not ready:
+                return
+            if not messagebox.askyesno("Confirm Import", f"Record {len(ready)} payments?", parent=dialog):
+                return
+            import_btn.config(state='disabled')
+            self.db_worker.submit(payment_import.apply_payment_import, list(preview_rows),
+                                  write=True, callback=imported)
+        
+        ttk.Button(button_frame, text="🔍 Preview", command=preview).pack(side=tk.LEFT, padx=(0, 10))
+        import_btn = ttk.Button(button_frame, text="💾 Import Payments", command=apply_import, 
+                               style='Accent.TButton', state='disabled')
+        import_btn.pack(side=tk.LEFT)
+        ttk.Button(button_frame, text="❌ Cancel", command=dialog.destroy).pack(side=tk.RIGHT)
+    
+    def find_panel_user(self):
+        """Search the users of all downloaded panel backups and jump to their admin"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Find Panel User")
+        dialog.geometry("800x500")
+        dialog.transient(self.root)
+        
+        main_frame = ttk.Frame(dialog, padding=15)
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        search_frame = ttk.Frame(main_frame)
+        search_frame.pack(fill=tk.X, pady=(0, 10))
+        ttk.Label(search_frame, text="User name or UUID:", font=('Arial', 11, 'bold')).pack(side=tk.LEFT)
+        query_var = tk.StringVar()
+        query_entry = ttk.Entry(search_frame, textvariable=query_var, width=40, font=('Arial', 11))
+        query_entry.pack(side=tk.LEFT, padx=(10, 0))
+        query_entry.focus_set()
+        
+        status_var = tk.StringVar(value=f"Type at least {search_index.MIN_TRIGRAM_LENGTH} characters")
+        ttk.Label(main_frame, textvariable=status_var, foreground='gray').pack(anchor=tk.W)
+        
+        tree_frame = ttk.Frame(main_frame)
+        tree_frame.pack(fill=tk.BOTH, expand=True, pady=(5, 0))
+        user_tree = ttk.Treeview(tree_frame, columns=('Name', 'UUID', 'Admin', 'Panel'), show='headings')
+        for column, width in (('Name', 200), ('UUID', 280), ('Admin', 180), ('Panel', 80)):
+            user_tree.heading(column, text=column)
+            user_tree.column(column, width=width)
+        scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=user_tree.yview)
+        user_tree.configure(yscrollcommand=scrollbar.set)
+        user_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        admin_uuids = {}
+        
+        def show_users(query, rows):
+            # Drop results for a search the user has already typed past
+            if query != query_var.get().strip():
+                return
+            user_tree.delete(*user_tree.get_children())
+            admin_uuids.clear()
+            for name, uuid, admin_name, admin_uuid, panel_number in rows:
+                item = user_tree.insert('', 'end', values=(name, uuid, admin_name or '', panel_number))
+                admin_uuids[item] = admin_uuid
+            status_var.set(f"{len(rows)} users found" if rows else "No users found (download backups to index users)")
+        
+        def search(*args):
+            query = query_var.get().strip()
+            if len(query) < search_index.MIN_TRIGRAM_LENGTH:
+                user_tree.delete(*user_tree.get_children())
+                status_var.set(f"Type at least {search_index.MIN_TRIGRAM_LENGTH} characters")
+                return
+            self.db_worker.submit(search_index.search_panel_users, query,
+                                  callback=lambda rows: show_users(query, rows))
+        
+        def open_admin(event):
+            selection = user_tree.selection()
+            if not selection:
+                return
+            admin_uuid = admin_uuids.get(selection[0])
+            if admin_uuid not in self.admin_cache:
+                messagebox.showinfo("Find Panel User", "This user's admin has no account in the accounting system",
+                                    parent=dialog)
+                return
+            dialog.destroy()
+            self.show_admin(admin_uuid)
+        
+        query_var.trace('w', search)
+        user_tree.bind('<Double-1>', open_admin)
+    
+    def show_outstanding_report(self):
+        """List every admin with unpaid invoices, largest debt first"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Who Owes What")
+        dialog.geometry("800x500")
+        dialog.transient(self.root)
+        
+        main_frame = ttk.Frame(dialog, padding=15)
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        status_var = tk.StringVar(value="Loading...")
+        ttk.Label(main_frame, textvariable=status_var, font=('Arial', 11, 'bold')).pack(anchor=tk.W)
+        
+        tree_frame = ttk.Frame(main_frame)
+        tree_frame.pack(fill=tk.BOTH, expand=True, pady=(5, 0))
+        report_tree = ttk.Treeview(tree_frame, columns=('Name', 'Panel', 'Unpaid', 'Outstanding', 'Since'),
+                                   show='headings')
+        for column, heading, width in (('Name', 'Name', 220), ('Panel', 'FA Number', 120),
+                                       ('Unpaid', 'Unpaid Invoices', 110), ('Outstanding', 'Outstanding', 150),
+                                       ('Since', 'Oldest Unpaid', 150)):
+            report_tree.heading(column, text=heading)
+            report_tree.column(column, width=width)
+        scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=report_tree.yview)
+        report_tree.configure(yscrollcommand=scrollbar.set)
+        report_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        def show_report(rows):
+            if not dialog.winfo_exists():
+                return
+            total = 0
+            for admin_uuid, name, fa_number, unpaid_invoices, outstanding, oldest in rows:
+                report_tree.insert('', 'end', iid=admin_uuid, values=(
+                    name, fa_number or '', unpaid_invoices,
+                    f"{self.format_amount_for_display(outstanding)}K تومان",
+                    oldest.split()[0] if ' ' in (oldest or '') else oldest or ''
+                ))
+                total += outstanding
+            status_var.set(f"{len(rows)} admins owe {self.format_amount_for_display(total)}K تومان"
+                           if rows else "Nobody owes anything")
+        
+        def open_admin(event):
+            selection = report_tree.selection()
+            if not selection:
+                return
+            dialog.destroy()
+            # Inactive admins are not in the admin list but still open by UUID
+            self.show_admin(selection[0])
+        
+        report_tree.bind('<Double-1>', open_admin)
+        self.db_worker.submit(accounting_store.get_outstanding_report, callback=show_report)
+    
+    def archive_old_records(self):
+        """Move settled payments and invoices older than a cutoff into the archive database"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Archive Old Records")
+        dialog.geometry("460x220")
+        dialog.transient(self.root)
+        dialog.grab_set()
+        
+        main_frame = ttk.Frame(dialog, padding=20)
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        ttk.Label(main_frame, text="Archive settled records dated before:", 
+                 font=('Arial', 11, 'bold')).pack(anchor=tk.W)
+        cutoff_entry = ttk.Entry(main_frame, width=15, font=('Arial', 11))
+        cutoff_entry.pack(anchor=tk.W, pady=(5, 10))
+        cutoff_entry.insert(0, f"{datetime.now().year - 1}-01-01")
+        ttk.Label(main_frame, text="Only fully paid invoices and the payments that paid them are moved.\n"
+                                   "Balances do not change.", foreground='gray').pack(anchor=tk.W)
+        
+        def show_summary(counts):
+            dialog.destroy()
+            messagebox.showinfo("Archive Complete",
+                                f"Archived {counts['invoice_additions']} invoices and {counts['payments']} payments "
+                                f"for {counts['admins']} admins, plus {counts['invoices']} generated invoice records.")
+            # Archiving moves history rows without changing any totals
+            self.admin_detail_cache.clear()
+            self.load_admin_accounts()
+            self.load_dashboard_data()
+            self.load_invoices()
+        
+        def start_archive():
+            cutoff = cutoff_entry.get().strip()
+            try:
+                datetime.strptime(cutoff, '%Y-%m-%d')
+            except ValueError:
+                messagebox.showerror("Error", "Please enter the date as YYYY-MM-DD", parent=dialog)
+                return
+            if not messagebox.askyesno("Confirm Archive", 
+                                       f"Move settled records dated before {cutoff} to the archive?", parent=dialog):
+                return
+            self.db_worker.submit(archive_closed_periods, cutoff, write=True, callback=show_summary)
+        
+        button_frame = ttk.Frame(main_frame)
+        button_frame.pack(fill=tk.X, pady=(15, 0))
+        ttk.Button(button_frame, text="🗄️ Archive", command=start_archive, 
+                  style='Accent.TButton').pack(side=tk.LEFT)
+        ttk.Button(button_frame, text="❌ Cancel", command=dialog.destroy).pack(side=tk.RIGHT)
+    
     def add_indebtedness_for_current_admin(self):
         """Add indebtedness for the currently selected admin"""
-        # Get current admin name
-        admin_name = self.admin_name_var.get()
-        if not admin_name:
+        admin_uuid = self.current_admin_uuid
+        if not admin_uuid:
             messagebox.showwarning("Warning", "No admin selected")
             return
+        admin_name = self.admin_name_var.get()
         
         # Create dialog
         dialog = tk.Toplevel(self.root)
@@ -886,58 +1085,22 @@ class VPNAccountingApp:
             
             amount = self.parse_amount_from_input(amount_var.get())
             notes = notes_var.get()
-            
-            # Get admin UUID
-            self.cursor.execute("SELECT uuid FROM admin_accounts WHERE name = ?", (admin_name,))
-            result = self.cursor.fetchone()
-            if not result:
-                messagebox.showerror("Error", "Admin not found")
-                return
-            
-            admin_uuid = result[0]
             current_date = datetime.now().strftime('%Y-%m-%d')
             
-            # Add indebtedness as invoice record
-            self.cursor.execute('''
-                INSERT INTO invoice_additions (admin_uuid, amount, addition_date, invoice_period_start, invoice_period_end)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (admin_uuid, amount, current_date, "Start Up Indebtedness", "Start Up Indebtedness"))
-            
-            # Update admin total earned
-            self.cursor.execute('''
-                UPDATE admin_accounts 
-                SET total_earned = total_earned + ?
-                WHERE uuid = ?
-            ''', (amount, admin_uuid))
-            
-            self.conn.commit()
-            
-            # Refresh displays
-            self.load_admin_accounts()
-            self.load_dashboard_data()
-            
-            # Refresh admin detail page
-            self.cursor.execute("""
-                SELECT uuid, name, fa_number, total_earned, total_paid 
-                FROM admin_accounts WHERE name = ?
-            """, (admin_name,))
-            result = self.cursor.fetchone()
+            def add(conn):
+                # Add indebtedness as invoice record
+                accounting_store.add_indebtedness(conn, admin_uuid, amount, current_date)
             
-            if result:
-                admin_uuid, name, fa_number, total_earned, total_paid = result
-                remainder = total_earned - total_paid
-                
-                # Update admin detail page
-                self.admin_earned_var.set(f"{self.format_amount_for_display(total_earned)}K تومان")
-                self.admin_paid_var.set(f"{self.format_amount_for_display(total_paid)}K تومان")
-                self.admin_balance_var.set(f"{self.format_amount_for_display(remainder)}K تومان")
+            def added(_):
+                # Refresh displays
+                self.load_admin_accounts()
+                self.load_dashboard_data()
+                self.refresh_admin_detail(admin_uuid)
                 
-                # Reload history
-                self.load_admin_invoice_history(admin_uuid)
-                self.load_admin_payment_history(admin_uuid)
+                messagebox.showinfo("Success", f"Indebtedness of {self.format_amount_for_display(amount)}K تومان added for {admin_name}")
+                dialog.destroy()
             
-            messagebox.showinfo("Success", f"Indebtedness of {self.format_amount_for_display(amount)}K تومان added for {admin_name}")
-            dialog.destroy()
+            self.db_worker.submit(add, write=True, callback=added)
         
         # Buttons
         ttk.Button(button_frame, text="💾 Add Indebtedness", command=add_indebtedness, 
@@ -970,52 +1133,27 @@ class VPNAccountingApp:
 
     
     def filter_admins(self, *args):
-        """Filter admin list based on search term"""
+        """Filter admin list based on search term, once typing pauses"""
         if not hasattr(self, 'admin_tree'):
             return
-        search_term = self.search_var.get().lower()
+        # Each keystroke restarts the wait, so a burst of typing filters once
+        if self.search_after_id is not None:
+            self.root.after_cancel(self.search_after_id)
+        self.search_after_id = self.root.after(self.SEARCH_DEBOUNCE_MS, self.apply_admin_filter)
+    
+    def apply_admin_filter(self):
+        """Show the cached admins matching the search box"""
+        self.search_after_id = None
+        self.display_admin_accounts(self.matching_admins())
+    
+    def matching_admins(self):
+        """Cached admin rows whose name, FA number or UUID contains the search text"""
+        search_term = normalize_search_text(self.search_var.get().strip())
         
         # Don't filter if it's the placeholder text
-        if search_term == "type admin name or fa number...":
-            self.load_admin_accounts()
-            return
-        
-        # Clear current display
-        for item in self.admin_tree.get_children():
-            self.admin_tree.delete(item)
-        
-        # Get all admin accounts (only active ones)
-        self.cursor.execute('''
-            SELECT name, fa_number, total_earned, total_paid
-            FROM admin_accounts
-            WHERE status = 'active' OR status IS NULL
-            ORDER BY name
-        ''')
-        
-        # Configure alternating row colors for filtered results
-        self.admin_tree.tag_configure('even_row', background='#f8f9fa', foreground='#2c3e50')
-        self.admin_tree.tag_configure('odd_row', background='#ffffff', foreground='#2c3e50')
-        
-        filtered_count = 0
-        for row in self.cursor.fetchall():
-            name, fa_number, earned, paid = row
-            earned = earned or 0
-            paid = paid or 0
-            balance = earned - paid
-            
-            # Filter by search term
-            if search_term in name.lower() or search_term in fa_number.lower():
-                # Apply alternating row colors
-                tag = 'even_row' if filtered_count % 2 == 0 else 'odd_row'
-                
-                self.admin_tree.insert('', 'end', values=(
-                    name, 
-                    fa_number, 
-                    self.format_amount_for_display(earned),
-                    self.format_amount_for_display(paid),
-                    self.format_amount_for_display(balance)
-                ), tags=(tag,))
-                filtered_count += 1
+        if not search_term or search_term == "type admin name or fa number...":
+            return [row for _, row in self.admin_search_rows]
+        return [row for key, row in self.admin_search_rows if search_term in key]
     
     def clear_search(self):
         """Clear search and show all admins"""
@@ -1041,56 +1179,102 @@ class VPNAccountingApp:
         """Open admin detail page when admin is clicked"""
         selection = self.admin_tree.selection()
         if selection:
-            item = self.admin_tree.item(selection[0])
-            admin_name = item['values'][0]
-            
-            # Get admin details
-            self.cursor.execute("""
-                SELECT uuid, name, fa_number, total_earned, total_paid 
-                FROM admin_accounts WHERE name = ?
-            """, (admin_name,))
-            result = self.cursor.fetchone()
-            
-            if result:
-                admin_uuid, name, fa_number, total_earned, total_paid = result
-                remainder = total_earned - total_paid
-                
-                # Update admin detail page
-                self.selected_admin_title.config(text=f"Admin: {name}")
-                self.admin_name_var.set(name)
-                self.admin_fa_var.set(fa_number)
-                self.admin_earned_var.set(f"{self.format_amount_for_display(total_earned)}K تومان")
-                self.admin_paid_var.set(f"{self.format_amount_for_display(total_paid)}K تومان")
-                self.admin_balance_var.set(f"{self.format_amount_for_display(remainder)}K تومان")
-                
-                # Load history
-                self.load_admin_invoice_history(admin_uuid)
-                self.load_admin_payment_history(admin_uuid)
-                
-                # Reset selection states
-                self.delete_payment_btn.config(state='disabled')
-                self.delete_invoice_btn.config(state='disabled')
+            # Row ids are admin UUIDs
+            self.show_admin(selection[0])
+    
+    def show_admin(self, admin_uuid):
+        """Open the detail page of an admin"""
+        self.current_admin_uuid = admin_uuid
+        if admin_uuid in self.admin_cache:
+            self.display_admin_summary(self.admin_cache[admin_uuid])
+        
+        key = (admin_uuid, self.include_archive_var.get())
+        
+        def show_detail(detail):
+            if detail:
+                self.admin_detail_cache[key] = detail
+                self.display_admin_detail(detail)
                 
                 # Show detail page
                 self.show_admin_detail_page()
+            else:
+                messagebox.showinfo("Admin Not Found", "This admin has no account in the accounting system")
+        
+        # Reopening an admin whose accounts have not changed needs no query
+        if key in self.admin_detail_cache:
+            show_detail(self.admin_detail_cache[key])
+            return
+        
+        # Get admin details and history in one round trip
+        self.db_worker.submit(accounting_store.get_admin_detail, admin_uuid, key[1], callback=show_detail)
     
-
+    def refresh_admin_detail(self, admin_uuid=None):
+        """Reload the admin detail page after a change"""
+        admin_uuid = admin_uuid or self.current_admin_uuid
+        if not admin_uuid:
+            return
+        key = (admin_uuid, self.include_archive_var.get())
+        self.admin_detail_cache.pop((admin_uuid, True), None)
+        self.admin_detail_cache.pop((admin_uuid, False), None)
+        
+        def show_detail(detail):
+            if detail:
+                self.admin_detail_cache[key] = detail
+            self.display_admin_detail(detail)
+        
+        self.db_worker.submit(accounting_store.get_admin_detail, admin_uuid, key[1], callback=show_detail)
     
-
+    def display_admin_summary(self, admin):
+        """Show an admin's (uuid, name, fa_number, total_earned, total_paid) at the top of the detail page"""
+        admin_uuid, name, fa_number, total_earned, total_paid = admin
+        total_earned = total_earned or 0
+        total_paid = total_paid or 0
+        remainder = total_earned - total_paid
+        
+        self.selected_admin_title.config(text=f"Admin: {name}")
+        self.admin_name_var.set(name)
+        self.admin_fa_var.set(fa_number)
+        self.admin_earned_var.set(f"{self.format_amount_for_display(total_earned)}K تومان")
+        self.admin_paid_var.set(f"{self.format_amount_for_display(total_paid)}K تومان")
+        self.admin_balance_var.set(f"{self.format_amount_for_display(remainder)}K تومان")
+    
+    def display_admin_detail(self, detail):
+        """Fill the admin detail page from accounting_store.get_admin_detail()"""
+        # Ignore a reply for an admin the user has already navigated away from
+        if not detail or detail['admin'][0] != self.current_admin_uuid:
+            return
+        
+        self.display_admin_summary(detail['admin'])
+        
+        # Load history: the newest page of each, with totals over all rows
+        self.archived_invoice_ids = set()
+        self.archived_payment_ids = set()
+        self.reset_history('invoices', self.invoice_tree, detail['totals']['invoice_count'],
+                           detail['totals']['invoiced'])
+        self.reset_history('payments', self.payment_tree, detail['totals']['payment_count'],
+                           detail['totals']['paid'])
+        self.show_history_page('invoices', self.history_pages['invoices']['generation'], detail['invoices'])
+        self.show_history_page('payments', self.history_pages['payments']['generation'], detail['payments'])
+        
+        # Reset selection states
+        self.delete_payment_btn.config(state='disabled')
+        self.delete_invoice_btn.config(state='disabled')
+        self.edit_invoice_btn.config(state='disabled')
     
     def refresh_admin_names(self):
         """Refresh admin names from backup files"""
-        try:
-            self.update_admin_names_from_backups()
+        def update_names(conn):
+            accounting_store.update_admin_names(conn, self.get_admin_names_from_backups())
+        
+        def updated(_):
             self.load_admin_accounts()
             messagebox.showinfo("Success", "Admin names updated from backup files!")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to update admin names: {str(e)}")
+        
+        self.db_worker.submit(update_names, write=True, callback=updated,
+                              errback=lambda e: messagebox.showerror("Error", f"Failed to update admin names: {str(e)}"))
     
-    def create_invoices_tab(self):
+    def create_invoices_tab(self, invoices_frame):
         """Create invoices tab for managing and generating invoices"""
-        invoices_frame = ttk.Frame(self.notebook)
-        self.notebook.add(invoices_frame, text="Invoices")
         
         # Title
         title_label = ttk.Label(invoices_frame, text="Invoice Management", 
@@ -1124,6 +1308,70 @@ class VPNAccountingApp:
         self.add_invoice_amounts_btn = ttk.Button(controls_frame, text="Add Invoice Amounts to Accounts", 
                                                  command=self.add_invoice_amounts_to_accounts)
         self.add_invoice_amounts_btn.pack(side=tk.LEFT, padx=5)
+        
+        # Progress of the running invoice job
+        progress_frame = ttk.Frame(invoices_frame)
+        progress_frame.pack(fill=tk.X, padx=20)
+        
+        self.invoice_progress_var = tk.DoubleVar()
+        ttk.Progressbar(progress_frame, variable=self.invoice_progress_var,
+                       maximum=1.0).pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.cancel_invoices_btn = ttk.Button(progress_frame, text="⏹ Cancel", state='disabled',
+                                             command=self.cancel_invoice_run)
+        self.cancel_invoices_btn.pack(side=tk.LEFT, padx=10)
+        self.invoice_status = ttk.Label(progress_frame, text="", width=40)
+        self.invoice_status.pack(side=tk.LEFT)
+        
+        # Output options frame
+        output_frame = ttk.LabelFrame(invoices_frame, text="Output", padding=5)
+        output_frame.pack(fill=tk.X, padx=20, pady=10)
+        
+        self.invoice_output_mode = tk.StringVar(value='files')
+        ttk.Radiobutton(output_frame, text="Separate PDF per admin", value='files',
+                       variable=self.invoice_output_mode).pack(side=tk.LEFT, padx=5)
+        ttk.Radiobutton(output_frame, text="One PDF per main admin", value='bundle',
+                       variable=self.invoice_output_mode).pack(side=tk.LEFT, padx=5)
+        
+        self.zip_invoice_bundles = tk.BooleanVar(value=False)
+        ttk.Checkbutton(output_frame, text="Zip per Telegram account",
+                       variable=self.zip_invoice_bundles).pack(side=tk.LEFT, padx=20)
+        
+        # Single in-memory archive per run instead of individual files
+        ttk.Label(output_frame, text="Run archive:").pack(side=tk.LEFT, padx=(20, 5))
+        self.invoice_archive_format = tk.StringVar(value='none')
+        ttk.Combobox(output_frame, textvariable=self.invoice_archive_format, values=('none', 'zip', 'tar'),
+                    state='readonly', width=6).pack(side=tk.LEFT)
+        
+        # Generated invoices frame
+        list_frame = ttk.LabelFrame(invoices_frame, text="Generated Invoices", padding=10)
+        list_frame.pack(fill=tk.BOTH, expand=True, padx=20, pady=10)
+        
+        ttk.Checkbutton(list_frame, text="🗄️ Include archived invoices", variable=self.include_archive_var,
+                       command=self.load_invoices).pack(anchor=tk.W, pady=(0, 5))
+        
+        self.invoices_tree = ttk.Treeview(list_frame,
+                                         columns=('Date', 'Admin', 'Usage', 'Amount', 'Status', 'PDF'),
+                                         show='headings', height=15)
+        for column, heading, width in (('Date', 'Date', 100), ('Admin', 'Admin', 180), ('Usage', 'Usage (GB)', 90),
+                                       ('Amount', 'Amount', 120), ('Status', 'Status', 80), ('PDF', 'PDF', 400)):
+            self.invoices_tree.heading(column, text=heading)
+            self.invoices_tree.column(column, width=width)
+        
+        scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.invoices_tree.yview)
+        self.invoices_tree.configure(yscrollcommand=scrollbar.set)
+        
+        self.invoices_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        # Double-click opens the PDF (extracted from the run archive if needed)
+        self.invoices_tree.bind('<Double-1>', self.open_invoice_pdf)
+        
+        self.load_invoices()
+    
+    def get_invoice_archive_format(self):
+        """Selected run archive format, or None for individual files"""
+        archive_format = self.invoice_archive_format.get()
+        return None if archive_format == 'none' else archive_format
     
 
     
@@ -1168,12 +1416,8 @@ class VPNAccountingApp:
             # Update database in main thread
             self.root.after(0, self.update_backup_database)
             
-            # Refresh admin accounts in database in main thread
-            def refresh_admin_data():
-                new_admins, removed_admins = self.sync_admin_accounts_with_config()
-                self.load_admin_accounts()
-                self.load_dashboard_data()
-                
+            # Refresh admin accounts in database (submitted from the main thread)
+            def report_admin_changes(new_admins, removed_admins):
                 if new_admins > 0 and removed_admins > 0:
                     messagebox.showinfo("Success", 
                         f"Download completed!\n"
@@ -1184,7 +1428,7 @@ class VPNAccountingApp:
                 elif removed_admins > 0:
                     messagebox.showinfo("Success", f"Download completed!\n{removed_admins} admin(s) removed/marked inactive")
             
-            self.root.after(0, refresh_admin_data)
+            self.root.after(0, lambda: self.sync_admin_accounts_with_config(on_done=report_admin_changes))
             
         except Exception as e:
             self.root.after(0, lambda: messagebox.showerror("Error", f"Download failed: {str(e)}"))
@@ -1193,6 +1437,8 @@ class VPNAccountingApp:
     
     def load_backup_files(self):
         """Load and display backup files"""
+        if not hasattr(self, 'backup_tree'):
+            return
         # Clear existing items
         for item in self.backup_tree.get_children():
             self.backup_tree.delete(item)
@@ -1220,30 +1466,30 @@ class VPNAccountingApp:
     
     def update_backup_database(self):
         """Update backup database with new files"""
-        downloads_folder = "downloads"
-        if not os.path.exists(downloads_folder):
-            return
-        
-        for filename in os.listdir(downloads_folder):
-            if filename.endswith('.json'):
-                file_path = os.path.join(downloads_folder, filename)
-                panel_num = int(filename.replace('backup', '').replace('.json', ''))
-                
-                # Calculate file hash
-                import hashlib
-                with open(file_path, 'rb') as f:
-                    data_hash = hashlib.md5(f.read()).hexdigest()
-                
-                # Check if already exists
-                self.cursor.execute("SELECT id FROM backup_data WHERE panel_number = ? AND data_hash = ?", 
-                                  (panel_num, data_hash))
-                if not self.cursor.fetchone():
-                    self.cursor.execute('''
-                        INSERT INTO backup_data (panel_number, backup_date, data_hash, file_path)
-                        VALUES (?, ?, ?, ?)
-                    ''', (panel_num, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), data_hash, file_path))
+        def record_backups(conn):
+            downloads_folder = "downloads"
+            if not os.path.exists(downloads_folder):
+                return
+            
+            for filename in os.listdir(downloads_folder):
+                if filename.endswith('.json'):
+                    file_path = os.path.join(downloads_folder, filename)
+                    panel_num = int(filename.replace('backup', '').replace('.json', ''))
+                    
+                    # Calculate file hash
+                    import hashlib
+                    with open(file_path, 'rb') as f:
+                        data_hash = hashlib.md5(f.read()).hexdigest()
+                    
+                    is_new = accounting_store.record_backup_file(conn, panel_num, data_hash, file_path,
+                                                                 datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+                    
+                    # Rebuild the panel's user search index from new backup data
+                    if is_new or not search_index.is_panel_indexed(conn, panel_num):
+                        search_index.index_panel_users(conn, panel_num, read_json_file(file_path))
         
-        self.conn.commit()
+        # Hashing, indexing and inserts run on the database worker
+        self.db_worker.submit(record_backups, write=True)
     
     def update_uuids_from_backups(self):
         """Update UUIDs from downloaded backup files"""
@@ -1340,104 +1586,81 @@ class VPNAccountingApp:
     
     def load_dashboard_data(self):
         """Load dashboard statistics"""
-        # Get total admins
-        self.cursor.execute("SELECT COUNT(*) FROM admin_accounts WHERE status = 'active'")
-        total_admins = self.cursor.fetchone()[0]
-        self.total_admins_var.set(str(total_admins))
-        
-        # Get total earned
-        self.cursor.execute("SELECT SUM(total_earned) FROM admin_accounts")
-        total_earned = self.cursor.fetchone()[0] or 0
-        self.total_earned_var.set(f"{total_earned:,.0f} تومان")
-        
-        # Get total paid
-        self.cursor.execute("SELECT SUM(total_paid) FROM admin_accounts")
-        total_paid = self.cursor.fetchone()[0] or 0
-        self.total_paid_var.set(f"{total_paid:,.0f} تومان")
+        if not hasattr(self, 'activity_tree'):
+            return
+        self.db_worker.submit(accounting_store.get_dashboard_stats, callback=self.display_dashboard)
+    
+    def display_dashboard(self, stats):
+        """Show dashboard statistics and recent activity"""
+        self.total_admins_var.set(str(stats['total_admins']))
+        self.total_earned_var.set(f"{stats['total_earned']:,.0f} تومان")
+        self.total_paid_var.set(f"{stats['total_paid']:,.0f} تومان")
         
         # Calculate balance
-        balance = total_earned - total_paid
+        balance = stats['total_earned'] - stats['total_paid']
         self.total_balance_var.set(f"{balance:,.0f} تومان")
         
-        # Get last backup date
-        self.cursor.execute("SELECT MAX(backup_date) FROM backup_data")
-        last_backup = self.cursor.fetchone()[0]
-        self.last_backup_var.set(last_backup or "Never")
+        self.last_backup_var.set(stats['last_backup'] or "Never")
         
-        # Load recent activity
-        self.load_recent_activity()
-    
-    def load_recent_activity(self):
-        """Load recent activity in dashboard"""
-        # Clear existing items
+        # Recent activity
         for item in self.activity_tree.get_children():
             self.activity_tree.delete(item)
         
-        # Get recent payments
-        self.cursor.execute('''
-            SELECT p.payment_date, a.name, 'Payment', p.amount
-            FROM payments p
-            JOIN admin_accounts a ON p.admin_uuid = a.uuid
-            ORDER BY p.payment_date DESC
-            LIMIT 20
-        ''')
-        
-        for row in self.cursor.fetchall():
+        for row in stats['recent_activity']:
             self.activity_tree.insert('', 'end', values=row)
     
     def load_admin_accounts(self):
         """Load admin accounts in accounting tab"""
-        # Clear existing items
-        for item in self.admin_tree.get_children():
-            self.admin_tree.delete(item)
-        
+        # Loaded when the tab is first opened
+        if not hasattr(self, 'admin_tree'):
+            return
         # Get admin accounts (only active ones)
-        self.cursor.execute('''
-            SELECT name, fa_number, total_earned, total_paid
-            FROM admin_accounts
-            WHERE status = 'active' OR status IS NULL
-            ORDER BY name
-        ''')
-        
-        # Configure alternating row colors
-        self.admin_tree.tag_configure('even_row', background='#f8f9fa', foreground='#2c3e50')
-        self.admin_tree.tag_configure('odd_row', background='#ffffff', foreground='#2c3e50')
-        
-        for i, row in enumerate(self.cursor.fetchall()):
-            name, fa_number, earned, paid = row
+        self.db_worker.submit(accounting_store.list_active_admins, callback=self.show_admin_accounts)
+    
+    def show_admin_accounts(self, rows):
+        """Refresh the admin cache from list_active_admins() rows and show those matching the search"""
+        self.admin_cache = {row[0]: row for row in rows}
+        # A cached detail page is stale once its admin's totals or names change
+        self.admin_detail_cache = {
+            key: detail for key, detail in self.admin_detail_cache.items()
+            if tuple(self.admin_cache.get(key[0], ())) == tuple(detail['admin'])
+        }
+        self.admin_search_rows = [
+            (normalize_search_text(f"{row[1] or ''}\n{row[2] or ''}\n{row[0]}"), row) for row in rows
+        ]
+        self.display_admin_accounts(self.matching_admins())
+    
+    def display_admin_accounts(self, rows):
+        """Show (uuid, name, fa_number, earned, paid) rows in the admin list, keyed by UUID"""
+        tree_rows = []
+        for row in rows:
+            admin_uuid, name, fa_number, earned, paid = row
             earned = earned or 0
             paid = paid or 0
             balance = earned - paid
             
-            # Apply alternating row colors
-            tag = 'even_row' if i % 2 == 0 else 'odd_row'
+            # Not striped by position: an insert or filter change would retag every later row
+            tag = 'owing' if balance > 0 else 'settled'
             
-            self.admin_tree.insert('', 'end', values=(
+            tree_rows.append((admin_uuid, (
                 name, 
                 fa_number, 
                 self.format_amount_for_display(earned),
                 self.format_amount_for_display(paid),
                 self.format_amount_for_display(balance)
-            ), tags=(tag,))
-    
-
+            ), (tag,)))
+        
+        # Only rows that were added, removed, moved or changed touch the Treeview
+        self.admin_tree_sync.update(tree_rows)
     
     def record_payment(self):
         """Record a payment for selected admin"""
-        # Get admin name from the detail page
-        admin_name = self.admin_name_var.get()
-        if not admin_name:
+        # The admin shown on the detail page
+        admin_uuid = self.current_admin_uuid
+        if not admin_uuid:
             messagebox.showwarning("Warning", "No admin selected")
             return
-        
-        # Get admin UUID
-        self.cursor.execute("SELECT uuid FROM admin_accounts WHERE name = ?", (admin_name,))
-        result = self.cursor.fetchone()
-        if not result:
-            messagebox.showerror("Error", "Admin not found")
-            return
-        
-        admin_uuid = result[0]
+        admin_name = self.admin_name_var.get()
         
         # Get payment details
         try:
@@ -1451,41 +1674,19 @@ class VPNAccountingApp:
             messagebox.showerror("Error", "Please enter payment date")
             return
         
-        # Record payment
-        self.cursor.execute('''
-            INSERT INTO payments (admin_uuid, amount, payment_date, payment_method, reference, notes)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (admin_uuid, amount, payment_date, '', '', ''))
-        
-        # Update admin account
-        self.cursor.execute('''
-            UPDATE admin_accounts 
-            SET total_paid = total_paid + ?, last_payment_date = ?
-            WHERE uuid = ?
-        ''', (amount, payment_date, admin_uuid))
+        def record(conn):
+            accounting_store.record_payment(conn, admin_uuid, amount, payment_date)
         
-        self.conn.commit()
+        def recorded(_):
+            # Refresh displays
+            self.load_admin_accounts()
+            self.load_dashboard_data()
+            self.clear_payment_form()
+            self.refresh_admin_detail(admin_uuid)
+            
+            messagebox.showinfo("Success", f"Payment of {self.format_amount_for_display(amount)}K تومان recorded for {admin_name}")
         
-        # Refresh displays
-        self.load_admin_accounts()
-        self.load_dashboard_data()
-        self.clear_payment_form()
-        
-        messagebox.showinfo("Success", f"Payment of {self.format_amount_for_display(amount)}K تومان recorded for {admin_name}")
-        
-        # Refresh admin detail page
-        self.cursor.execute("SELECT total_earned, total_paid FROM admin_accounts WHERE uuid = ?", (admin_uuid,))
-        result = self.cursor.fetchone()
-        if result:
-            total_earned, total_paid = result
-            remainder = total_earned - total_paid
-            self.admin_earned_var.set(f"{self.format_amount_for_display(total_earned)}K تومان")
-            self.admin_paid_var.set(f"{self.format_amount_for_display(total_paid)}K تومان")
-            self.admin_balance_var.set(f"{self.format_amount_for_display(remainder)}K تومان")
-            self.load_admin_payment_history(admin_uuid)
-            # Reset payment and invoice selection
-            self.delete_payment_btn.config(state='disabled')
-            self.delete_invoice_btn.config(state='disabled')
+        self.db_worker.submit(record, write=True, callback=recorded)
     
     def clear_payment_form(self):
         """Clear payment form"""
@@ -1493,53 +1694,65 @@ class VPNAccountingApp:
         self.payment_date.delete(0, tk.END)
         self.payment_date.insert(0, datetime.now().strftime('%Y-%m-%d'))
     
-    def load_admin_invoice_history(self, admin_uuid):
-        """Load invoice history for selected admin"""
-        # Clear existing items
-        for item in self.invoice_tree.get_children():
-            self.invoice_tree.delete(item)
-        
-        # Get invoice additions for this admin (ordered by date ascending for payment calculation)
-        self.cursor.execute("""
-            SELECT id, addition_date, amount, invoice_period_start, invoice_period_end
-            FROM invoice_additions 
-            WHERE admin_uuid = ?
-            ORDER BY addition_date ASC
-        """, (admin_uuid,))
-        
-        invoice_results = self.cursor.fetchall()
-        
-        # Get total payments for this admin
-        self.cursor.execute("""
-            SELECT SUM(amount) FROM payments WHERE admin_uuid = ?
-        """, (admin_uuid,))
-        
-        total_payments_result = self.cursor.fetchone()
-        total_payments = total_payments_result[0] if total_payments_result[0] else 0
-        
-        # Calculate which invoices are paid
-        cumulative_invoice_amount = 0
-        paid_invoice_ids = []
-        
-        for invoice_id, addition_date, amount, start_date, end_date in invoice_results:
-            cumulative_invoice_amount += amount
-            if cumulative_invoice_amount <= total_payments:
-                paid_invoice_ids.append(invoice_id)
-        
-        # Now display invoices in reverse order (newest first) with color coding
-        self.cursor.execute("""
-            SELECT id, addition_date, amount, invoice_period_start, invoice_period_end
-            FROM invoice_additions 
-            WHERE admin_uuid = ?
-            ORDER BY addition_date DESC
-        """, (admin_uuid,))
-        
-        results = self.cursor.fetchall()
-        total_invoiced = 0
-        
-        for invoice_id, addition_date, amount, start_date, end_date in results:
+    def reset_history(self, kind, tree, count, total):
+        """Empty a history list, pinning a TOTAL row over all count rows at the top"""
+        state = self.history_pages[kind]
+        state.update(before=None, done=False, loading=False, generation=state['generation'] + 1)
+        
+        tree.delete(*tree.get_children())
+        if count:
+            tree.insert('', 'end', iid='total', values=('TOTAL', self.format_amount_for_display(total)),
+                        tags=('total',))
+        
+        # Configure tags for styling
+        tree.tag_configure('paid', background='#d4edda', foreground='#155724')  # Green for paid
+        tree.tag_configure('unpaid', background='#f8f9fa', foreground='#2c3e50')  # Default for unpaid
+        tree.tag_configure('total', background='#e8f5e8', font=('Arial', 10, 'bold'))
+        tree.tag_configure('archived', foreground='#95a5a6')
+        tree.tag_configure('carried_forward', background='#fff3cd', foreground='#856404')
+    
+    def load_more_history(self, kind):
+        """Fetch the next (older) page of the invoice or payment history"""
+        state = self.history_pages[kind]
+        if state['done'] or state['loading'] or not self.current_admin_uuid:
+            return
+        state['loading'] = True
+        
+        fetch = accounting_store.get_invoice_history if kind == 'invoices' else accounting_store.get_payment_history
+        generation = state['generation']
+        self.db_worker.submit(fetch, self.current_admin_uuid, self.include_archive_var.get(), state['before'],
+                              callback=lambda rows: self.show_history_page(kind, generation, rows))
+    
+    def on_history_scroll(self, kind, scrollbar, first, last):
+        """Treeview yscrollcommand: move the scrollbar and load more rows near the bottom"""
+        scrollbar.set(first, last)
+        if float(last) >= 0.9:
+            self.load_more_history(kind)
+    
+    def show_history_page(self, kind, generation, rows):
+        """Append a page of history rows (ignored if the page was reloaded meanwhile)"""
+        state = self.history_pages[kind]
+        if generation != state['generation']:
+            return
+        state['loading'] = False
+        state['done'] = len(rows) < accounting_store.HISTORY_PAGE_SIZE
+        if not rows:
+            return
+        # Rows are (id, date, ...): the next page continues after the last one
+        state['before'] = (rows[-1][1], rows[-1][0])
+        
+        if kind == 'invoices':
+            self.append_invoice_rows(rows)
+        else:
+            self.append_payment_rows(rows)
+    
+    def append_invoice_rows(self, rows):
+        """Add (id, addition_date, amount, start, end, paid, archived) rows to the invoice history"""
+        for invoice_id, addition_date, amount, start_date, end_date, paid, archived in rows:
             # Format the invoice period (from-to dates)
-            if start_date and end_date:
+            if start_date == CARRY_FORWARD_PERIOD:
+                period_text = CARRY_FORWARD_PERIOD
+            elif start_date and end_date:
                 # Extract just the date part from start and end dates
                 start_part = start_date.split()[0] if ' ' in start_date else start_date
                 end_part = end_date.split()[0] if ' ' in end_date else end_date
@@ -1549,68 +1762,33 @@ class VPNAccountingApp:
                 date_part = addition_date.split()[0] if ' ' in addition_date else addition_date
                 period_text = date_part
             
-            # Format amount with simplified display
-            formatted_amount = self.format_amount_for_display(amount)
-            
-            # Insert into treeview with appropriate tag
-            item = self.invoice_tree.insert('', 'end', values=(period_text, formatted_amount))
-            
             # Color code based on payment status
-            if invoice_id in paid_invoice_ids:
-                self.invoice_tree.item(item, tags=('paid',))
+            if archived:
+                self.archived_invoice_ids.add(invoice_id)
+                tag = 'archived'
+            elif start_date == CARRY_FORWARD_PERIOD:
+                # Stands in for archived invoices: read-only, like them
+                tag = 'carried_forward'
             else:
-                self.invoice_tree.item(item, tags=('unpaid',))
+                tag = 'paid' if paid else 'unpaid'
             
-            total_invoiced += amount
-        
-        # Add total row if there are invoices
-        if results:
-            self.invoice_tree.insert('', 'end', values=('TOTAL', self.format_amount_for_display(total_invoiced)), tags=('total',))
-            
-            # Configure tags for styling
-            self.invoice_tree.tag_configure('paid', background='#d4edda', foreground='#155724')  # Green for paid
-            self.invoice_tree.tag_configure('unpaid', background='#f8f9fa', foreground='#2c3e50')  # Default for unpaid
-            self.invoice_tree.tag_configure('total', background='#e8f5e8', font=('Arial', 10, 'bold'))
-        
-        # Store invoice IDs for deletion (in reverse order to match display)
-        self.invoice_ids = [row[0] for row in results]
+            # Row ids are invoice ids
+            self.invoice_tree.insert('', 'end', iid=str(invoice_id),
+                                     values=(period_text, self.format_amount_for_display(amount)), tags=(tag,))
     
-    def load_admin_payment_history(self, admin_uuid):
-        """Load payment history for selected admin"""
-        # Clear existing items
-        for item in self.payment_tree.get_children():
-            self.payment_tree.delete(item)
-        
-        # Get payments for this admin
-        self.cursor.execute("""
-            SELECT id, payment_date, amount
-            FROM payments 
-            WHERE admin_uuid = ?
-            ORDER BY payment_date DESC
-        """, (admin_uuid,))
-        
-        results = self.cursor.fetchall()
-        total_paid = 0
-        
-        # Store payment IDs for deletion
-        self.payment_ids = []
-        
-        for payment_id, payment_date, amount in results:
+    def append_payment_rows(self, rows):
+        """Add (id, payment_date, amount, archived) rows to the payment history"""
+        for payment_id, payment_date, amount, archived in rows:
             # Extract just the date part from payment_date
             date_part = payment_date.split()[0] if ' ' in payment_date else payment_date
             
-            # Format amount with simplified display
-            formatted_amount = self.format_amount_for_display(amount)
+            if archived:
+                self.archived_payment_ids.add(payment_id)
+            tags = ('archived',) if archived else ()
             
-            # Insert into treeview
-            self.payment_tree.insert('', 'end', values=(date_part, formatted_amount))
-            total_paid += amount
-            self.payment_ids.append(payment_id)
-        
-        # Add total row if there are payments
-        if results:
-            self.payment_tree.insert('', 'end', values=('TOTAL', self.format_amount_for_display(total_paid)), tags=('total',))
-            self.payment_tree.tag_configure('total', background='#e8f5e8', font=('Arial', 10, 'bold'))
+            # Row ids are payment ids
+            self.payment_tree.insert('', 'end', iid=str(payment_id),
+                                     values=(date_part, self.format_amount_for_display(amount)), tags=tags)
     
     def on_payment_select(self, event):
         """Handle payment selection in treeview"""
@@ -1620,14 +1798,18 @@ class VPNAccountingApp:
             selected_item = selection[0]
             item_values = self.payment_tree.item(selected_item, 'values')
             
-            # Don't enable delete for TOTAL row
-            if item_values[0] != 'TOTAL':
+            # Don't enable delete for TOTAL or archived rows
+            if item_values[0] != 'TOTAL' and 'archived' not in self.payment_tree.item(selected_item, 'tags'):
                 self.delete_payment_btn.config(state='normal')
             else:
                 self.delete_payment_btn.config(state='disabled')
         else:
             self.delete_payment_btn.config(state='disabled')
     
+    def is_read_only_invoice(self, item):
+        """Archived invoices and the Carried Forward row standing in for them cannot be changed"""
+        return bool({'archived', 'carried_forward'} & set(self.invoice_tree.item(item, 'tags')))
+    
     def on_invoice_select(self, event):
         """Handle invoice selection in treeview"""
         selection = self.invoice_tree.selection()
@@ -1636,8 +1818,8 @@ class VPNAccountingApp:
             selected_item = selection[0]
             item_values = self.invoice_tree.item(selected_item, 'values')
             
-            # Don't enable buttons for TOTAL row
-            if item_values[0] != 'TOTAL':
+            # Don't enable buttons for TOTAL, archived or carried-forward rows
+            if item_values[0] != 'TOTAL' and not self.is_read_only_invoice(selected_item):
                 self.edit_invoice_btn.config(state='normal')
                 self.delete_invoice_btn.config(state='normal')
             else:
@@ -1660,72 +1842,41 @@ class VPNAccountingApp:
         if item_values[0] == 'TOTAL':
             return
         
-        # Find the index of the selected item (excluding TOTAL row)
-        children = self.payment_tree.get_children()
-        selected_index = children.index(selected_item)
-        
-        if selected_index >= len(self.payment_ids):
+        # Row ids are payment ids
+        payment_id = int(selected_item)
+        if payment_id in self.archived_payment_ids:
             return
         
-        payment_id = self.payment_ids[selected_index]
-        
-        # Get payment details for confirmation
-        self.cursor.execute("""
-            SELECT p.amount, p.payment_date, a.name 
-            FROM payments p 
-            JOIN admin_accounts a ON p.admin_uuid = a.uuid 
-            WHERE p.id = ?
-        """, (payment_id,))
-        
-        result = self.cursor.fetchone()
-        if not result:
-            return
-        
-        amount, payment_date, admin_name = result
-        date_part = payment_date.split()[0] if ' ' in payment_date else payment_date
-        
-        # Ask for confirmation
-        confirm = messagebox.askyesno(
-            "Confirm Deletion", 
-            f"Are you sure you want to delete this payment?\n\n"
-            f"Admin: {admin_name}\n"
-            f"Date: {date_part}\n"
-            f"Amount: {self.format_amount_for_display(amount)}K تومان"
-        )
-        
-        if confirm:
-            # Get admin UUID for updating total_paid
-            self.cursor.execute("SELECT admin_uuid FROM payments WHERE id = ?", (payment_id,))
-            admin_uuid = self.cursor.fetchone()[0]
-            
-            # Delete the payment
-            self.cursor.execute("DELETE FROM payments WHERE id = ?", (payment_id,))
-            
-            # Update admin's total_paid
-            self.cursor.execute("""
-                UPDATE admin_accounts 
-                SET total_paid = total_paid - ? 
-                WHERE uuid = ?
-            """, (amount, admin_uuid))
-            
-            self.conn.commit()
+        def confirm_deletion(payment):
+            if not payment:
+                return
             
-            # Refresh displays
-            self.load_admin_accounts()
-            self.load_dashboard_data()
+            amount, payment_date, admin_name, admin_uuid = payment
+            date_part = payment_date.split()[0] if ' ' in payment_date else payment_date
             
-            # Refresh admin detail page
-            self.cursor.execute("SELECT total_earned, total_paid FROM admin_accounts WHERE uuid = ?", (admin_uuid,))
-            result = self.cursor.fetchone()
-            if result:
-                total_earned, total_paid = result
-                remainder = total_earned - total_paid
-                self.admin_earned_var.set(f"{self.format_amount_for_display(total_earned)}K تومان")
-                self.admin_paid_var.set(f"{self.format_amount_for_display(total_paid)}K تومان")
-                self.admin_balance_var.set(f"{self.format_amount_for_display(remainder)}K تومان")
-                self.load_admin_payment_history(admin_uuid)
+            # Ask for confirmation
+            confirm = messagebox.askyesno(
+                "Confirm Deletion", 
+                f"Are you sure you want to delete this payment?\n\n"
+                f"Admin: {admin_name}\n"
+                f"Date: {date_part}\n"
+                f"Amount: {self.format_amount_for_display(amount)}K تومان"
+            )
             
-            messagebox.showinfo("Success", f"Payment of {self.format_amount_for_display(amount)}K تومان deleted successfully!")
+            if confirm:
+                def deleted(_):
+                    # Refresh displays
+                    self.load_admin_accounts()
+                    self.load_dashboard_data()
+                    self.refresh_admin_detail(admin_uuid)
+                    
+                    messagebox.showinfo("Success", f"Payment of {self.format_amount_for_display(amount)}K تومان deleted successfully!")
+                
+                self.db_worker.submit(accounting_store.delete_payment, payment_id, amount, admin_uuid,
+                                      write=True, callback=deleted)
+        
+        # Get payment details for confirmation
+        self.db_worker.submit(accounting_store.get_payment, payment_id, callback=confirm_deletion)
     
     def delete_selected_invoice(self):
         """Delete the selected invoice record"""
@@ -1740,46 +1891,29 @@ class VPNAccountingApp:
         if item_values[0] == 'TOTAL':
             return
         
-        # Find the index of the selected item (excluding TOTAL row)
-        children = self.invoice_tree.get_children()
-        selected_index = children.index(selected_item)
-        
-        if selected_index >= len(self.invoice_ids):
+        # Row ids are invoice ids
+        invoice_id = int(selected_item)
+        if self.is_read_only_invoice(selected_item):
             return
         
-        invoice_id = self.invoice_ids[selected_index]
-        
-        # Get invoice details for confirmation
-        self.cursor.execute("""
-            SELECT ia.amount, ia.addition_date, ia.invoice_period_start, ia.invoice_period_end, a.name, ia.admin_uuid
-            FROM invoice_additions ia
-            JOIN admin_accounts a ON ia.admin_uuid = a.uuid 
-            WHERE ia.id = ?
-        """, (invoice_id,))
-        
-        result = self.cursor.fetchone()
-        if not result:
-            return
-        
-        amount, addition_date, start_date, end_date, admin_name, admin_uuid = result
-        
-        # Format period for display
-        if start_date and end_date:
-            start_part = start_date.split()[0] if ' ' in start_date else start_date
-            end_part = end_date.split()[0] if ' ' in end_date else end_date
-            period_text = f"{start_part} to {end_part}"
-        else:
-            date_part = addition_date.split()[0] if ' ' in addition_date else addition_date
-            period_text = date_part
-        
-        # Check if this invoice is paid (green)
-        is_paid = self.is_invoice_paid(invoice_id, admin_uuid)
-        
-        if is_paid:
-            # Calculate which payments need to be reduced
-            payment_reductions = self.calculate_payment_reductions_for_invoice(invoice_id, admin_uuid, amount)
+        def confirm_deletion(info):
+            if not info:
+                return
+            
+            amount, addition_date, start_date, end_date, admin_name, admin_uuid = info['invoice']
+            is_paid = info['is_paid']
+            payment_reductions = info['payment_reductions']
+            
+            # Format period for display
+            if start_date and end_date:
+                start_part = start_date.split()[0] if ' ' in start_date else start_date
+                end_part = end_date.split()[0] if ' ' in end_date else end_date
+                period_text = f"{start_part} to {end_part}"
+            else:
+                date_part = addition_date.split()[0] if ' ' in addition_date else addition_date
+                period_text = date_part
             
-            if payment_reductions:
+            if is_paid and payment_reductions:
                 # Show detailed confirmation for paid invoice deletion
                 reduction_text = "\n".join([f"• Payment {p['date']}: -{self.format_amount_for_display(p['amount'])}K تومان" for p in payment_reductions])
                 
@@ -1801,60 +1935,27 @@ class VPNAccountingApp:
                     f"Amount: {self.format_amount_for_display(amount)}K تومان\n\n"
                     f"⚠️ Warning: This will reduce the admin's total_earned amount!"
                 )
-        else:
-            # Regular confirmation for unpaid invoice
-            confirm = messagebox.askyesno(
-                "Confirm Invoice Deletion", 
-                f"Are you sure you want to delete this invoice?\n\n"
-                f"Admin: {admin_name}\n"
-                f"Period: {period_text}\n"
-                f"Amount: {self.format_amount_for_display(amount)}K تومان\n\n"
-                f"⚠️ Warning: This will reduce the admin's total_earned amount!"
-            )
-        
-        if confirm:
-            # Delete the invoice
-            self.cursor.execute("DELETE FROM invoice_additions WHERE id = ?", (invoice_id,))
-            
-            # Update admin's total_earned
-            self.cursor.execute("""
-                UPDATE admin_accounts 
-                SET total_earned = total_earned - ? 
-                WHERE uuid = ?
-            """, (amount, admin_uuid))
-            
-            # If invoice was paid, reduce corresponding payment amounts
-            if is_paid and payment_reductions:
-                self.reduce_payment_amounts(payment_reductions, admin_uuid)
-            
-            self.conn.commit()
-            
-            # Refresh displays
-            self.load_admin_accounts()
-            self.load_dashboard_data()
             
-            # Refresh admin detail page
-            self.cursor.execute("SELECT total_earned, total_paid FROM admin_accounts WHERE uuid = ?", (admin_uuid,))
-            result = self.cursor.fetchone()
-            if result:
-                total_earned, total_paid = result
-                remainder = total_earned - total_paid
-                self.admin_earned_var.set(f"{total_earned:,.0f} تومان")
-                self.admin_paid_var.set(f"{total_paid:,.0f} تومان")
-                self.admin_balance_var.set(f"{remainder:,.0f} تومان")
-                self.load_admin_invoice_history(admin_uuid)
-                self.load_admin_payment_history(admin_uuid)
-            
-            # Reset invoice selection
-            self.delete_invoice_btn.config(state='disabled')
-            self.edit_invoice_btn.config(state='disabled')
-            
-            if is_paid:
-                messagebox.showinfo("Success", 
-                                  f"Paid invoice of {amount:,.0f} تومان deleted successfully!\n"
-                                  f"Payment amounts have been adjusted accordingly.")
-            else:
-                messagebox.showinfo("Success", f"Invoice of {amount:,.0f} تومان deleted successfully!")
+            if confirm:
+                def deleted(_):
+                    # Refresh displays
+                    self.load_admin_accounts()
+                    self.load_dashboard_data()
+                    self.refresh_admin_detail(admin_uuid)
+                    
+                    if is_paid:
+                        messagebox.showinfo("Success", 
+                                          f"Paid invoice of {amount:,.0f} تومان deleted successfully!\n"
+                                          f"Payment amounts have been adjusted accordingly.")
+                    else:
+                        messagebox.showinfo("Success", f"Invoice of {amount:,.0f} تومان deleted successfully!")
+                
+                # Delete the invoice; if it was paid, reduce corresponding payment amounts
+                self.db_worker.submit(accounting_store.delete_invoice_addition, invoice_id, amount, admin_uuid,
+                                      payment_reductions, write=True, callback=deleted)
+        
+        # Get invoice details, paid status and payment reductions for confirmation
+        self.db_worker.submit(accounting_store.get_invoice_deletion_info, invoice_id, callback=confirm_deletion)
     
     def edit_selected_invoice(self):
         """Edit the selected invoice amount"""
@@ -1869,28 +1970,21 @@ class VPNAccountingApp:
         if item_values[0] == 'TOTAL':
             return
         
-        # Find the index of the selected item (excluding TOTAL row)
-        children = self.invoice_tree.get_children()
-        selected_index = children.index(selected_item)
-        
-        if selected_index >= len(self.invoice_ids):
+        # Row ids are invoice ids
+        invoice_id = int(selected_item)
+        if self.is_read_only_invoice(selected_item):
             return
         
-        invoice_id = self.invoice_ids[selected_index]
-        
-        # Get invoice details
-        self.cursor.execute("""
-            SELECT ia.amount, ia.addition_date, ia.invoice_period_start, ia.invoice_period_end, a.name, ia.admin_uuid
-            FROM invoice_additions ia
-            JOIN admin_accounts a ON ia.admin_uuid = a.uuid 
-            WHERE ia.id = ?
-        """, (invoice_id,))
-        
-        result = self.cursor.fetchone()
-        if not result:
+        # Get invoice details, then show the edit dialog
+        self.db_worker.submit(accounting_store.get_invoice_addition, invoice_id,
+                              callback=lambda invoice: self.show_edit_invoice_dialog(invoice_id, invoice))
+    
+    def show_edit_invoice_dialog(self, invoice_id, invoice):
+        """Dialog for changing an invoice addition's amount"""
+        if not invoice:
             return
         
-        old_amount, addition_date, start_date, end_date, admin_name, admin_uuid = result
+        old_amount, addition_date, start_date, end_date, admin_name, admin_uuid = invoice
         
         # Format period for display
         if start_date and end_date:
@@ -1935,45 +2029,22 @@ class VPNAccountingApp:
                 if new_amount < 0:
                     messagebox.showerror("Error", "Amount cannot be negative")
                     return
-                
-                # Calculate the difference
-                amount_difference = new_amount - old_amount
-                
-                # Update the invoice amount
-                self.cursor.execute("UPDATE invoice_additions SET amount = ? WHERE id = ?", (new_amount, invoice_id))
-                
-                # Update admin's total_earned
-                self.cursor.execute("""
-                    UPDATE admin_accounts 
-                    SET total_earned = total_earned + ? 
-                    WHERE uuid = ?
-                """, (amount_difference, admin_uuid))
-                
-                self.conn.commit()
-                
+            except ValueError:
+                messagebox.showerror("Error", "Please enter a valid number")
+                return
+            
+            def saved(_):
                 # Refresh displays
                 self.load_admin_accounts()
                 self.load_dashboard_data()
-                
-                # Refresh admin detail page
-                self.cursor.execute("SELECT total_earned, total_paid FROM admin_accounts WHERE uuid = ?", (admin_uuid,))
-                result = self.cursor.fetchone()
-                if result:
-                    total_earned, total_paid = result
-                    remainder = total_earned - total_paid
-                    self.admin_earned_var.set(f"{self.format_amount_for_display(total_earned)}K تومان")
-                    self.admin_paid_var.set(f"{self.format_amount_for_display(total_paid)}K تومان")
-                    self.admin_balance_var.set(f"{self.format_amount_for_display(remainder)}K تومان")
-                    self.load_admin_invoice_history(admin_uuid)
+                self.refresh_admin_detail(admin_uuid)
                 
                 edit_dialog.destroy()
-                # Reset button states
-                self.edit_invoice_btn.config(state='disabled')
-                self.delete_invoice_btn.config(state='disabled')
                 messagebox.showinfo("Success", f"Invoice amount updated from {self.format_amount_for_display(old_amount)}K to {self.format_amount_for_display(new_amount)}K تومان")
-                
-            except ValueError:
-                messagebox.showerror("Error", "Please enter a valid number")
+            
+            # Update the invoice amount and admin's total_earned
+            self.db_worker.submit(accounting_store.update_invoice_addition_amount, invoice_id, admin_uuid,
+                                  old_amount, new_amount, write=True, callback=saved)
         
         def cancel_edit():
             edit_dialog.destroy()
@@ -1985,129 +2056,6 @@ class VPNAccountingApp:
         amount_entry.bind('<Return>', lambda e: save_changes())
         amount_entry.bind('<Escape>', lambda e: cancel_edit())
     
-    def is_invoice_paid(self, invoice_id, admin_uuid):
-        """Check if an invoice is paid (green) based on payment history"""
-        # Get all invoices for this admin (ordered by date ascending)
-        self.cursor.execute("""
-            SELECT id, amount FROM invoice_additions 
-            WHERE admin_uuid = ? 
-            ORDER BY addition_date ASC
-        """, (admin_uuid,))
-        
-        invoices = self.cursor.fetchall()
-        
-        # Get total payments for this admin
-        self.cursor.execute("""
-            SELECT SUM(amount) FROM payments WHERE admin_uuid = ?
-        """, (admin_uuid,))
-        
-        total_payments_result = self.cursor.fetchone()
-        total_payments = total_payments_result[0] if total_payments_result[0] else 0
-        
-        # Calculate which invoices are paid
-        cumulative_invoice_amount = 0
-        paid_invoice_ids = []
-        
-        for inv_id, inv_amount in invoices:
-            cumulative_invoice_amount += inv_amount
-            if cumulative_invoice_amount <= total_payments:
-                paid_invoice_ids.append(inv_id)
-        
-        return invoice_id in paid_invoice_ids
-    
-    def calculate_payment_reductions_for_invoice(self, invoice_id, admin_uuid, invoice_amount):
-        """Calculate which payment amounts should be reduced when deleting a paid invoice"""
-        # Get all invoices for this admin (ordered by date ascending)
-        self.cursor.execute("""
-            SELECT id, amount FROM invoice_additions 
-            WHERE admin_uuid = ? 
-            ORDER BY addition_date ASC
-        """, (admin_uuid,))
-        
-        invoices = self.cursor.fetchall()
-        
-        # Get all payments for this admin (ordered by date ascending)
-        self.cursor.execute("""
-            SELECT id, amount, payment_date FROM payments 
-            WHERE admin_uuid = ? 
-            ORDER BY payment_date ASC
-        """, (admin_uuid,))
-        
-        payments = self.cursor.fetchall()
-        
-        # Find the position of the invoice to be deleted
-        invoice_position = None
-        cumulative_invoice_amount = 0
-        for i, (inv_id, inv_amount) in enumerate(invoices):
-            if inv_id == invoice_id:
-                invoice_position = i
-                break
-            cumulative_invoice_amount += inv_amount
-        
-        if invoice_position is None:
-            return []
-        
-        # Calculate which payments were used to pay this invoice
-        payment_reductions = []
-        remaining_amount_to_reduce = invoice_amount
-        
-        # Find which payments were used to pay this specific invoice
-        cumulative_payment_amount = 0
-        for payment_id, payment_amount, payment_date in payments:
-            cumulative_payment_amount += payment_amount
-            
-            # If this payment was used to pay invoices up to and including our target invoice
-            if cumulative_payment_amount > cumulative_invoice_amount:
-                # Calculate how much of this payment was used for our target invoice
-                amount_used_for_this_invoice = min(
-                    remaining_amount_to_reduce,
-                    cumulative_payment_amount - cumulative_invoice_amount
-                )
-                
-                if amount_used_for_this_invoice > 0:
-                    payment_reductions.append({
-                        'payment_id': payment_id,
-                        'amount': amount_used_for_this_invoice,
-                        'date': payment_date.split()[0] if ' ' in payment_date else payment_date
-                    })
-                    remaining_amount_to_reduce -= amount_used_for_this_invoice
-                
-                if remaining_amount_to_reduce <= 0:
-                    break
-        
-        return payment_reductions
-    
-    def reduce_payment_amounts(self, payment_reductions, admin_uuid):
-        """Reduce payment amounts based on the calculated reductions"""
-        total_reduction = 0
-        
-        for reduction in payment_reductions:
-            payment_id = reduction['payment_id']
-            amount_to_reduce = reduction['amount']
-            
-            # Get current payment amount
-            self.cursor.execute("SELECT amount FROM payments WHERE id = ?", (payment_id,))
-            current_amount = self.cursor.fetchone()[0]
-            
-            # Calculate new amount
-            new_amount = current_amount - amount_to_reduce
-            
-            if new_amount > 0:
-                # Update payment amount
-                self.cursor.execute("UPDATE payments SET amount = ? WHERE id = ?", (new_amount, payment_id))
-            else:
-                # Delete payment if amount becomes zero or negative
-                self.cursor.execute("DELETE FROM payments WHERE id = ?", (payment_id,))
-            
-            total_reduction += amount_to_reduce
-        
-        # Update admin's total_paid
-        self.cursor.execute("""
-            UPDATE admin_accounts 
-            SET total_paid = total_paid - ? 
-            WHERE uuid = ?
-        """, (total_reduction, admin_uuid))
-    
     def generate_invoices(self):
         """Generate invoices for the selected period"""
         try:
@@ -2122,58 +2070,155 @@ class VPNAccountingApp:
             messagebox.showerror("Error", "No backup files found. Please download backups first.")
             return
         
-        # Generate invoices with accounting integration
-        try:
-            # Delete old invoices
-            delete_folder("invoices")
-            
-            # Import enhanced data processing
+        output_mode = self.invoice_output_mode.get()
+        zip_bundles = self.zip_invoice_bundles.get()
+        archive_format = self.get_invoice_archive_format()
+        
+        # Generate invoices with accounting integration (without adding to admin accounts)
+        self.start_invoice_run(start_date, end_date, False, output_mode, zip_bundles, archive_format,
+                               "Invoices generated", "Failed to generate invoices",
+                               "Note: Use 'Add Invoice Amounts to Accounts' button to add these amounts to admin accounts.")
+    
+    def start_invoice_run(self, start_date, end_date, add_to_accounts, output_mode, zip_bundles, archive_format,
+                          done_title, error_title, done_note=""):
+        """Run process_invoices_with_accounting on the job worker with progress, cancel and a summary"""
+        cancel_event = threading.Event()
+        progress = self.invoice_progress
+        
+        def run(conn):
             from enhanced_data_processing import process_invoices_with_accounting
             
-            # Process invoices with accounting (without adding to admin accounts)
-            total_earnings = process_invoices_with_accounting(self.conn, start_date, end_date)
+            # A new generation run replaces the old invoices
+            if not add_to_accounts:
+                delete_folder("invoices")
+            # Runs on the job thread: events are handed to the Tk thread via the queue
+            return process_invoices_with_accounting(conn, start_date, end_date, add_to_accounts,
+                                                    output_mode=output_mode,
+                                                    zip_bundles=zip_bundles,
+                                                    archive_format=archive_format,
+                                                    progress_callback=progress.put,
+                                                    cancel_event=cancel_event)
+        
+        def finish():
+            self.invoice_cancel_event = None
+            self.show_invoice_progress()
+            self.set_invoice_buttons_state('normal')
             
             # Refresh displays
             self.load_admin_accounts()
             self.load_dashboard_data()
-            
-            messagebox.showinfo("Success", 
-                              f"Invoices generated successfully!\nTotal earnings: {self.format_amount_for_display(total_earnings)}K تومان\n\nNote: Use 'Add Invoice Amounts to Accounts' button to add these amounts to admin accounts.")
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to generate invoices: {str(e)}")
+            self.load_invoices()
+        
+        def done(summary):
+            finish()
+            earnings = self.format_amount_for_display(summary['total_earnings'])
+            if summary['cancelled']:
+                self.invoice_status.config(text="Cancelled")
+                messagebox.showinfo("Cancelled",
+                                  f"{done_title} for {summary['admins']} admins before the run was cancelled "
+                                  f"({summary['panels']} panels finished).\nTotal earnings so far: {earnings}K تومان"
+                                  + ("\n\nRunning it again skips the admins already added." if add_to_accounts else ""))
+                return
+            self.invoice_status.config(text="Done")
+            message = (f"{done_title} successfully!\n{summary['admins']} admins in {summary['panels']} panels\n"
+                       f"Total earnings: {earnings}K تومان")
+            if summary['skipped']:
+                message += f"\n{summary['skipped']} admins skipped: this period was already added to their accounts"
+            if done_note:
+                message += f"\n\n{done_note}"
+            messagebox.showinfo("Success", message)
+        
+        def failed(e):
+            finish()
+            self.invoice_status.config(text="Failed")
+            messagebox.showerror("Error", f"{error_title}: {str(e)}")
+        
+        self.invoice_cancel_event = cancel_event
+        self.invoice_progress_var.set(0)
+        self.invoice_status.config(text="Starting...")
+        self.set_invoice_buttons_state('disabled')
+        self.job_worker.submit(run, write=True, callback=done, errback=failed)
+        self.root.after(100, self.poll_invoice_progress)
+    
+    def poll_invoice_progress(self):
+        """Tk thread: show the latest progress while an invoice run is going"""
+        if self.invoice_cancel_event is None:
+            return
+        self.show_invoice_progress()
+        self.root.after(100, self.poll_invoice_progress)
+    
+    def show_invoice_progress(self):
+        """Move the progress bar to the newest queued event"""
+        event = None
+        while True:
+            try:
+                event = self.invoice_progress.get_nowait()
+            except queue.Empty:
+                break
+        if event is None:
+            return
+        
+        # Each panel is an equal share of the bar, split between its main admins
+        panel_share = 1.0 / max(event['panels'], 1)
+        done_in_panel = event['admin'] / event['admins'] if event['admins'] else 0
+        self.invoice_progress_var.set(panel_share * (event['panel'] - 1 + done_in_panel))
+        
+        status = f"Panel {event['panel']}/{event['panels']}"
+        if event['name']:
+            status += f" - {event['name']} ({event['admin']}/{event['admins']})"
+        self.invoice_status.config(text=status)
+    
+    def cancel_invoice_run(self):
+        """Ask the running invoice job to stop after the current admin"""
+        if self.invoice_cancel_event is not None:
+            self.invoice_cancel_event.set()
+            self.cancel_invoices_btn.config(state='disabled')
+            self.invoice_status.config(text="Cancelling after the current admin...")
+    
+    def set_invoice_buttons_state(self, state):
+        """Enable or disable the invoice run buttons while a run is in progress"""
+        self.generate_btn.config(state=state)
+        self.add_invoice_amounts_btn.config(state=state)
+        # Cancel is only available while a run is going
+        self.cancel_invoices_btn.config(state='normal' if state == 'disabled' else 'disabled')
     
     def add_invoice_amounts_to_accounts(self):
         """Add generated invoice amounts to admin accounts"""
+        # Check if invoices exist
+        if not os.path.exists('invoices'):
+            messagebox.showwarning("Warning", "No invoices found. Please generate invoices first.")
+            return
+        
+        # Get the date range from the GUI
         try:
-            # Check if invoices exist
-            if not os.path.exists('invoices'):
-                messagebox.showwarning("Warning", "No invoices found. Please generate invoices first.")
-                return
-            
-            # Import enhanced data processing to calculate amounts
-            from enhanced_data_processing import process_invoices_with_accounting
-            
-            # Get the date range from the GUI
-            try:
-                start_date = datetime.strptime(self.start_date.get(), '%Y-%m-%d')
-                end_date = datetime.strptime(self.end_date.get(), '%Y-%m-%d')
-            except:
-                messagebox.showerror("Error", "Invalid date format. Use YYYY-MM-DD")
-                return
+            start_date = datetime.strptime(self.start_date.get(), '%Y-%m-%d')
+            end_date = datetime.strptime(self.end_date.get(), '%Y-%m-%d')
+        except:
+            messagebox.showerror("Error", "Invalid date format. Use YYYY-MM-DD")
+            return
+        
+        output_mode = self.invoice_output_mode.get()
+        zip_bundles = self.zip_invoice_bundles.get()
+        archive_format = self.get_invoice_archive_format()
+        
+        period_start, period_end = start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
+        
+        def checked(names):
+            # Admins already credited for this period are skipped by the run
+            if names:
+                listed = "\n".join(names[:10]) + (f"\n... and {len(names) - 10} more" if len(names) > 10 else "")
+                if not messagebox.askyesno(
+                        "Period Already Added",
+                        f"Invoice amounts for {period_start} to {period_end} were already "
+                        f"added for {len(names)} admins:\n\n{listed}\n\n"
+                        f"They will be skipped. Add the amounts for the other admins?"):
+                    return
             
             # Calculate earnings and add to admin accounts
-            total_earnings = process_invoices_with_accounting(self.conn, start_date, end_date, add_to_accounts=True)
-            
-            # Refresh displays
-            self.load_admin_accounts()
-            self.load_dashboard_data()
-            
-            messagebox.showinfo("Success", 
-                              f"Invoice amounts added to admin accounts!\nTotal earnings: {self.format_amount_for_display(total_earnings)}K تومان")
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to add invoice amounts: {str(e)}")
+            self.start_invoice_run(start_date, end_date, True, output_mode, zip_bundles, archive_format,
+                                   "Invoice amounts added to admin accounts", "Failed to add invoice amounts")
+        
+        self.db_worker.submit(accounting_store.list_period_additions, period_start, period_end, callback=checked)
     
     def update_invoice_database(self, start_date, end_date):
         """Update invoice database with generated invoices"""
@@ -2183,20 +2228,18 @@ class VPNAccountingApp:
     
     def load_invoices(self):
         """Load invoices in the invoices tab"""
+        if not hasattr(self, 'invoices_tree'):
+            return
+        self.db_worker.submit(accounting_store.list_generated_invoices, self.include_archive_var.get(),
+                              callback=self.display_invoices)
+    
+    def display_invoices(self, rows):
+        """Show rows from the invoices table in the invoices tab"""
         # Clear existing items
         for item in self.invoices_tree.get_children():
             self.invoices_tree.delete(item)
         
-        # Get invoices from database
-        self.cursor.execute('''
-            SELECT invoice_date, 
-                   (SELECT name FROM admin_accounts WHERE uuid = i.admin_uuid) as admin_name,
-                   usage_gb, amount, status, pdf_path
-            FROM invoices i
-            ORDER BY invoice_date DESC
-        ''')
-        
-        for row in self.cursor.fetchall():
+        for row in rows:
             self.invoices_tree.insert('', 'end', values=row)
     
     def open_invoice_pdf(self, event):
@@ -2204,9 +2247,11 @@ class VPNAccountingApp:
         selection = self.invoices_tree.selection()
         if selection:
             item = self.invoices_tree.item(selection[0])
-            pdf_path = item['values'][5]
+            # Archive members ("<archive>::<member>") are extracted to a temp file first
+            from pdf_generation import resolve_invoice_pdf
+            pdf_path = resolve_invoice_pdf(item['values'][5])
             
-            if pdf_path and os.path.exists(pdf_path):
+            if pdf_path:
                 import subprocess
                 import platform
                 
@@ -2223,8 +2268,17 @@ class VPNAccountingApp:
 
 def main():
     root = tk.Tk()
+    # VPN_UI_PROFILE=1 times every callback and the event-loop lag (see ui_profiler.py)
+    if ui_profiler.ENABLED:
+        ui_profiler.install(root)
     app = VPNAccountingApp(root)
     root.mainloop()
+    # Let queued database work finish, then close the connections (closing the
+    # writer checkpoints the WAL back into the database file)
+    app.db_worker.stop()
+    app.job_worker.stop()
+    app.db.close()
+    app.job_db.close()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,208 @@
+"""
+Append-only ledger of every money movement, with monthly balance snapshots.
+
+Each invoice addition, indebtedness, payment and correction is one row in
+ledger_entries, dated by when the money moved (entry_date) and stamped with
+when it was booked (recorded_at). Rows are never updated or deleted (SQLite
+triggers refuse it); corrections are booked as adjustment rows.
+
+balance_snapshots caches an admin's cumulative totals at the end of each month
+with activity, so a balance at any date is the nearest earlier snapshot plus
+the entries after it. admin_accounts.total_earned/total_paid stay as the fast
+denormalized copy and can be checked against or rebuilt from the ledger:
+
+    python ledger.py check
+    python ledger.py rebuild
+    python ledger.py balance <admin_uuid> [YYYY-MM-DD]
+"""
+
+import sys
+from datetime import datetime, timedelta
+
+# Kinds of money movement
+ENTRY_INVOICE = 'invoice'
+ENTRY_INDEBTEDNESS = 'indebtedness'
+ENTRY_PAYMENT = 'payment'
+ENTRY_ADJUSTMENT = 'adjustment'
+
+# Stored totals closer than this to the ledger count as matching (REAL rounding)
+TOTALS_TOLERANCE = 0.01
+
+def _month(date_text):
+    """'YYYY-MM' of a date or datetime string"""
+    return date_text[:7]
+
+def _after_month(month):
+    """Sorts after every date in the month ('YYYY-MM' -> 'YYYY-MM-~')"""
+    return month + '-~'
+
+def record_entry(conn, admin_uuid, entry_type, entry_date, earned=0, paid=0,
+                 source_table=None, source_id=None, note=None):
+    """Append a money movement and drop the snapshots it makes stale"""
+    record_entries(conn, [(admin_uuid, entry_type, entry_date, earned, paid, source_table, source_id, note)])
+
+def record_entries(conn, entries):
+    """
+    Append many movements at once. Each entry is (admin_uuid, entry_type,
+    entry_date, earned, paid, source_table, source_id, note).
+    """
+    recorded_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.executemany('''
+        INSERT INTO ledger_entries
+            (admin_uuid, entry_type, entry_date, earned, paid, source_table, source_id, note, recorded_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [tuple(entry) + (recorded_at,) for entry in entries])
+
+    # Snapshots are a cache; a back-dated entry invalidates the months after it
+    earliest = {}
+    for entry in entries:
+        admin_uuid, month = entry[0], _month(entry[2])
+        earliest[admin_uuid] = min(month, earliest.get(admin_uuid, month))
+    conn.executemany("DELETE FROM balance_snapshots WHERE admin_uuid = ? AND month >= ?",
+                     list(earliest.items()))
+
+def take_snapshots(conn):
+    """Snapshot every admin's totals at the end of each finished month not yet snapshotted"""
+    current_month = datetime.now().strftime("%Y-%m")
+    admin_uuids = [row[0] for row in conn.execute("SELECT DISTINCT admin_uuid FROM ledger_entries").fetchall()]
+    created = 0
+
+    for admin_uuid in admin_uuids:
+        last = conn.execute('''
+            SELECT month, total_earned, total_paid FROM balance_snapshots
+            WHERE admin_uuid = ? ORDER BY month DESC LIMIT 1
+        ''', (admin_uuid,)).fetchone()
+        since_month, earned, paid = last if last else ('', 0, 0)
+
+        months = conn.execute('''
+            SELECT substr(entry_date, 1, 7) AS month, SUM(earned), SUM(paid)
+            FROM ledger_entries
+            WHERE admin_uuid = ? AND entry_date > ? AND entry_date < ?
+            GROUP BY month
+            ORDER BY month
+        ''', (admin_uuid, _after_month(since_month) if since_month else '', current_month)).fetchall()
+
+        for month, month_earned, month_paid in months:
+            earned += month_earned or 0
+            paid += month_paid or 0
+            conn.execute('''
+                INSERT INTO balance_snapshots (admin_uuid, month, total_earned, total_paid)
+                VALUES (?, ?, ?, ?)
+            ''', (admin_uuid, month, earned, paid))
+            created += 1
+
+    return created
+
+def get_balance(conn, admin_uuid, as_of=None):
+    """(total_earned, total_paid) for an admin at the end of the day as_of ('YYYY-MM-DD'), or now"""
+    if as_of is None:
+        until = '~'
+        before_month = '~'
+    else:
+        until = (datetime.strptime(as_of[:10], "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+        before_month = _month(as_of)
+
+    snapshot = conn.execute('''
+        SELECT month, total_earned, total_paid FROM balance_snapshots
+        WHERE admin_uuid = ? AND month < ?
+        ORDER BY month DESC LIMIT 1
+    ''', (admin_uuid, before_month)).fetchone()
+    since, earned, paid = (_after_month(snapshot[0]), snapshot[1], snapshot[2]) if snapshot else ('', 0, 0)
+
+    delta = conn.execute('''
+        SELECT COALESCE(SUM(earned), 0), COALESCE(SUM(paid), 0)
+        FROM ledger_entries
+        WHERE admin_uuid = ? AND entry_date > ? AND entry_date < ?
+    ''', (admin_uuid, since, until)).fetchone()
+    return earned + delta[0], paid + delta[1]
+
+def _ledger_totals(conn):
+    """{admin_uuid: (earned, paid)} summed over the whole ledger"""
+    return {
+        admin_uuid: (earned or 0, paid or 0)
+        for admin_uuid, earned, paid in conn.execute('''
+            SELECT admin_uuid, SUM(earned), SUM(paid) FROM ledger_entries GROUP BY admin_uuid
+        ''')
+    }
+
+def check_totals(conn):
+    """Admins whose stored totals disagree with the ledger: (uuid, name, stored, ledger) tuples"""
+    totals = _ledger_totals(conn)
+    mismatches = []
+    for uuid, name, total_earned, total_paid in conn.execute(
+            "SELECT uuid, name, total_earned, total_paid FROM admin_accounts"):
+        stored = (total_earned or 0, total_paid or 0)
+        expected = totals.get(uuid, (0, 0))
+        if abs(stored[0] - expected[0]) > TOTALS_TOLERANCE or abs(stored[1] - expected[1]) > TOTALS_TOLERANCE:
+            mismatches.append((uuid, name, stored, expected))
+    return mismatches
+
+def rebuild_totals(conn):
+    """Overwrite admin_accounts totals with the ledger sums; returns the number of admins corrected"""
+    mismatches = check_totals(conn)
+    conn.executemany(
+        "UPDATE admin_accounts SET total_earned = ?, total_paid = ? WHERE uuid = ?",
+        [(earned, paid, uuid) for uuid, _, _, (earned, paid) in mismatches]
+    )
+    return len(mismatches)
+
+def backfill_ledger(conn):
+    """Book the existing invoice additions and payments, plus an adjustment for any unexplained total"""
+    conn.execute('''
+        INSERT INTO ledger_entries
+            (admin_uuid, entry_type, entry_date, earned, paid, source_table, source_id, note, recorded_at)
+        SELECT admin_uuid,
+               CASE WHEN invoice_period_start = 'Start Up Indebtedness' THEN ? ELSE ? END,
+               addition_date, amount, 0, 'invoice_additions', id, NULL, datetime('now', 'localtime')
+        FROM invoice_additions
+    ''', (ENTRY_INDEBTEDNESS, ENTRY_INVOICE))
+    conn.execute('''
+        INSERT INTO ledger_entries
+            (admin_uuid, entry_type, entry_date, earned, paid, source_table, source_id, note, recorded_at)
+        SELECT admin_uuid, ?, payment_date, 0, amount, 'payments', id, NULL, datetime('now', 'localtime')
+        FROM payments
+    ''', (ENTRY_PAYMENT,))
+
+    # Totals changed outside the history tables (older versions) become an opening adjustment
+    today = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    for uuid, _, (total_earned, total_paid), (earned, paid) in check_totals(conn):
+        record_entry(conn, uuid, ENTRY_ADJUSTMENT, today, total_earned - earned, total_paid - paid,
+                     note="Opening balance from admin_accounts")
+
+    take_snapshots(conn)
+
+def main():
+    from database import ConnectionManager
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'check'
+    db = ConnectionManager()
+    try:
+        if command == 'check':
+            with db.reader() as conn:
+                mismatches = check_totals(conn)
+            for uuid, name, stored, expected in mismatches:
+                print(f"❌ {name} ({uuid}): stored earned/paid {stored[0]:,.0f}/{stored[1]:,.0f}, "
+                      f"ledger {expected[0]:,.0f}/{expected[1]:,.0f}")
+            if not mismatches:
+                print("✅ Admin totals match the ledger")
+            return not mismatches
+        if command == 'rebuild':
+            with db.write() as conn:
+                corrected = rebuild_totals(conn)
+                take_snapshots(conn)
+            print(f"✅ Rebuilt totals from the ledger ({corrected} admins corrected)")
+            return True
+        if command == 'balance' and len(sys.argv) > 2:
+            as_of = sys.argv[3] if len(sys.argv) > 3 else None
+            with db.reader() as conn:
+                earned, paid = get_balance(conn, sys.argv[2], as_of)
+            print(f"💰 {sys.argv[2]} as of {as_of or 'now'}: earned {earned:,.0f}, paid {paid:,.0f}, "
+                  f"remainder {earned - paid:,.0f}")
+            return True
+        print("Usage: python ledger.py check | rebuild | balance <admin_uuid> [YYYY-MM-DD]")
+        return False
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,168 @@
+"""
+FIFO allocation of payments to invoice additions.
+
+Payments pay off an admin's invoice additions oldest first: invoices in
+(addition_date, id) order, payments in (payment_date, id) order. The
+payment_allocations table stores the result so paid status and the payments
+behind an invoice are lookups instead of a replay of the whole history:
+
+    payment_id + invoice_id   amount of that payment spent on that invoice
+    invoice_id only           part of the invoice still unpaid
+    payment_id only           part of the payment not spent yet (credit)
+
+After any change only the allocations from the first affected invoice onward
+are rebuilt. Write functions do not commit; callers commit with their change.
+"""
+
+def invoice_key(conn, invoice_id):
+    """(addition_date, id) of an invoice addition, or None"""
+    return conn.execute(
+        "SELECT addition_date, id FROM invoice_additions WHERE id = ?", (invoice_id,)
+    ).fetchone()
+
+def first_affected_invoice(conn, admin_uuid, payment_date, payment_id):
+    """
+    (addition_date, id) of the earliest invoice whose allocation can change
+    when the payment at (payment_date, payment_id) is added, edited or
+    deleted, or None if no invoice is affected. Call while the existing
+    allocations are still in place.
+    """
+    # Invoices covered by this payment or any later one
+    covered = conn.execute("""
+        SELECT i.addition_date, i.id
+        FROM payments p
+        JOIN payment_allocations pa ON pa.payment_id = p.id
+        JOIN invoice_additions i ON i.id = pa.invoice_id
+        WHERE p.admin_uuid = ? AND (p.payment_date, p.id) >= (?, ?)
+        ORDER BY i.addition_date, i.id
+        LIMIT 1
+    """, (admin_uuid, payment_date, payment_id)).fetchone()
+
+    # Invoices still waiting for money
+    unpaid = conn.execute("""
+        SELECT i.addition_date, i.id
+        FROM payment_allocations pa
+        JOIN invoice_additions i ON i.id = pa.invoice_id
+        WHERE pa.admin_uuid = ? AND pa.payment_id IS NULL
+        ORDER BY i.addition_date, i.id
+        LIMIT 1
+    """, (admin_uuid,)).fetchone()
+
+    candidates = [tuple(key) for key in (covered, unpaid) if key]
+    return min(candidates) if candidates else None
+
+def reallocate(conn, admin_uuid, start=None, payment_ids=()):
+    """
+    Rebuild the admin's allocations for invoices at or after `start`
+    ((addition_date, id)) and refresh the unspent credit of `payment_ids`
+    (payments that were inserted or changed).
+    """
+    involved = set(payment_ids)
+
+    if start is not None:
+        # Give the money spent on the affected invoices back to its payments
+        affected = """
+            SELECT id FROM invoice_additions
+            WHERE admin_uuid = ? AND (addition_date, id) >= (?, ?)
+        """
+        params = (admin_uuid, start[0], start[1])
+        involved.update(row[0] for row in conn.execute(f"""
+            SELECT DISTINCT payment_id FROM payment_allocations
+            WHERE invoice_id IN ({affected}) AND payment_id IS NOT NULL
+        """, params))
+        conn.execute(f"DELETE FROM payment_allocations WHERE invoice_id IN ({affected})", params)
+
+    for payment_id in involved:
+        conn.execute("DELETE FROM payment_allocations WHERE payment_id = ? AND invoice_id IS NULL", (payment_id,))
+        row = conn.execute("""
+            SELECT p.amount - COALESCE((SELECT SUM(amount) FROM payment_allocations WHERE payment_id = p.id), 0)
+            FROM payments p WHERE p.id = ?
+        """, (payment_id,)).fetchone()
+        if row and row[0] > 0:
+            conn.execute("""
+                INSERT INTO payment_allocations (payment_id, invoice_id, admin_uuid, amount)
+                VALUES (?, NULL, ?, ?)
+            """, (payment_id, admin_uuid, row[0]))
+
+    if start is None:
+        return
+
+    # Spend the unspent credit on the affected invoices, oldest first
+    credits = [list(row) for row in conn.execute("""
+        SELECT pa.payment_id, pa.amount
+        FROM payment_allocations pa
+        JOIN payments p ON p.id = pa.payment_id
+        WHERE pa.admin_uuid = ? AND pa.invoice_id IS NULL
+        ORDER BY p.payment_date, p.id
+    """, (admin_uuid,))]
+    invoices = conn.execute("""
+        SELECT id, amount FROM invoice_additions
+        WHERE admin_uuid = ? AND (addition_date, id) >= (?, ?)
+        ORDER BY addition_date, id
+    """, (admin_uuid, start[0], start[1])).fetchall()
+
+    allocations = []
+    position = 0
+    for invoice_id, amount in invoices:
+        due = amount or 0
+        while due > 0 and position < len(credits):
+            payment_id, available = credits[position]
+            used = min(due, available)
+            allocations.append((payment_id, invoice_id, admin_uuid, used))
+            credits[position][1] -= used
+            due -= used
+            if credits[position][1] <= 0:
+                position += 1
+        if due > 0:
+            allocations.append((None, invoice_id, admin_uuid, due))
+
+    allocations.extend(
+        (payment_id, None, admin_uuid, available)
+        for payment_id, available in credits[position:] if available > 0
+    )
+    conn.execute("DELETE FROM payment_allocations WHERE admin_uuid = ? AND invoice_id IS NULL", (admin_uuid,))
+    conn.executemany("""
+        INSERT INTO payment_allocations (payment_id, invoice_id, admin_uuid, amount)
+        VALUES (?, ?, ?, ?)
+    """, allocations)
+
+def rebuild_allocations(conn, admin_uuid=None):
+    """Recompute allocations from scratch for one admin, or for everyone"""
+    if admin_uuid is None:
+        admin_uuids = [row[0] for row in conn.execute("""
+            SELECT admin_uuid FROM payments
+            UNION
+            SELECT admin_uuid FROM invoice_additions
+        """).fetchall()]
+    else:
+        admin_uuids = [admin_uuid]
+
+    for uuid in admin_uuids:
+        conn.execute("DELETE FROM payment_allocations WHERE admin_uuid = ?", (uuid,))
+        payment_ids = [row[0] for row in conn.execute(
+            "SELECT id FROM payments WHERE admin_uuid = ?", (uuid,)
+        ).fetchall()]
+        first_invoice = conn.execute("""
+            SELECT addition_date, id FROM invoice_additions
+            WHERE admin_uuid = ?
+            ORDER BY addition_date, id
+            LIMIT 1
+        """, (uuid,)).fetchone()
+        reallocate(conn, uuid, first_invoice, payment_ids)
+
+def get_unpaid_invoice_ids(conn, admin_uuid):
+    """IDs of the admin's invoice additions that are not fully paid"""
+    return {row[0] for row in conn.execute("""
+        SELECT invoice_id FROM payment_allocations
+        WHERE admin_uuid = ? AND payment_id IS NULL
+    """, (admin_uuid,))}
+
+def get_invoice_payments(conn, invoice_id):
+    """(payment_id, amount, payment_date) of the payments spent on an invoice, oldest first"""
+    return conn.execute("""
+        SELECT pa.payment_id, pa.amount, p.payment_date
+        FROM payment_allocations pa
+        JOIN payments p ON p.id = pa.payment_id
+        WHERE pa.invoice_id = ?
+        ORDER BY p.payment_date, p.id
+    """, (invoice_id,)).fetchall()
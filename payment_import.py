@@ -0,0 +1,192 @@
+"""
+Bulk payment import from CSV files or pasted bank statement text.
+
+Each line names an admin (by UUID, FA number or name), an amount and
+optionally a date. A header row with column names is recognised in any
+column order; without one the columns are read as admin, amount, date.
+build_import_preview() matches and validates every row without writing;
+apply_payment_import() then records all valid rows in one transaction.
+"""
+
+import csv
+from collections import defaultdict
+
+from ledger import ENTRY_PAYMENT, record_entries
+from payment_allocations import first_affected_invoice, reallocate
+from utils import convert_non_ascii_to_ascii, parse_date
+
+# Header names (lower case) recognised for each column
+ADMIN_COLUMNS = {'admin', 'name', 'admin_name', 'uuid', 'admin_uuid', 'fa_number', 'fa', 'نام'}
+AMOUNT_COLUMNS = {'amount', 'payment', 'مبلغ'}
+DATE_COLUMNS = {'date', 'payment_date', 'تاریخ'}
+
+# Delimiters tried on pasted text, in order of preference
+DELIMITERS = '\t;|,'
+
+def _split_lines(text):
+    """Rows of cells from CSV or pasted text (tab, ;, | or , separated)"""
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return []
+
+    try:
+        dialect = csv.Sniffer().sniff('\n'.join(lines[:20]), delimiters=DELIMITERS)
+    except csv.Error:
+        # Statements copied from a web page are often aligned with spaces
+        return [[cell for cell in line.replace('\t', '  ').split('  ') if cell.strip()] for line in lines]
+    return list(csv.reader(lines, dialect))
+
+def _column_positions(header):
+    """(admin, amount, date) column indexes if the row is a header, else None"""
+    names = [cell.strip().lower() for cell in header]
+    positions = []
+    for columns in (ADMIN_COLUMNS, AMOUNT_COLUMNS, DATE_COLUMNS):
+        matches = [i for i, name in enumerate(names) if name in columns]
+        positions.append(matches[0] if matches else None)
+    if positions[0] is None or positions[1] is None:
+        return None
+    return tuple(positions)
+
+def parse_amount(text, amount_unit=1000):
+    """Amount in Tomans from text such as '1,500' or '۱۵۰۰' (multiplied by amount_unit), or None"""
+    clean_text = convert_non_ascii_to_ascii(text).replace(',', '').replace(' ', '').strip()
+    try:
+        return int(round(float(clean_text) * amount_unit))
+    except ValueError:
+        return None
+
+def parse_payment_date(text):
+    """'YYYY-MM-DD' for a Gregorian date (optionally with a time), or None"""
+    clean_text = convert_non_ascii_to_ascii(text).strip()
+    date = parse_date(clean_text) or parse_date(clean_text[:10])
+    if date is None or date.year < 1900:
+        # Solar Hijri (1403/...) dates are not converted
+        return None
+    return date.strftime('%Y-%m-%d')
+
+def _admin_index(conn):
+    """Lookup tables from UUID, FA number and name to (uuid, name) lists"""
+    by_uuid, by_fa_number, by_name = {}, defaultdict(list), defaultdict(list)
+    for uuid, name, fa_number in conn.execute("SELECT uuid, name, fa_number FROM admin_accounts"):
+        by_uuid[uuid.lower()] = (uuid, name)
+        if fa_number:
+            by_fa_number[str(fa_number).strip().lower()].append((uuid, name))
+        if name:
+            by_name[name.strip().casefold()].append((uuid, name))
+    return by_uuid, by_fa_number, by_name
+
+def _match_admin(index, text):
+    """((uuid, name), None) for the admin a cell refers to, or (None, error)"""
+    by_uuid, by_fa_number, by_name = index
+    key = text.strip()
+    if not key:
+        return None, "No admin"
+    if key.lower() in by_uuid:
+        return by_uuid[key.lower()], None
+    for table, lookup in ((by_fa_number, key.lower()), (by_name, key.casefold())):
+        matches = table.get(lookup, [])
+        if len(matches) == 1:
+            return matches[0], None
+        if len(matches) > 1:
+            return None, f"{len(matches)} admins match '{key}'"
+    return None, f"Unknown admin '{key}'"
+
+def build_import_preview(conn, text, amount_unit=1000, default_date=None):
+    """
+    Parse and match every row without writing anything. Returns a list of
+    dicts (line, admin_text, admin_uuid, admin_name, amount, payment_date,
+    error); rows with an error are not imported.
+    """
+    rows = _split_lines(text)
+    if not rows:
+        return []
+
+    positions = _column_positions(rows[0])
+    first_line = 2 if positions else 1
+    if positions:
+        rows = rows[1:]
+    else:
+        positions = (0, 1, 2)
+    admin_col, amount_col, date_col = positions
+
+    index = _admin_index(conn)
+    preview = []
+    # (admin, amount, date) of the rows accepted so far, so a line pasted twice imports once
+    accepted = {}
+    for line, cells in enumerate(rows, start=first_line):
+        cell = lambda col: cells[col].strip() if col is not None and col < len(cells) else ''
+        admin, error = _match_admin(index, cell(admin_col))
+        amount = parse_amount(cell(amount_col), amount_unit) if cell(amount_col) else None
+        date_text = cell(date_col)
+        payment_date = parse_payment_date(date_text) if date_text else default_date
+
+        if error is None:
+            if amount is None:
+                error = f"Invalid amount '{cell(amount_col)}'"
+            elif amount <= 0:
+                error = "Amount must be positive"
+            elif not payment_date:
+                error = f"Invalid date '{date_text}' (use YYYY-MM-DD)" if date_text else "No date"
+            elif conn.execute("""
+                    SELECT 1 FROM payments WHERE admin_uuid = ? AND amount = ? AND substr(payment_date, 1, 10) = ?
+                    """, (admin[0], amount, payment_date)).fetchone():
+                error = "Already recorded (same admin, amount and date)"
+            elif (admin[0], amount, payment_date) in accepted:
+                error = f"Duplicate of line {accepted[(admin[0], amount, payment_date)]}"
+            else:
+                accepted[(admin[0], amount, payment_date)] = line
+
+        preview.append({
+            'line': line,
+            'admin_text': cell(admin_col),
+            'admin_uuid': admin[0] if admin else None,
+            'admin_name': admin[1] if admin else None,
+            'amount': amount,
+            'payment_date': payment_date,
+            'error': error,
+        })
+    return preview
+
+def apply_payment_import(conn, preview):
+    """
+    Record every valid preview row as a payment. Does not commit; the caller
+    commits the whole import as one transaction. Returns (count, total amount).
+    """
+    rows = [row for row in preview if not row['error']]
+    if not rows:
+        return 0, 0
+
+    last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM payments").fetchone()[0]
+    conn.executemany('''
+        INSERT INTO payments (admin_uuid, amount, payment_date, payment_method, reference, notes)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(row['admin_uuid'], row['amount'], row['payment_date'], 'Import', '', f"Imported line {row['line']}")
+          for row in rows])
+    # One writer holds the transaction, so the new rows are exactly those above last_id
+    payments = conn.execute("""
+        SELECT id, admin_uuid, amount, payment_date FROM payments WHERE id > ? ORDER BY id
+    """, (last_id,)).fetchall()
+
+    record_entries(conn, [
+        (admin_uuid, ENTRY_PAYMENT, payment_date, 0, amount, 'payments', payment_id, None)
+        for payment_id, admin_uuid, amount, payment_date in payments
+    ])
+
+    by_admin = defaultdict(list)
+    for payment in payments:
+        by_admin[payment[1]].append(payment)
+
+    conn.executemany('''
+        UPDATE admin_accounts
+        SET total_paid = total_paid + ?, last_payment_date = MAX(COALESCE(last_payment_date, ''), ?)
+        WHERE uuid = ?
+    ''', [(sum(p[2] for p in admin_payments), max(p[3] for p in admin_payments), admin_uuid)
+          for admin_uuid, admin_payments in by_admin.items()])
+
+    # Re-allocate each admin once, from the invoice the earliest new payment affects
+    for admin_uuid, admin_payments in by_admin.items():
+        payment_id, _, _, payment_date = min(admin_payments, key=lambda p: (p[3], p[0]))
+        start = first_affected_invoice(conn, admin_uuid, payment_date, payment_id)
+        reallocate(conn, admin_uuid, start, [p[0] for p in admin_payments])
+
+    return len(payments), sum(p[2] for p in payments)
@@ -5,28 +5,62 @@ from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Frame
+from reportlab.platypus.doctemplate import LayoutError
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
+from reportlab.pdfgen import canvas
+from functools import lru_cache
 import os
 from utils import convert_non_ascii_to_ascii, parse_date, reshape_rtl_text
 from config import CARD_DETAILS, TOTAL
+from database import DATABASE_FILE, connect
+import io
 import random
-import sqlite3
+import shutil
+import tarfile
+import tempfile
+import time
+import zipfile
 
-# Register a font that supports Persian characters
-pdfmetrics.registerFont(TTFont('DejaVuSans', 'DejaVuSans.ttf'))
+_fonts_registered = False
+
+def register_fonts():
+    """Register a font that supports Persian characters (parsed on first use, not at import)"""
+    global _fonts_registered
+    if not _fonts_registered:
+        pdfmetrics.registerFont(TTFont('DejaVuSans', 'DejaVuSans.ttf'))
+        _fonts_registered = True
+
+# Above this many user rows an invoice is drawn straight onto the canvas instead of
+# being laid out as a platypus Table (whose layout cost grows steeply with row count)
+LARGE_INVOICE_ROW_THRESHOLD = 500
+
+# Reshaped names kept between invoices; the GUI process lives through many runs
+SHAPED_TEXT_CACHE_SIZE = 4096
+
+# Geometry shared by the canvas renderer (matches the platypus table defaults)
+PAGE_MARGIN = inch
+ROW_HEIGHT = 18
+HEADER_ROW_HEIGHT = 27
+CELL_PADDING = 6
+FRAME_PADDING = 6
+
+# In-memory PDFs are streamed into run archives through a large write buffer;
+# invoices.pdf_path then stores "<archive>::<member>"
+ARCHIVE_BUFFER_SIZE = 1024 * 1024
+ARCHIVE_MEMBER_SEPARATOR = "::"
 
 def f(admin_name):
+    register_fonts()
     styles = getSampleStyleSheet()
     styles['Normal'].fontName = 'DejaVuSans'
     centered_style = styles['Normal'].clone('CenteredStyle')
     centered_style.alignment = 1  # 1 is for CENTER alignment
     return Paragraph(reshape_rtl_text(admin_name), centered_style)
 
-def generate_pdf_from_summary(usage_summary, output_file, unpaid_remainder=0):
-    # Create a SimpleDocTemplate object with specified output file
-    pdf = SimpleDocTemplate(output_file, pagesize=letter)
+def summary_elements(usage_summary, unpaid_remainder=0):
+    """Flowables of the summary page (per-admin totals, remainder and payment card)"""
     elements = []
     # Create data for the table
     data = [[f("نام ادمین"), f("مصرف کل"), f("قیمت هر گیگ"), f("مجموع")]]
@@ -90,16 +124,129 @@ def generate_pdf_from_summary(usage_summary, output_file, unpaid_remainder=0):
     # Add the table to the elements list
     elements.append(table)
     elements.append(card_table)
+    return elements
+
+def generate_pdf_from_summary(usage_summary, output_file, unpaid_remainder=0):
+    # Create a SimpleDocTemplate object with specified output file
+    pdf = SimpleDocTemplate(output_file, pagesize=letter)
     # Build the PDF document
-    pdf.build(elements)
+    pdf.build(summary_elements(usage_summary, unpaid_remainder))
 
-def create_pdf_invoice(admin_name, invoice_data, total_usage, file_name, prev_invoice_date, end_date, panel_number, telegram_account, parent_admin, row_par_name):
-    
-    # Create the nested directory structure if it doesn't exist
-    folder_path = os.path.join("invoices",f'{telegram_account}', row_par_name)  # Combine telegram_account and parent_admin paths
-    os.makedirs(folder_path, exist_ok=True)  # Create the directory recursively
+@lru_cache(maxsize=SHAPED_TEXT_CACHE_SIZE)
+def shape_text(text):
+    """Reshape RTL text once; user and admin names repeat a lot across invoices"""
+    return reshape_rtl_text(text)
+
+def build_invoice_rows(filtered_users):
+    """Plain invoice rows (name, short UUID, start date, usage) shared by both renderers"""
+    return [[user.get('name')[:15],
+             user.get('uuid')[:18] + "...",
+             user.get('start_date'),
+             user.get('usage_limit_GB')]
+            for user in filtered_users]
+
+def invoice_header_data(admin_name, total_usage, prev_invoice_date, end_date, panel_number):
+    return [
+        ["Admin", reshape_rtl_text(convert_non_ascii_to_ascii(admin_name))],
+        ["Panel", PANELS[panel_number]],
+        ["Start Date", prev_invoice_date.strftime('%Y-%m-%d')],
+        ["End Date", end_date.strftime('%Y-%m-%d')],
+        ["usage", total_usage]
+    ]
+
+def _draw_row(c, x, y, col_widths, height, cells, fills=None, fonts=None, colors_=None, aligns=None):
+    """Draw one table row whose bottom edge sits at y"""
+    cell_x = x
+    for i, width in enumerate(col_widths):
+        fill = fills[i] if fills else None
+        if fill is not None:
+            c.setFillColor(fill)
+            c.rect(cell_x, y, width, height, stroke=0, fill=1)
+        value = cells[i]
+        if value is not None and value != '':
+            font_name, font_size = fonts[i] if fonts else ('Helvetica', 10)
+            c.setFont(font_name, font_size)
+            c.setFillColor(colors_[i] if colors_ else colors.black)
+            baseline = y + height - 3 - font_size  # TOPPADDING 3, like the platypus tables
+            if aligns and aligns[i] == 'LEFT':
+                c.drawString(cell_x + CELL_PADDING, baseline, str(value))
+            else:
+                c.drawCentredString(cell_x + width / 2, baseline, str(value))
+        cell_x += width
+
+def draw_invoice_on_canvas(c, header_data, invoice_data, total_usage):
+    """
+    Draw an invoice straight onto a reportlab canvas with hand-made pagination.
+    Used instead of a platypus Table for very large user lists; every page is
+    finished with showPage() so callers can keep drawing further documents.
+    """
+    register_fonts()
+    page_width, page_height = letter
+    top = page_height - PAGE_MARGIN - FRAME_PADDING
+    bottom = PAGE_MARGIN + FRAME_PADDING
+
+    # Header table (same colours as header_table_style in the platypus renderer)
+    header_widths = [2*inch, 4*inch]
+    x = (page_width - sum(header_widths)) / 2
+    y = top
+    last = len(header_data) - 1
+    for i, row in enumerate(header_data):
+        height = HEADER_ROW_HEIGHT if i == 0 else ROW_HEIGHT
+        y -= height
+        if i == 0:
+            fill, font, color = colors.lightcoral, ('Helvetica-Bold', 10), colors.red
+        elif i == last:
+            fill, font, color = colors.lightgreen, ('Helvetica', 10), colors.black
+        else:
+            fill = colors.white if i % 2 == 1 else colors.lightgrey
+            font, color = ('Helvetica', 10), colors.black
+        _draw_row(c, x, y, header_widths, height, row, fills=[fill, fill],
+                  fonts=[font, font], colors_=[color, color])
+        if i == 0:
+            c.setLineWidth(2)
+            c.setStrokeColor(colors.black)
+            c.line(x, y, x + sum(header_widths), y)
 
-    doc = SimpleDocTemplate(os.path.join(folder_path, file_name), pagesize=letter)
+    # User table
+    col_widths = [2*inch, 2*inch, 1.5*inch, 1*inch]
+    x = (page_width - sum(col_widths)) / 2
+    table_width = sum(col_widths)
+    if y - HEADER_ROW_HEIGHT - ROW_HEIGHT < bottom:
+        c.showPage()
+        y = top
+
+    y -= HEADER_ROW_HEIGHT
+    _draw_row(c, x, y, col_widths, HEADER_ROW_HEIGHT, ['Name', 'UUID', 'Start Date', 'Usage (GB)'],
+              fills=[colors.lightblue] * 4, fonts=[('Helvetica-Bold', 10)] * 4,
+              colors_=[colors.whitesmoke] * 4)
+    c.setLineWidth(2)
+    c.setStrokeColor(colors.black)
+    c.line(x, y, x + table_width, y)
+
+    row_fonts = [('DejaVuSans', 10), ('Courier', 10), ('Helvetica', 10), ('Helvetica', 10)]
+    row_aligns = ['CENTER', 'LEFT', 'CENTER', 'CENTER']
+    for i, (name, uuid, start_date, usage) in enumerate(invoice_data):
+        if y - ROW_HEIGHT < bottom:
+            c.showPage()
+            y = top
+        y -= ROW_HEIGHT
+        fill = colors.white if i % 2 == 0 else colors.lightgrey
+        _draw_row(c, x, y, col_widths, ROW_HEIGHT, [shape_text(name), uuid, start_date, usage],
+                  fills=[fill] * 4, fonts=row_fonts, aligns=row_aligns)
+
+    # Total row
+    if y - ROW_HEIGHT < bottom:
+        c.showPage()
+        y = top
+    y -= ROW_HEIGHT
+    _draw_row(c, x, y, col_widths, ROW_HEIGHT, [shape_text("مجموع"), '', '', total_usage],
+              fills=[None, None, None, colors.blue],
+              fonts=[('DejaVuSans', 10)] + [('Helvetica', 10)] * 3)
+    c.showPage()
+
+def invoice_elements(header_data, invoice_data, total_usage):
+    """Flowables of one admin's invoice (header table and user table)"""
+    register_fonts()
     elements = []
     styles = getSampleStyleSheet()
 
@@ -110,6 +257,14 @@ def create_pdf_invoice(admin_name, invoice_data, total_usage, file_name, prev_in
     centered_style = styles['Normal'].clone('CenteredStyle')
     centered_style.alignment = 1  # 1 is for CENTER alignment
 
+    # Define a custom paragraph style with Courier font
+    uuid_style = ParagraphStyle(
+        name="custom_style",
+        fontName="Courier",  # Use the Courier font
+        spaceAfter=12,
+        textColor=colors.black
+    )
+
     # Custom styles
     header_table_style = TableStyle([
         ('BACKGROUND', (0,0), (-1,0), colors.lightcoral),
@@ -124,23 +279,21 @@ def create_pdf_invoice(admin_name, invoice_data, total_usage, file_name, prev_in
         ('BACKGROUND', (0, -1), (-1, -1), colors.lightgreen)  # Change to your desired color
     ])
 
-    # Header data with reshaped and reordered RTL text for start and end date
-    header_data = [
-        ["Admin", reshape_rtl_text(convert_non_ascii_to_ascii(admin_name))],
-        ["Panel", PANELS[panel_number]],
-        ["Start Date", prev_invoice_date.strftime('%Y-%m-%d')],
-        ["End Date", end_date.strftime('%Y-%m-%d')],
-        ["usage", total_usage]
-    ]
-
     # Create and style the header table
     header_table = Table(header_data, colWidths=[2*inch, 4*inch])
     header_table.setStyle(header_table_style)
     elements.append(header_table)
 
+    # Reshape and reorder each user's name and use Paragraph with centered style
+    paragraph_rows = [[Paragraph(shape_text(name), centered_style),
+                       Paragraph(uuid, uuid_style),
+                       start_date,
+                       usage]
+                      for name, uuid, start_date, usage in invoice_data]
+
     # Table Data
     SUM = Paragraph(reshape_rtl_text("مجموع"), centered_style)
-    data = [['Name', 'UUID', 'Start Date', 'Usage (GB)']] + invoice_data + [[SUM, '', '', total_usage]]
+    data = [['Name', 'UUID', 'Start Date', 'Usage (GB)']] + paragraph_rows + [[SUM, '', '', total_usage]]
 
     # Create a table instance
     table = Table(data, colWidths=[2*inch, 2*inch, 1.5*inch, 1*inch])
@@ -160,10 +313,225 @@ def create_pdf_invoice(admin_name, invoice_data, total_usage, file_name, prev_in
     table.setStyle(style)
 
     elements.append(table)
-    doc.build(elements)
-    print(f"Invoice created for {admin_name} as {file_name}")
+    return elements
 
-def create_invoices(descendant_admins: list, users: list, prev_invoice_date: str, panel_number: int, total_usages : list, end_date_str: str = None):
+def draw_flowables_on_canvas(c, elements):
+    """
+    Lay platypus flowables out page by page on an existing canvas. A flowable
+    that does not fit in the rest of a page (a long table) is split there and
+    continues on the next pages.
+    """
+    page_width, page_height = letter
+
+    def new_frame():
+        return Frame(PAGE_MARGIN, PAGE_MARGIN, page_width - 2*PAGE_MARGIN, page_height - 2*PAGE_MARGIN)
+
+    elements = list(elements)
+    frame, page_empty = new_frame(), True
+    while elements:
+        flowable = elements.pop(0)
+        if frame.add(flowable, c, trySplit=1):
+            page_empty = False
+            continue
+        # Draw the part that fits here and queue the rest
+        parts = frame.split(flowable, c)
+        if parts and frame.add(parts[0], c, trySplit=1):
+            page_empty = False
+            elements[:0] = parts[1:]
+            continue
+        if page_empty:
+            raise LayoutError(f"{flowable.__class__.__name__} does not fit on an empty page")
+        c.showPage()
+        frame, page_empty = new_frame(), True
+        elements.insert(0, flowable)
+    if not page_empty:
+        c.showPage()
+
+def draw_invoice_section(c, header_data, invoice_data, total_usage):
+    """Draw one admin's invoice on a shared canvas, picking the renderer by size"""
+    if len(invoice_data) > LARGE_INVOICE_ROW_THRESHOLD:
+        draw_invoice_on_canvas(c, header_data, invoice_data, total_usage)
+    else:
+        draw_flowables_on_canvas(c, invoice_elements(header_data, invoice_data, total_usage))
+
+def write_invoice_pdf(path_parts, render, archive=None):
+    """
+    Render one PDF below invoices/ or, when an InvoiceArchive is given, into an
+    in-memory buffer that is appended to the archive. render(target) receives a
+    path or file object. Returns the reference to store for the PDF.
+    """
+    if archive is None:
+        output_file = os.path.join("invoices", *path_parts)
+        # Create the nested directory structure if it doesn't exist
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        render(output_file)
+        return output_file
+
+    buffer = io.BytesIO()
+    render(buffer)
+    return archive.add("/".join(path_parts), buffer.getvalue())
+
+def create_pdf_invoice(admin_name, invoice_data, total_usage, file_name, prev_invoice_date, end_date, panel_number, telegram_account, parent_admin, row_par_name, archive=None):
+
+    # Header data with reshaped and reordered RTL text for start and end date
+    header_data = invoice_header_data(admin_name, total_usage, prev_invoice_date, end_date, panel_number)
+
+    # Very large user lists skip platypus and are drawn row by row onto the canvas
+    fast_renderer = len(invoice_data) > LARGE_INVOICE_ROW_THRESHOLD
+
+    def render(target):
+        if fast_renderer:
+            c = canvas.Canvas(target, pagesize=letter)
+            draw_invoice_on_canvas(c, header_data, invoice_data, total_usage)
+            c.save()
+        else:
+            doc = SimpleDocTemplate(target, pagesize=letter)
+            doc.build(invoice_elements(header_data, invoice_data, total_usage))
+
+    # Stored under invoices/<telegram_account>/<parent admin>/
+    pdf_path = write_invoice_pdf((f'{telegram_account}', row_par_name, file_name), render, archive)
+    if fast_renderer:
+        print(f"Invoice created for {admin_name} as {file_name} (fast renderer, {len(invoice_data)} rows)")
+    else:
+        print(f"Invoice created for {admin_name} as {file_name}")
+    return pdf_path
+
+def create_invoice_bundle(output_file, usage_summary, unpaid_remainder, sections):
+    """
+    Write one multi-page PDF for a main admin: the summary page followed by one
+    section per descendant. sections is a list of (header_data, invoice_data, total_usage).
+    """
+    c = canvas.Canvas(output_file, pagesize=letter)
+    draw_flowables_on_canvas(c, summary_elements(usage_summary, unpaid_remainder))
+    for header_data, invoice_data, total_usage in sections:
+        draw_invoice_section(c, header_data, invoice_data, total_usage)
+    c.save()
+
+def archive_reference(archive_path, member_name):
+    """Reference to a PDF stored inside an archive, as kept in invoices.pdf_path"""
+    return f"{archive_path}{ARCHIVE_MEMBER_SEPARATOR}{member_name}"
+
+class InvoiceArchive:
+    """
+    A single zip or tar archive for a whole invoice run. PDFs are rendered into
+    memory and appended as members through a large write buffer, so a run
+    produces one sequentially written file instead of thousands of small ones.
+    """
+    def __init__(self, path, archive_format='zip'):
+        if archive_format not in ('zip', 'tar'):
+            raise ValueError(f"Unsupported archive format: {archive_format}")
+        self.path = path
+        self.format = archive_format
+        self.members = []
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._file = open(path, 'wb', buffering=ARCHIVE_BUFFER_SIZE)
+        if archive_format == 'zip':
+            self._archive = zipfile.ZipFile(self._file, 'w', zipfile.ZIP_DEFLATED)
+        else:
+            self._archive = tarfile.open(fileobj=self._file, mode='w|', bufsize=ARCHIVE_BUFFER_SIZE)
+
+    def add(self, member_name, data):
+        """Append one in-memory PDF and return its archive reference"""
+        if self.format == 'zip':
+            self._archive.writestr(member_name, data)
+        else:
+            info = tarfile.TarInfo(member_name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            self._archive.addfile(info, io.BytesIO(data))
+        self.members.append(member_name)
+        return archive_reference(self.path, member_name)
+
+    def close(self):
+        self._archive.close()
+        self._file.close()
+        print(f"Invoice archive written: {self.path} ({len(self.members)} PDFs)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def resolve_invoice_pdf(pdf_path):
+    """
+    Return a filesystem path for a stored PDF reference. Archive members are
+    extracted to a temporary folder; returns None if the PDF cannot be found.
+    """
+    if not pdf_path:
+        return None
+    if ARCHIVE_MEMBER_SEPARATOR not in pdf_path:
+        return pdf_path if os.path.exists(pdf_path) else None
+
+    archive_path, member_name = pdf_path.split(ARCHIVE_MEMBER_SEPARATOR, 1)
+    if not os.path.exists(archive_path):
+        return None
+    extract_folder = os.path.realpath(
+        os.path.join(tempfile.gettempdir(), "vpn_invoices", os.path.basename(archive_path)))
+    output_file = os.path.realpath(os.path.join(extract_folder, *member_name.split("/")))
+    # The reference comes from the database: never write outside the extract folder
+    if os.path.commonpath([extract_folder, output_file]) != extract_folder or output_file == extract_folder:
+        print(f"Refusing to extract unsafe archive member: {member_name}")
+        return None
+    # Already extracted from this archive (and not older than it)
+    if os.path.exists(output_file) and os.path.getmtime(output_file) >= os.path.getmtime(archive_path):
+        return output_file
+    try:
+        if zipfile.is_zipfile(archive_path):
+            with zipfile.ZipFile(archive_path) as archive:
+                data = archive.read(member_name)
+        else:
+            with tarfile.open(archive_path) as archive:
+                data = archive.extractfile(member_name).read()
+    except (KeyError, AttributeError, tarfile.TarError, zipfile.BadZipFile):
+        return None
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    with open(output_file, 'wb') as file:
+        file.write(data)
+    return output_file
+
+def zip_invoice_folders(invoices_folder="invoices"):
+    """Replace every invoices/<telegram_account>/ folder with a single zip archive"""
+    zipped = []
+    if not os.path.exists(invoices_folder):
+        return zipped
+    for telegram_account in sorted(os.listdir(invoices_folder)):
+        folder_path = os.path.join(invoices_folder, telegram_account)
+        if not os.path.isdir(folder_path):
+            continue
+        zip_path = os.path.join(invoices_folder, f"{telegram_account}.zip")
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for dirpath, _, filenames in os.walk(folder_path):
+                for filename in sorted(filenames):
+                    file_path = os.path.join(dirpath, filename)
+                    archive.write(file_path, os.path.relpath(file_path, folder_path))
+        shutil.rmtree(folder_path)
+        zipped.append(zip_path)
+        print(f"Zipped invoices for {telegram_account} into {zip_path}")
+    return zipped
+
+def load_admin_balances(conn=None):
+    """
+    Load (total_earned, total_paid) for every admin with a single query.
+    An invoice run calls this once and hands the dict to create_invoices, so
+    rendering needs no database access of its own.
+    """
+    own_connection = conn is None
+    try:
+        if own_connection:
+            conn = connect(DATABASE_FILE, read_only=True)
+        cursor = conn.cursor()
+        cursor.execute("SELECT uuid, total_earned, total_paid FROM admin_accounts")
+        return {uuid: (total_earned or 0, total_paid or 0)
+                for uuid, total_earned, total_paid in cursor.fetchall()}
+    except Exception as e:
+        print(f"Warning: Could not load admin balances from database: {e}")
+        return {}
+    finally:
+        if own_connection and conn is not None:
+            conn.close()
+
+def create_invoices(descendant_admins: list, users: list, prev_invoice_date: str, panel_number: int, total_usages : list, end_date_str: str = None, balances: dict = None, output_mode: str = 'files', archive=None):
     date = parse_date(prev_invoice_date)
     if date:
         prev_invoice_date = date
@@ -196,6 +564,8 @@ def create_invoices(descendant_admins: list, users: list, prev_invoice_date: str
     parent_admin_name = reshape_rtl_text(descendant_admins[0].get('name', 'No Name'))
     total_usage_main_admin = 0
     usage_summary = {}
+    sections = []  # Collected instead of written when output_mode == 'bundle'
+    pdf_paths = {}  # admin uuid -> where that admin's invoice ended up
     for admin in descendant_admins:
         admin_uuid = admin.get('uuid')
         admin_name = admin.get('name', 'No Name')
@@ -207,27 +577,8 @@ def create_invoices(descendant_admins: list, users: list, prev_invoice_date: str
                           and prev_invoice_date < datetime.strptime(user.get('start_date'), "%Y-%m-%d") <= end_date
                           and user.get('usage_limit_GB', 0) != 1]
 
-        styles = getSampleStyleSheet()
-        styles['Normal'].fontName = 'DejaVuSans'
-
-        # Create a custom style for centered text
-        centered_style = styles['Normal'].clone('CenteredStyle')
-        centered_style.alignment = 1  # 1 is for CENTER alignment
-
-        # Define a custom paragraph style with Courier font
-        uuid_style = ParagraphStyle(
-            name="custom_style",
-            fontName="Courier",  # Use the Courier font
-            spaceAfter=12,
-            textColor=colors.black
-        )
-
-        # Reshape and reorder each user's name and use Paragraph with centered style
-        invoice_data = [[Paragraph(reshape_rtl_text(user.get('name')[:15]), centered_style), 
-                         Paragraph(user.get('uuid')[:18] + "...", uuid_style), 
-                         user.get('start_date'), 
-                         user.get('usage_limit_GB')] 
-                         for user in filtered_users]
+        # Plain rows; the renderer decides whether they become Paragraphs or canvas text
+        invoice_data = build_invoice_rows(filtered_users)
         total_usage = sum(user.get('usage_limit_GB', 0) for user in filtered_users)
         total_usage_main_admin += total_usage
         # Save to PDF file
@@ -235,51 +586,33 @@ def create_invoices(descendant_admins: list, users: list, prev_invoice_date: str
         # Use parent's price per GB for all admins (main and children)
         admins_price_per_GB = parent_price_per_gb
         usage_summary[admin_name] = [total_usage, admins_price_per_GB, total_usage * admins_price_per_GB]
-        create_pdf_invoice(reshape_rtl_text(admin_name), invoice_data, total_usage, file_name, prev_invoice_date, end_date, panel_number, telegram_account, parent_admin_name, row_par_name)
+        if output_mode == 'bundle':
+            header_data = invoice_header_data(reshape_rtl_text(admin_name), total_usage, prev_invoice_date, end_date, panel_number)
+            sections.append((header_data, invoice_data, total_usage))
+        else:
+            pdf_paths[admin_uuid] = create_pdf_invoice(reshape_rtl_text(admin_name), invoice_data, total_usage, file_name, prev_invoice_date, end_date, panel_number, telegram_account, parent_admin_name, row_par_name, archive)
     
     
-    # Calculate unpaid remainder from database for the main admin
-    # This should be calculated BEFORE any current invoice amounts are added to the database
+    # Calculate unpaid remainder for the main admin from the prefetched balances
+    # These must be loaded BEFORE any current invoice amounts are added to the database
+    if balances is None:
+        balances = load_admin_balances()
     unpaid_remainder = 0
-    try:
-        # Connect to database
-        conn = sqlite3.connect('vpn_accounting.db')
-        cursor = conn.cursor()
-        
-        # Get the main admin UUID (first admin in descendant_admins)
-        main_admin_uuid = descendant_admins[0].get('uuid')
-        
-        # Get total earned and total paid for the main admin
+
+    # Get the main admin UUID (first admin in descendant_admins)
+    main_admin_uuid = descendant_admins[0].get('uuid')
+    if main_admin_uuid in balances:
         # This represents the balance from PREVIOUS invoices and payments only
-        cursor.execute("""
-            SELECT total_earned, total_paid FROM admin_accounts 
-            WHERE uuid = ?
-        """, (main_admin_uuid,))
-        
-        result = cursor.fetchone()
-        if result:
-            total_earned, total_paid = result
-            total_earned = total_earned or 0
-            total_paid = total_paid or 0
-            
-            # Calculate unpaid remainder from previous invoices only
-            unpaid_remainder = total_earned - total_paid
-            
-            # Only include positive remainder (if there's unpaid amount)
-            if unpaid_remainder < 0:
-                unpaid_remainder = 0
-            
-            print(f"Admin {descendant_admins[0].get('name', 'Unknown')}: Previous earned={total_earned}, paid={total_paid}, unpaid_remainder={unpaid_remainder}")
-        
-        conn.close()
-    except Exception as e:
-        print(f"Warning: Could not get unpaid remainder from database: {e}")
-        unpaid_remainder = 0
-    
-    # Create the nested directory structure if it doesn't exist
-    folder_path = os.path.join("invoices",f'{telegram_account}', row_par_name)  # Combine telegram_account and parent_admin paths
-    os.makedirs(folder_path, exist_ok=True)  # Create the directory recursively
-    name_of_final_pdf = 'مجموع فاکتور ها.pdf'
+        total_earned, total_paid = balances[main_admin_uuid]
+
+        # Calculate unpaid remainder from previous invoices only
+        unpaid_remainder = total_earned - total_paid
+
+        # Only include positive remainder (if there's unpaid amount)
+        if unpaid_remainder < 0:
+            unpaid_remainder = 0
+
+        print(f"Admin {descendant_admins[0].get('name', 'Unknown')}: Previous earned={total_earned}, paid={total_paid}, unpaid_remainder={unpaid_remainder}")
     
     # Calculate current invoice total for debugging
     current_total = sum(summary[2] for summary in usage_summary.values())
@@ -287,8 +620,24 @@ def create_invoices(descendant_admins: list, users: list, prev_invoice_date: str
     print(f"Unpaid remainder from previous: {unpaid_remainder:,}")
     print(f"Total payable amount: {current_total + unpaid_remainder:,}")
     
-    generate_pdf_from_summary(usage_summary, os.path.join(folder_path, name_of_final_pdf), unpaid_remainder)
+    if output_mode == 'bundle':
+        # One PDF per main admin: summary page followed by every descendant's invoice
+        bundle_path = write_invoice_pdf(
+            (f'{telegram_account}', f"{row_par_name}.pdf"),
+            lambda target: create_invoice_bundle(target, usage_summary, unpaid_remainder, sections),
+            archive)
+        for admin in descendant_admins:
+            pdf_paths[admin.get('uuid')] = bundle_path
+        print(f"Invoice bundle created for {row_par_name} as {bundle_path}")
+    else:
+        # Summary lives next to the per-admin invoices in invoices/<telegram_account>/<parent admin>/
+        name_of_final_pdf = 'مجموع فاکتور ها.pdf'
+        write_invoice_pdf(
+            (f'{telegram_account}', row_par_name, name_of_final_pdf),
+            lambda target: generate_pdf_from_summary(usage_summary, target, unpaid_remainder),
+            archive)
 
     total_usages[0] += total_usage_main_admin
+    return pdf_paths
 
 
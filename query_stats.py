@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Optional statement timing for the accounting database.
+
+Start the application (or any script that opens the database through
+database.connect) with VPN_QUERY_STATS=1 and every statement is timed:
+executions, total and slowest time, and rows returned or changed, per
+statement text. Statements slower than VPN_SLOW_QUERY_MS milliseconds
+(default 50, including fetching their rows) are printed with their
+EXPLAIN QUERY PLAN. The numbers are added to query_stats.json when the
+process exits.
+
+Usage:
+    python query_stats.py report [total|avg|max|count|rows] [limit]
+    python query_stats.py reset
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+ENABLED = os.environ.get('VPN_QUERY_STATS', '') not in ('', '0')
+SLOW_QUERY_MS = float(os.environ.get('VPN_SLOW_QUERY_MS', 50))
+STATS_FILE = 'query_stats.json'
+
+# Statement text (whitespace collapsed) -> {count, total_ms, max_ms, rows, plan}
+_stats = {}
+_stats_lock = threading.Lock()
+
+def normalize(sql):
+    """Statement text with runs of whitespace collapsed, used as the stats key"""
+    return ' '.join(sql.split())
+
+def _record(sql, elapsed_ms, rows=0, executions=1, execution_ms=None):
+    with _stats_lock:
+        entry = _stats.setdefault(sql, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0, 'plan': None})
+        entry['count'] += executions
+        entry['total_ms'] += elapsed_ms
+        entry['max_ms'] = max(entry['max_ms'], execution_ms if execution_ms is not None else elapsed_ms)
+        entry['rows'] += rows
+
+def _query_plan(conn, sql, parameters):
+    """EXPLAIN QUERY PLAN lines for a statement, indented by depth"""
+    try:
+        # The plain execute, so the EXPLAIN is not itself counted
+        rows = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, parameters).fetchall()
+    except sqlite3.Error as e:
+        return [f"(no plan: {e})"]
+    depth = {0: 0}
+    lines = []
+    for node_id, parent_id, _, detail in rows:
+        depth[node_id] = depth.get(parent_id, 0) + 1
+        lines.append("  " * (depth[node_id] - 1) + detail)
+    return lines
+
+class StatsCursor(sqlite3.Cursor):
+    """Cursor that times execute/executemany and the fetches that follow them"""
+
+    _sql = None
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._executed(sql, parameters, start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._executed(sql, None, start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(start, 0)
+            raise
+        self._fetched(start, 1)
+        return row
+
+    def _executed(self, sql, parameters, start):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._sql = normalize(sql)
+        self._parameters = parameters
+        self._elapsed_ms = elapsed_ms
+        self._logged = False
+        # rowcount is the number of changed rows for DML and -1 for queries
+        _record(self._sql, elapsed_ms, rows=max(self.rowcount, 0))
+        self._check_slow()
+
+    def _fetched(self, start, rows):
+        if self._sql is None:
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._elapsed_ms += elapsed_ms
+        _record(self._sql, elapsed_ms, rows=rows, executions=0, execution_ms=self._elapsed_ms)
+        self._check_slow()
+
+    def _check_slow(self):
+        """Print a statement once per execution when it passes the threshold"""
+        if self._logged or self._elapsed_ms < SLOW_QUERY_MS:
+            return
+        self._logged = True
+        plan = _query_plan(self.connection, self._sql, self._parameters) if self._parameters is not None else []
+        with _stats_lock:
+            _stats[self._sql]['plan'] = plan
+        print(f"🐢 Slow query ({self._elapsed_ms:.1f} ms): {self._sql[:200]}")
+        for line in plan:
+            print(f"    {line}")
+
+class StatsConnection(sqlite3.Connection):
+    """Connection whose statements all run through StatsCursor (see database.connect)"""
+
+    def cursor(self, factory=StatsCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def save_stats(path=STATS_FILE):
+    """Add this process's numbers to the stats file and start counting afresh"""
+    with _stats_lock:
+        current = dict(_stats)
+        _stats.clear()
+    if not current:
+        return
+
+    saved = load_stats(path)
+    for sql, entry in current.items():
+        total = saved.setdefault(sql, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0, 'plan': None})
+        total['count'] += entry['count']
+        total['total_ms'] += entry['total_ms']
+        total['max_ms'] = max(total['max_ms'], entry['max_ms'])
+        total['rows'] += entry['rows']
+        total['plan'] = entry['plan'] or total['plan']
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(saved, f, indent=1, ensure_ascii=False)
+
+def load_stats(path=STATS_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+if ENABLED:
+    atexit.register(save_stats)
+
+def print_report(sort='total', limit=20, path=STATS_FILE):
+    stats = load_stats(path)
+    if not stats:
+        print(f"No statistics in {path}; run the application with VPN_QUERY_STATS=1 first")
+        return
+    sort_keys = {
+        'total': lambda e: e['total_ms'],
+        'avg': lambda e: e['total_ms'] / max(e['count'], 1),
+        'max': lambda e: e['max_ms'],
+        'count': lambda e: e['count'],
+        'rows': lambda e: e['rows'],
+    }
+    entries = sorted(stats.items(), key=lambda item: sort_keys[sort](item[1]), reverse=True)[:limit]
+
+    print(f"📊 {len(stats)} statements, top {len(entries)} by {sort}")
+    print(f"{'Count':>8} {'Total ms':>10} {'Avg ms':>8} {'Max ms':>8} {'Rows':>9}  Statement")
+    for sql, entry in entries:
+        print(f"{entry['count']:>8} {entry['total_ms']:>10.1f} {entry['total_ms'] / max(entry['count'], 1):>8.2f} "
+              f"{entry['max_ms']:>8.1f} {entry['rows']:>9}  {sql[:100]}")
+        for line in entry['plan'] or []:
+            print(f"{'':>48}{line}")
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'report'
+    if command == 'report':
+        sort = sys.argv[2] if len(sys.argv) > 2 else 'total'
+        if sort not in ('total', 'avg', 'max', 'count', 'rows'):
+            print("Sort by one of: total, avg, max, count, rows")
+            return False
+        print_report(sort, int(sys.argv[3]) if len(sys.argv) > 3 else 20)
+        return True
+    if command == 'reset':
+        if os.path.exists(STATS_FILE):
+            os.remove(STATS_FILE)
+        print(f"✅ Cleared {STATS_FILE}")
+        return True
+    print("Usage: python query_stats.py report [total|avg|max|count|rows] [limit] | reset")
+    return False
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
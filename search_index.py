@@ -0,0 +1,78 @@
+"""
+Full-text search over panel users.
+
+panel_user_search indexes every user in the downloaded panel backups (name,
+uuid and the selling admin) and is rebuilt per panel when a new backup is
+recorded. The trigram tokenizer matches any substring of three or more
+characters, case-insensitively, and ranks results with bm25. The admin list
+is small and is filtered in memory by the GUI instead.
+
+SQLite builds without FTS5 trigram support (before 3.34) get no index table
+and user search is unavailable.
+"""
+
+import sqlite3
+
+# Trigram queries need at least this many characters
+MIN_TRIGRAM_LENGTH = 3
+# panel_user_search rowids are panel_number * PANEL_ROWID_SPAN + n, so one
+# panel's users can be replaced with a rowid range delete
+PANEL_ROWID_SPAN = 10_000_000
+
+def fts5_trigram_available(conn):
+    """Whether this SQLite build has FTS5 with the trigram tokenizer"""
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts5_trigram_probe USING fts5(x, tokenize = 'trigram')")
+        conn.execute("DROP TABLE temp.fts5_trigram_probe")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+def _has_table(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+def _phrase(text):
+    """FTS5 query matching text literally (quotes escaped)"""
+    return '"' + text.replace('"', '""') + '"'
+
+def index_panel_users(conn, panel_number, data):
+    """Replace a panel's users in panel_user_search with those in its backup data; returns the count"""
+    if not _has_table(conn, 'panel_user_search'):
+        return 0
+    first_rowid = panel_number * PANEL_ROWID_SPAN
+    conn.execute("DELETE FROM panel_user_search WHERE rowid >= ? AND rowid < ?",
+                 (first_rowid, first_rowid + PANEL_ROWID_SPAN))
+
+    admin_names = {admin.get('uuid'): admin.get('name') for admin in data.get('admin_users', [])}
+    users = data.get('users', [])
+    conn.executemany('''
+        INSERT INTO panel_user_search (rowid, name, uuid, admin_name, admin_uuid, panel_number)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(first_rowid + i, user.get('name'), user.get('uuid'), admin_names.get(user.get('added_by_uuid')),
+           user.get('added_by_uuid'), panel_number)
+          for i, user in enumerate(users)])
+    return len(users)
+
+def is_panel_indexed(conn, panel_number):
+    """Whether panel_user_search holds any users of the panel"""
+    if not _has_table(conn, 'panel_user_search'):
+        return True
+    first_rowid = panel_number * PANEL_ROWID_SPAN
+    return conn.execute("SELECT 1 FROM panel_user_search WHERE rowid >= ? AND rowid < ? LIMIT 1",
+                        (first_rowid, first_rowid + PANEL_ROWID_SPAN)).fetchone() is not None
+
+def search_panel_users(conn, text, limit=100):
+    """
+    Panel users whose name, UUID or selling admin contains text, best match
+    first: (name, uuid, admin_name, admin_uuid, panel_number) rows.
+    """
+    text = text.strip()
+    if len(text) < MIN_TRIGRAM_LENGTH or not _has_table(conn, 'panel_user_search'):
+        return []
+    return conn.execute('''
+        SELECT name, uuid, admin_name, admin_uuid, panel_number
+        FROM panel_user_search
+        WHERE panel_user_search MATCH ?
+        ORDER BY rank
+        LIMIT ?
+    ''', (_phrase(text), limit)).fetchall()
@@ -0,0 +1,52 @@
+"""
+Incremental refresh of flat ttk.Treeview lists.
+
+Clearing a Treeview and inserting every row again costs one Tk call per row
+and makes the list flicker. TreeviewSync remembers what it last displayed and
+turns a new row list into the few insert/item/move/delete calls needed to
+reach it, so refreshing after a single payment touches a single row.
+"""
+
+class TreeviewSync:
+    """Keeps a flat Treeview showing a list of (iid, values, tags) rows"""
+
+    def __init__(self, tree):
+        self.tree = tree
+        # What the tree currently shows: iid -> (values, tags), in display order
+        self._rows = {}
+        self._order = []
+
+    def update(self, rows):
+        """Show rows (a list of (iid, values, tags)) in order; returns the number of Tk calls made"""
+        calls = 0
+        wanted = {iid for iid, _, _ in rows}
+
+        gone = [iid for iid in self._order if iid not in wanted]
+        if gone:
+            self.tree.delete(*gone)
+            calls += 1
+            for iid in gone:
+                del self._rows[iid]
+            self._order = [iid for iid in self._order if iid in wanted]
+
+        for index, (iid, values, tags) in enumerate(rows):
+            values, tags = tuple(values), tuple(tags)
+            if iid not in self._rows:
+                self.tree.insert('', index, iid=iid, values=values, tags=tags)
+                self._order.insert(index, iid)
+                calls += 1
+            else:
+                if self._rows[iid] != (values, tags):
+                    self.tree.item(iid, values=values, tags=tags)
+                    calls += 1
+                if self._order[index] != iid:
+                    self.tree.move(iid, '', index)
+                    self._order.remove(iid)
+                    self._order.insert(index, iid)
+                    calls += 1
+            self._rows[iid] = (values, tags)
+        return calls
+
+    def clear(self):
+        """Remove every row"""
+        self.update([])
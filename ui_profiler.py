@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Optional event-loop profiling for the GUI.
+
+Start the application with VPN_UI_PROFILE=1 and every Tk callback (button
+commands, event bindings, variable traces and root.after callbacks) is
+timed, and a heartbeat scheduled with root.after measures how late the event
+loop gets round to it (the lag a user feels as a frozen window). While a
+callback runs, a sampler thread records the Tk thread's stack; callbacks
+slower than VPN_UI_SLOW_MS milliseconds (default 100) are printed with their
+most frequent stacks. A small always-on-top window shows the current lag
+and the worst callbacks. The numbers are added to ui_stats.json when the
+process exits.
+
+Usage:
+    python ui_profiler.py report [total|avg|max|count|slow] [limit]
+    python ui_profiler.py reset
+"""
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+import tkinter
+import traceback
+from collections import Counter
+
+ENABLED = os.environ.get('VPN_UI_PROFILE', '') not in ('', '0')
+SLOW_HANDLER_MS = float(os.environ.get('VPN_UI_SLOW_MS', 100))
+STATS_FILE = 'ui_stats.json'
+# Heartbeat and overlay refresh intervals
+HEARTBEAT_MS = 50
+OVERLAY_REFRESH_MS = 1000
+# Stack sampling interval while a callback runs, and frames kept per sample
+SAMPLE_INTERVAL_MS = 5
+SAMPLE_DEPTH = 6
+# Most frequent stacks kept per slow callback
+STACKS_PER_HANDLER = 3
+
+# Callback name -> {count, total_ms, max_ms, slow, waited, stacks: {stack text: samples}}
+_handlers = {}
+# Heartbeat lag: beats, total and worst lag, and beats later than one frame / the slow threshold
+_lag = {'beats': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'over_frame': 0, 'over_slow': 0}
+_stats_lock = threading.Lock()
+
+# The innermost callback running on the Tk thread, for the sampler: (name, samples)
+_active = None
+_tk_thread_id = None
+# Frames from tkinter and this module are left out of stack samples
+_OWN_FILES = {tkinter.__file__, __file__}
+
+def _unwrap(func):
+    """The function behind a Tk callback (root.after wraps its function in a local callit())"""
+    if getattr(func, '__qualname__', '').endswith('after.<locals>.callit') and func.__closure__:
+        cells = dict(zip(func.__code__.co_freevars, (cell.cell_contents for cell in func.__closure__)))
+        func = cells.get('func', func)
+    return func
+
+def callback_name(func):
+    """Readable name for a Tk callback: module.qualname, with the line for lambdas"""
+    func = getattr(func, '__func__', func)
+    name = f"{getattr(func, '__module__', '?')}.{getattr(func, '__qualname__', repr(func))}"
+    if '<lambda>' in name:
+        name += f":{func.__code__.co_firstlineno}"
+    return name
+
+def _new_entry():
+    return {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'slow': 0, 'waited': 0, 'stacks': {}}
+
+def _record_handler(name, elapsed_ms, samples):
+    """Count a callback; elapsed_ms is None when it ran a nested event loop"""
+    with _stats_lock:
+        entry = _handlers.setdefault(name, _new_entry())
+        entry['count'] += 1
+        if elapsed_ms is None:
+            # A modal dialog or wait_window: the time was spent waiting for the
+            # user while the event loop kept running, not blocking it
+            entry['waited'] += 1
+            return
+        slow = elapsed_ms >= SLOW_HANDLER_MS
+        entry['total_ms'] += elapsed_ms
+        entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+        if slow:
+            entry['slow'] += 1
+            for stack, count in samples.items():
+                entry['stacks'][stack] = entry['stacks'].get(stack, 0) + count
+            # Keep only the most sampled stacks
+            entry['stacks'] = dict(Counter(entry['stacks']).most_common(STACKS_PER_HANDLER))
+    if slow:
+        print(f"🐌 Slow UI callback ({elapsed_ms:.0f} ms): {name}")
+        for stack, count in samples.most_common(1):
+            for line in stack.splitlines():
+                print(f"    {line}")
+
+class ProfiledCallWrapper(tkinter.CallWrapper):
+    """tkinter.CallWrapper that times the callback it wraps"""
+
+    def __call__(self, *args):
+        global _active
+        func = _unwrap(self.func)
+        # The profiler's own heartbeat and overlay are not counted
+        if getattr(func, '_ui_profiler', False):
+            return super().__call__(*args)
+
+        name = callback_name(func)
+        samples = Counter()
+        # Callbacks nest when one runs a nested event loop (e.g. a messagebox)
+        outer, _active = _active, (name, samples)
+        beats = _lag['beats']
+        start = time.perf_counter()
+        try:
+            return super().__call__(*args)
+        finally:
+            _active = outer
+            # Heartbeats during the callback mean the event loop kept running
+            elapsed_ms = None if _lag['beats'] != beats else (time.perf_counter() - start) * 1000
+            _record_handler(name, elapsed_ms, samples)
+
+def _sample_stacks():
+    """Sampler thread: count the Tk thread's stacks while a callback is running"""
+    while True:
+        time.sleep(SAMPLE_INTERVAL_MS / 1000)
+        active = _active
+        if active is None:
+            continue
+        frame = sys._current_frames().get(_tk_thread_id)
+        if frame is None:
+            continue
+        # Application frames only, innermost first
+        stack = [f for f in traceback.extract_stack(frame) if f.filename not in _OWN_FILES][-SAMPLE_DEPTH:]
+        active[1]["\n".join(f"{os.path.basename(f.filename)}:{f.lineno} {f.name}" for f in reversed(stack))] += 1
+
+def _profiler_callback(func):
+    func._ui_profiler = True
+    return func
+
+class LagMonitor:
+    """Heartbeat on root.after measuring event-loop lag, with a small overlay window"""
+
+    def __init__(self, root):
+        self.root = root
+        self.recent = []
+        self.expected = time.perf_counter() + HEARTBEAT_MS / 1000
+        self.root.after(HEARTBEAT_MS, self.beat)
+
+        self.overlay = tkinter.Toplevel(root)
+        self.overlay.title("UI profile")
+        self.overlay.attributes('-topmost', True)
+        self.label = tkinter.Label(self.overlay, justify=tkinter.LEFT, anchor='w', font=('Courier', 9))
+        self.label.pack(fill=tkinter.BOTH, expand=True, padx=5, pady=5)
+        self.root.after(OVERLAY_REFRESH_MS, self.refresh)
+
+    @_profiler_callback
+    def beat(self):
+        """How much later than scheduled the event loop ran this beat"""
+        now = time.perf_counter()
+        lag_ms = max(0.0, (now - self.expected) * 1000)
+        with _stats_lock:
+            _lag['beats'] += 1
+            _lag['total_ms'] += lag_ms
+            _lag['max_ms'] = max(_lag['max_ms'], lag_ms)
+            _lag['over_frame'] += lag_ms > 16
+            _lag['over_slow'] += lag_ms >= SLOW_HANDLER_MS
+        self.recent.append(lag_ms)
+        self.expected = now + HEARTBEAT_MS / 1000
+        self.root.after(HEARTBEAT_MS, self.beat)
+
+    @_profiler_callback
+    def refresh(self):
+        """Show the worst lag of the last refresh interval and the slowest callbacks"""
+        recent, self.recent = self.recent, []
+        lines = [f"lag {max(recent, default=0):6.0f} ms (max {_lag['max_ms']:.0f} ms)"]
+        with _stats_lock:
+            worst = sorted(_handlers.items(), key=lambda item: item[1]['max_ms'], reverse=True)[:5]
+        for name, entry in worst:
+            lines.append(f"{entry['max_ms']:6.0f} ms  {entry['count']:>5}x  {name.split('.', 1)[-1][:50]}")
+        self.label.config(text="\n".join(lines))
+        self.root.after(OVERLAY_REFRESH_MS, self.refresh)
+
+def install(root):
+    """
+    Start profiling a Tk application. Call before its widgets are created:
+    only callbacks registered after this are timed.
+    """
+    global _tk_thread_id
+    _tk_thread_id = threading.get_ident()
+    tkinter.CallWrapper = ProfiledCallWrapper
+    threading.Thread(target=_sample_stacks, name="ui-profiler", daemon=True).start()
+    atexit.register(save_stats)
+    print(f"⏱️  UI profiling on (slow callbacks: {SLOW_HANDLER_MS:.0f} ms)")
+    return LagMonitor(root)
+
+def save_stats(path=STATS_FILE):
+    """Add this process's numbers to the stats file and start counting afresh"""
+    with _stats_lock:
+        handlers = dict(_handlers)
+        lag = dict(_lag)
+        _handlers.clear()
+        _lag.update(beats=0, total_ms=0.0, max_ms=0.0, over_frame=0, over_slow=0)
+    if not handlers and not lag['beats']:
+        return
+
+    saved = load_stats(path)
+    for name, entry in handlers.items():
+        total = saved['handlers'].setdefault(name, _new_entry())
+        total['count'] += entry['count']
+        total['waited'] += entry['waited']
+        total['total_ms'] += entry['total_ms']
+        total['max_ms'] = max(total['max_ms'], entry['max_ms'])
+        total['slow'] += entry['slow']
+        stacks = Counter(total['stacks'])
+        stacks.update(entry['stacks'])
+        total['stacks'] = dict(stacks.most_common(STACKS_PER_HANDLER))
+    saved_lag = saved['lag']
+    for key in ('beats', 'total_ms', 'over_frame', 'over_slow'):
+        saved_lag[key] = saved_lag.get(key, 0) + lag[key]
+    saved_lag['max_ms'] = max(saved_lag.get('max_ms', 0.0), lag['max_ms'])
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(saved, f, indent=1, ensure_ascii=False)
+
+def load_stats(path=STATS_FILE):
+    if not os.path.exists(path):
+        return {'handlers': {}, 'lag': {}}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def print_report(sort='total', limit=20, path=STATS_FILE):
+    stats = load_stats(path)
+    if not stats['handlers']:
+        print(f"No statistics in {path}; run the application with VPN_UI_PROFILE=1 first")
+        return
+    lag = stats['lag']
+    if lag.get('beats'):
+        print(f"💓 {lag['beats']} heartbeats: average lag {lag['total_ms'] / lag['beats']:.1f} ms, "
+              f"worst {lag['max_ms']:.0f} ms, {lag['over_frame']} over 16 ms, {lag['over_slow']} frozen")
+
+    sort_keys = {
+        'total': lambda e: e['total_ms'],
+        'avg': lambda e: e['total_ms'] / max(e['count'], 1),
+        'max': lambda e: e['max_ms'],
+        'count': lambda e: e['count'],
+        'slow': lambda e: e['slow'],
+    }
+    entries = sorted(stats['handlers'].items(), key=lambda item: sort_keys[sort](item[1]), reverse=True)[:limit]
+
+    print(f"📊 {len(stats['handlers'])} callbacks, top {len(entries)} by {sort}")
+    print(f"{'Count':>8} {'Total ms':>10} {'Avg ms':>8} {'Max ms':>8} {'Slow':>6}  Callback")
+    for name, entry in entries:
+        print(f"{entry['count']:>8} {entry['total_ms']:>10.1f} {entry['total_ms'] / max(entry['count'], 1):>8.2f} "
+              f"{entry['max_ms']:>8.1f} {entry['slow']:>6}  {name}")
+        for stack, samples in entry['stacks'].items():
+            print(f"{'':>44}{samples} samples:")
+            for line in stack.splitlines():
+                print(f"{'':>46}{line}")
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else 'report'
+    if command == 'report':
+        sort = sys.argv[2] if len(sys.argv) > 2 else 'total'
+        if sort not in ('total', 'avg', 'max', 'count', 'slow'):
+            print("Sort by one of: total, avg, max, count, slow")
+            return False
+        print_report(sort, int(sys.argv[3]) if len(sys.argv) > 3 else 20)
+        return True
+    if command == 'reset':
+        if os.path.exists(STATS_FILE):
+            os.remove(STATS_FILE)
+        print(f"✅ Cleared {STATS_FILE}")
+        return True
+    print("Usage: python ui_profiler.py report [total|avg|max|count|slow] [limit] | reset")
+    return False
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -41,6 +41,18 @@ def find_descendants(selected_admin_uuid, admin_users, descendants=None, process
 def convert_non_ascii_to_ascii(input_text):
     return unidecode(input_text)
 
+# Arabic letters that Persian keyboards type differently, Persian and Arabic
+# digits, and the zero-width non-joiner, mapped to a single search form
+_SEARCH_CHAR_MAP = str.maketrans({
+    'ي': 'ی', 'ى': 'ی', 'ك': 'ک', 'ة': 'ه', '\u200c': ' ',
+    **{chr(0x06F0 + i): str(i) for i in range(10)},
+    **{chr(0x0660 + i): str(i) for i in range(10)},
+})
+
+def normalize_search_text(text):
+    """Lowercased text with Arabic/Persian letter and digit variants unified, for substring search"""
+    return (text or '').translate(_SEARCH_CHAR_MAP).casefold()
+
 def parse_date(date_string):
     if date_string is None:
         return None